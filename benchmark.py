@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Run every script against mock_featureserver.py and report requests,
+bytes and wall time per script and dataset size.
+
+  python benchmark.py --sizes 1000,100000 --json bench.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import importlib.util
+
+import requests
+
+import synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROD_HOST = "https://maps.sinarmasforestry.com"
+BENCH_ENV = {
+    "GIS_USER_ID": synthetic.DEFAULT_USER,
+    "GIS_AUTH_USERNAME": synthetic.DEFAULT_USER,
+    "GIS_AUTH_PASSWORD": "bench",
+    "GIS_USERNAME": "bench-editor",
+    "GIS_PASSWORD": "bench",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(size, seed, max_record_count, latency_ms, error_rate):
+    port = free_port()
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "mock_featureserver.py"),
+        "--port", str(port), "--features", str(size), "--seed", str(seed),
+        "--max-record-count", str(max_record_count),
+        "--latency-ms", str(latency_ms), "--error-rate", str(error_rate),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("mock server exited during startup")
+        try:
+            requests.get(f"{url}/__stats", timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("mock server did not start")
+
+
+def load_script(name, mock_url):
+    """Import a script as a fresh module with production URLs pointed at the mock."""
+    spec = importlib.util.spec_from_file_location(f"bench_{name}", os.path.join(HERE, f"{name}.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    for attr, val in list(vars(mod).items()):
+        if isinstance(val, str) and val.startswith(PROD_HOST):
+            setattr(mod, attr, mock_url + val[len(PROD_HOST):])
+    return mod
+
+
+def prepare_inputs(workdir, size, seed, feedback_rows):
+    """Pick an SPK with null heights and build the files the scripts read."""
+    rows, shapes = synthetic.generate_rows(size, seed)
+    null_spks = [r[2] for r in rows if r[5] is None and r[2].startswith("5")]
+    spk = null_spks[0] if null_spks else rows[0][2]
+    zip_path = os.path.join(workdir, f"{spk}.zip")
+    synthetic.write_kml_zip(zip_path, rows, shapes, spk, seed)
+    inputs = {"spk": spk, "zip": zip_path, "feedback": None}
+    try:
+        synthetic.write_feedback_xlsx(os.path.join(workdir, "feedback.xlsx"),
+                                      synthetic.pick_spks(rows, feedback_rows, seed))
+        inputs["feedback"] = "feedback.xlsx"
+    except ImportError:
+        pass
+    return inputs
+
+
+def script_plan(inputs):
+    """(script, argv) for every entry point; runner.py needs pandas for its sheet."""
+    plan = [
+        ("checknull", []),
+        ("checkduplicate", []),
+        ("checkduplicate", ["--pbf"]),
+        ("delete_by_spk", [inputs["spk"]]),
+        ("bulk_update_heights", [inputs["zip"], inputs["spk"]]),
+        ("bulk_update_heights", [inputs["zip"], inputs["spk"], "--calculate"]),
+        ("update_features_swap", []),
+        ("update_features_swap", ["--pbf"]),
+        ("delete", []),
+    ]
+    if inputs["feedback"]:
+        plan.append(("runner", []))
+        plan.append(("runner", ["--local"]))
+    return plan
+
+
+def run_script(name, argv, mock_url, workdir):
+    requests.post(f"{mock_url}/__reset")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    out = io.StringIO()
+    status = "ok"
+    try:
+        for path in (".token_cache.json", "feedback_checked.xlsx"):
+            if os.path.exists(path):
+                os.remove(path)
+        mod = load_script(name, mock_url)
+        if name == "delete":
+            token = requests.post(f"{mock_url}/portal/sharing/rest/generateToken",
+                                  data={"username": "bench", "f": "json"}).json()["token"]
+            mod.USER_ID, mod.QUERY_TOKEN, mod.DELETE_TOKEN = synthetic.DEFAULT_USER, token, token
+        sys.argv = [f"{name}.py", *argv]
+        requests.post(f"{mock_url}/__reset", params={"data": "false"})
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(out):
+            try:
+                mod.main()
+            except SystemExit as e:
+                if e.code:
+                    status = f"exit {e.code}"
+        wall = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    if status == "ok" and "❌" in out.getvalue():
+        status = "error: " + out.getvalue().split("❌", 1)[1].strip().splitlines()[0]
+    stats = requests.get(f"{mock_url}/__stats").json()
+    return {"wall_s": round(wall, 3), "status": status, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark all scripts against the offline mock FeatureServer")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated dataset sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scripts", help="comma-separated subset of scripts to run")
+    parser.add_argument("--max-record-count", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated per-request server latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of injected request failures")
+    parser.add_argument("--feedback-rows", type=int, default=200, help="rows in the runner.py feedback sheet")
+    parser.add_argument("--json", help="also write results to this JSON file")
+    args = parser.parse_args()
+
+    os.environ.update(BENCH_ENV)
+    only = set(args.scripts.split(",")) if args.scripts else None
+    results = []
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"\n== {size} features ==")
+        proc, url = start_server(size, args.seed, args.max_record_count, args.latency_ms, args.error_rate)
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                inputs = prepare_inputs(workdir, size, args.seed, args.feedback_rows)
+                for name, argv in script_plan(inputs):
+                    label = " ".join([name, *(a for a in argv if a.startswith("--"))])
+                    if only and name not in only:
+                        continue
+                    res = run_script(name, argv, url, workdir)
+                    tot = res["total"]
+                    print(f"{label:<36} {res['wall_s']:>9.3f}s {tot['requests']:>7} req "
+                          f"{tot['bytes_in']:>11} B sent {tot['bytes_out']:>12} B recv  {res['status']}")
+                    results.append({"size": size, "script": label, **res})
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
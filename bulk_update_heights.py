@@ -1,25 +1,44 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
+import csv
 import json
 import time
 import zipfile
 import tempfile
 import argparse
-import requests
-import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+from journal import Journal, journal_path, chunked, edits_payload, run_pending, rollback
+
 load_dotenv()
 
 # --- ENDPOINTS ---
-BASE_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
+BASE_URL = os.getenv("FDM_LAYER_URL", "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0")
 QUERY_URL = f"{BASE_URL}/query"
 EDIT_URL = f"{BASE_URL}/applyEdits"
-SERVER_URL = BASE_URL.replace('/FeatureServer/0', '/MapServer')
+CALC_URL = f"{BASE_URL}/calculate"
+# what an error body says when the layer has no calculate operation
+CALC_UNSUPPORTED = re.compile(r"not supported|unsupported|not enabled|invalid url", re.IGNORECASE)
+SERVER_URL = re.sub(r'/FeatureServer/\d+$', '/MapServer', BASE_URL)
 TOKEN_URL = "https://maps.sinarmasforestry.com/portal/sharing/rest/generateToken"
 TOKEN_CACHE_FILE = ".token_cache.json"
 
+# Max FlightIDs per calculate / null-height lookup WHERE clause (keeps the IN (...) list sane)
+CALC_BATCH_SIZE = 200
+
+# Multi-archive runs: per-folder manifests, and the SPK-in-file-name fallback
+MANIFESTS = ("manifest.json", "manifest.csv")
+DEFAULT_SPK_PATTERN = r"^(?P<spk>\d{6,})[_\-. ]"
+# where watch_heights.py moves finished archives; never picked up again
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+
 TOKEN_HEADERS = {
     "Content-Type": "application/x-www-form-urlencoded",
     "Referer": "https://maps.sinarmasforestry.com/UploadDroneManagements/",
@@ -101,6 +120,7 @@ def get_final_token(session):
 
 
 def parse_height_only(path):
+    import xml.etree.ElementTree as ET
     tree = ET.parse(path)
     root = tree.getroot()
     ext = next((el for el in root.iter() if el.tag.endswith("ExtendedData")), None)
@@ -122,6 +142,58 @@ def extract_flight_id_from_filename(fn):
     raise ValueError("cannot parse FlightID from filename")
 
 
+def parse_flight_id(path, fn):
+    import xml.etree.ElementTree as ET
+    try:
+        tree = ET.parse(path)
+        root = tree.getroot()
+        ext = next((el for el in root.iter() if el.tag.endswith("ExtendedData")), None)
+        if ext is not None:
+            for d in ext:
+                nm = d.attrib.get("name", "").lower()
+                if "flightid" in nm or "flight_controller_id" in nm:
+                    val = next((c.text for c in d if c.tag.endswith("value")), None)
+                    if val:
+                        return val.strip()
+    except Exception:
+        pass
+    return extract_flight_id_from_filename(fn)
+
+
+def collect_heights(folder, verbose=True):
+    """Parse every KML under folder into (filename, FlightID, Height) tuples."""
+    parsed = []
+    for root, _, files in os.walk(folder):
+        for fn in files:
+            if not fn.lower().endswith(".kml"):
+                continue
+            path = os.path.join(root, fn)
+
+            try:
+                height = parse_height_only(path)
+            except ValueError as e:
+                print(f"– skipping '{fn}': {e}")
+                continue
+
+            try:
+                fid = parse_flight_id(path, fn)
+            except ValueError:
+                print(f"– skipping '{fn}': cannot determine FlightID")
+                continue
+
+            if verbose:
+                print(f"Parsed '{fn}' → FlightID={fid}, Height={height}")
+            parsed.append((fn, fid, height))
+    return parsed
+
+
+def parse_archive(zip_path, verbose=True):
+    with tempfile.TemporaryDirectory() as tmp:
+        with zipfile.ZipFile(zip_path, "r") as z:
+            z.extractall(tmp)
+        return collect_heights(tmp, verbose)
+
+
 def query_null_heights(session, token, spk, flight_id):
     params = {
         "f": "json",
@@ -132,11 +204,53 @@ def query_null_heights(session, token, spk, flight_id):
     }
     r = session.get(QUERY_URL, params=params)
     r.raise_for_status()
-    return r.json().get("features", [])
+    js = r.json()
+    if "error" in js:
+        raise Exception(f"❌ Query failed: {js['error']}")
+    return js.get("features", [])
+
+
+def edit_headers(cookie):
+    return {
+        **TOKEN_HEADERS,
+        "Cookie": f'AGS_ROLES="{cookie}"',
+        "Origin": "https://maps.sinarmasforestry.com"
+    }
+
+
+def sql_in(values):
+    return ", ".join("'" + str(v).replace("'", "''") + "'" for v in values)
 
 
-def update_height(session, token, cookie, attrs, new_height):
-    updates = [{
+def calculate_heights(session, token, cookie, spk, flight_ids, new_height):
+    """Set Height server-side for every null-height feature of these flights.
+
+    Returns the updated feature count, or None when the server refuses the
+    calculate operation (older servers, or layers without it enabled). Any
+    other failure (an expired token, a server error) raises.
+    """
+    payload = {
+        "f": "json",
+        "token": token,
+        "where": f"SPKNumber='{spk}' AND FlightID IN ({sql_in(flight_ids)}) AND Height IS NULL",
+        "calcExpression": json.dumps([{"field": "Height", "value": new_height}])
+    }
+    r = session.post(CALC_URL, headers=edit_headers(cookie), data=payload)
+    if r.status_code in (400, 404, 405, 501):
+        return None
+    r.raise_for_status()
+    js = r.json()
+    if "error" in js:
+        if CALC_UNSUPPORTED.search(str(js["error"].get("message", ""))):
+            return None
+        raise Exception(f"❌ Calculate failed: {js['error']}")
+    if not js.get("success"):
+        raise Exception(f"❌ Calculate failed: {js}")
+    return js.get("updatedFeatureCount", 0)
+
+
+def height_update(attrs, new_height):
+    return {
         "attributes": {
             "OBJECTID": attrs["OBJECTID"],
             "SPKNumber": attrs["SPKNumber"],
@@ -144,91 +258,433 @@ def update_height(session, token, cookie, attrs, new_height):
             "CRT_Date": attrs["CRT_Date"],
             "Height": new_height
         }
-    }]
+    }
+
+
+def apply_edits(session, token, cookie, edits):
     payload = {
         "f": "json",
         "token": token,
-        "updates": json.dumps(updates)
+        **edits_payload(edits)
     }
-    headers = {
-        **TOKEN_HEADERS,
-        "Cookie": f'AGS_ROLES="{cookie}"',
-        "Origin": "https://maps.sinarmasforestry.com"
-    }
-    r = session.post(EDIT_URL, headers=headers, data=payload)
+    r = session.post(EDIT_URL, headers=edit_headers(cookie), data=payload)
     r.raise_for_status()
     return r.json()
 
 
+def plan_per_feature(session, token, spk, parsed, journal):
+    updates, before = [], []
+    for _, fid, height in parsed:
+        feats = query_null_heights(session, token, spk, fid)
+        if not feats:
+            print(f" → no null-height features for FlightID={fid}")
+            continue
+
+        for feat in feats:
+            attrs = feat["attributes"]
+            print(f" → OBJECTID={attrs['OBJECTID']} will be set to Height={height}")
+            updates.append(height_update(attrs, height))
+            before.append({"attributes": attrs})
+
+    for batch in chunked(list(zip(updates, before))):
+        journal.plan({"updates": [u for u, _ in batch]}, [b for _, b in batch])
+
+
+def plan_calculate(parsed, journal, spk=None):
+    by_height = defaultdict(list)
+    for _, fid, height in parsed:
+        if fid not in by_height[height]:
+            by_height[height].append(fid)
+
+    for height, fids in by_height.items():
+        for chunk in chunked(fids, CALC_BATCH_SIZE):
+            calc = {"height": height, "flight_ids": chunk}
+            if spk is not None:
+                calc["spk"] = spk
+            journal.plan({"calculate": calc})
+
+
+def make_apply(session, token, cookie, spk):
+    """applyEdits for planned updates; calculate (with fallback) for calculate batches."""
+    calc_supported = [True]
+
+    def apply(edits):
+        if "calculate" not in edits:
+            return apply_edits(session, token, cookie, edits)
+
+        height = edits["calculate"]["height"]
+        fids = edits["calculate"]["flight_ids"]
+        batch_spk = edits["calculate"].get("spk", spk)
+        if calc_supported[0]:
+            count = calculate_heights(session, token, cookie, batch_spk, fids, height)
+            if count is not None:
+                return {"success": True, "updatedFeatureCount": count}
+            print("calculate not supported by server, falling back to applyEdits …", end=" ")
+            calc_supported[0] = False
+
+        attrs_list = [f["attributes"] for f in query_null_heights_batch(session, token, batch_spk, fids)]
+        if not attrs_list:
+            return {"updateResults": []}
+        return apply_edits(session, token, cookie,
+                           {"updates": [height_update(attrs, height) for attrs in attrs_list]})
+
+    return apply
+
+
+def process_archive(session, token, zip_path, spk, journal, apply, calculate=False, prof=None):
+    """Parse one KML ZIP, journal its plan and apply it."""
+    prof = prof or Profiler("bulk_update_heights")
+    with prof.phase("parse"):
+        parsed = parse_archive(zip_path)
+
+    # per-feature planning includes the null-height lookups
+    with prof.phase("plan"):
+        journal.start("bulk_update_heights", {
+            "zipfile": zip_path, "spk": spk, "calculate": calculate
+        })
+        if calculate:
+            plan_calculate(parsed, journal)
+        else:
+            plan_per_feature(session, token, spk, parsed, journal)
+
+    with prof.phase("edit"):
+        run_pending(journal, apply)
+
+
+# --- multi-archive runs ---
+
+def read_manifest(path):
+    """[(zip path, SPK)] from a JSON ({"a.zip": "5000012345"}) or CSV (zipfile,spk) manifest.
+
+    Relative zip paths are taken relative to the manifest's folder.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith(".json"):
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            pairs = list(data.items())
+        else:
+            pairs = [(d["zipfile"], d["spk"]) for d in data]
+    else:
+        pairs = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+                archive = row.get("zipfile") or row.get("file") or row.get("archive")
+                if archive and row.get("spk"):
+                    pairs.append((archive, row["spk"]))
+    return [(os.path.join(base, z), str(spk)) for z, spk in pairs]
+
+
+def load_manifest(folder):
+    """archive file name → SPK from manifest.json / manifest.csv in folder, if any."""
+    mapping = {}
+    for name in MANIFESTS:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            mapping.update((os.path.basename(z), spk) for z, spk in read_manifest(path))
+    return mapping
+
+
+def infer_spk(root, path, manifest, pattern):
+    """SPK of an archive under root: manifest entry, then sub-folder name, then file name pattern."""
+    name = os.path.basename(path)
+    if name in manifest:
+        return manifest[name]
+    parent = os.path.relpath(os.path.dirname(path), root)
+    if parent != ".":
+        return parent.split(os.sep)[0]
+    m = pattern.search(name)
+    if m:
+        return m.group("spk") if "spk" in pattern.groupindex else m.group(0)
+    return None
+
+
+def find_archives(folder, spk_pattern=DEFAULT_SPK_PATTERN):
+    """[(zip path, SPK or None)] for the ZIPs in folder and its direct sub-folders (but done/ and failed/)."""
+    manifest = load_manifest(folder)
+    pattern = re.compile(spk_pattern)
+    paths = []
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if entry.is_dir():
+            if entry.name in (DONE_DIR, FAILED_DIR):
+                continue
+            paths.extend(os.path.join(entry.path, fn) for fn in sorted(os.listdir(entry.path))
+                         if fn.lower().endswith(".zip"))
+        elif entry.name.lower().endswith(".zip"):
+            paths.append(entry.path)
+    return [(path, infer_spk(folder, path, manifest, pattern)) for path in paths]
+
+
+def parse_archives(paths, jobs=None):
+    """{zip path: [(filename, FlightID, Height)] or the exception} through one process pool."""
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(parse_archive, path, False): path for path in paths}
+        for fut in as_completed(futures):
+            path = futures[fut]
+            try:
+                results[path] = fut.result()
+            except Exception as e:
+                results[path] = e
+    return results
+
+
+def query_null_heights_batch(session, token, spk, flight_ids):
+    """Null-height features of many flights of one SPK, following exceededTransferLimit."""
+    feats, offset = [], 0
+    while True:
+        r = session.post(QUERY_URL, data={
+            "f": "json",
+            "where": f"SPKNumber='{spk}' AND FlightID IN ({sql_in(flight_ids)}) AND Height IS NULL",
+            "outFields": "OBJECTID,FlightID,SPKNumber,KeyID,CRT_Date,Height",
+            "returnGeometry": "false",
+            "orderByFields": "OBJECTID",
+            "resultOffset": offset,
+            "token": token
+        })
+        r.raise_for_status()
+        js = r.json()
+        if "error" in js:
+            raise Exception(f"❌ Query failed: {js['error']}")
+        page = js.get("features", [])
+        feats.extend(page)
+        if not page or not js.get("exceededTransferLimit"):
+            return feats
+        offset += len(page)
+
+
+def merge_flights(archives, parsed):
+    """{spk: [(filename, FlightID, Height)]}, one entry per flight; later archives win."""
+    flights = defaultdict(dict)
+    for path, spk in archives:
+        result = parsed.get(path)
+        if not spk or isinstance(result, Exception) or result is None:
+            continue
+        for fn, fid, height in result:
+            prev = flights[spk].get(fid)
+            if prev and prev[2] != height:
+                print(f"⚠️  SPK {spk} FlightID={fid}: Height {prev[2]} from '{prev[0]}' "
+                      f"replaced by {height} from '{fn}'")
+            flights[spk][fid] = (fn, fid, height)
+    return {spk: list(by_fid.values()) for spk, by_fid in flights.items()}
+
+
+def plan_many(session, token, flights, journal, calculate=False):
+    """Journal the edits for {spk: parsed flights} with one null-height lookup per CALC_BATCH_SIZE flights."""
+    if calculate:
+        for spk, parsed in flights.items():
+            plan_calculate(parsed, journal, spk)
+        return
+
+    updates, before = [], []
+    for spk, parsed in flights.items():
+        heights = {fid: height for _, fid, height in parsed}
+        found = 0
+        for chunk in chunked(list(heights), CALC_BATCH_SIZE):
+            for feat in query_null_heights_batch(session, token, spk, chunk):
+                attrs = feat["attributes"]
+                updates.append(height_update(attrs, heights[attrs["FlightID"]]))
+                before.append({"attributes": attrs})
+                found += 1
+        print(f"SPK {spk}: {len(parsed)} flights parsed, {found} null-height features to update")
+
+    for batch in chunked(list(zip(updates, before))):
+        journal.plan({"updates": [u for u, _ in batch]}, [b for _, b in batch])
+
+
+def batch_report(journal):
+    """{spk: {"updated": set, "failed": set, "features": n}} from the journal's batches and results.
+
+    calculate batches do not say which of their flights had NULL Height, so
+    every flight of a successful one counts as updated.
+    """
+    out = defaultdict(lambda: {"updated": set(), "failed": set(), "features": 0})
+    for batch, rec in sorted(journal.plans.items()):
+        result = journal.done.get(batch)
+        ok = isinstance(result, dict) and "error" not in result
+        calc = rec["edits"].get("calculate")
+        if calc:
+            r = out[calc.get("spk")]
+            if not ok:
+                r["failed"].update(calc["flight_ids"])
+                continue
+            r["updated"].update(calc["flight_ids"])
+            r["features"] += result.get("updatedFeatureCount",
+                                        sum(1 for u in result.get("updateResults", []) if u.get("success")))
+            continue
+
+        owner = {b["attributes"]["OBJECTID"]: (b["attributes"]["SPKNumber"], b["attributes"].get("FlightID"))
+                 for b in rec.get("before", [])}
+        results = {u.get("objectId"): u.get("success") for u in (result or {}).get("updateResults", [])}
+        for oid, (spk, fid) in owner.items():
+            if ok and results.get(oid):
+                out[spk]["updated"].add(fid)
+                out[spk]["features"] += 1
+            else:
+                out[spk]["failed"].add(fid)
+    return out
+
+
+def consolidated_report(archives, parsed, flights, journal):
+    """One row per SPK: archives, flights updated / skipped (no NULL Height) / failed, features updated."""
+    batches = batch_report(journal)
+    rows = {}
+    for path, spk in archives:
+        row = rows.setdefault(spk or "?", {"spk": spk or "?", "archives": 0, "failed_archives": 0,
+                                           "flights": 0, "updated": 0, "skipped": 0, "failed": 0,
+                                           "features": 0})
+        row["archives"] += 1
+        if not spk or isinstance(parsed.get(path), Exception):
+            row["failed_archives"] += 1
+    for spk in set(flights) | set(batches):
+        row = rows.setdefault(spk, {"spk": spk, "archives": 0, "failed_archives": 0, "flights": 0,
+                                    "updated": 0, "skipped": 0, "failed": 0, "features": 0})
+        fids = {fid for _, fid, _ in flights.get(spk, [])}
+        b = batches.get(spk, {"updated": set(), "failed": set(), "features": 0})
+        failed = b["failed"] - b["updated"]
+        row["flights"] = len(fids | b["updated"] | failed)
+        row["updated"] = len(b["updated"])
+        row["failed"] = len(failed)
+        row["skipped"] = len(fids - b["updated"] - failed)
+        row["features"] = b["features"]
+    return [rows[k] for k in sorted(rows)]
+
+
+def print_report(rows, path=None):
+    cols = ("spk", "archives", "failed_archives", "flights", "updated", "skipped", "failed", "features")
+    print(f"\n{'SPKNumber':<14}{'archives':>9}{'bad zip':>9}{'flights':>9}{'updated':>9}"
+          f"{'skipped':>9}{'failed':>8}{'features':>10}")
+    for r in rows:
+        print(f"{r['spk']:<14}{r['archives']:>9}{r['failed_archives']:>9}{r['flights']:>9}"
+              f"{r['updated']:>9}{r['skipped']:>9}{r['failed']:>8}{r['features']:>10}")
+    if path:
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=cols)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\n✅ Report written to {path}")
+
+
+def process_many(session, token, archives, journal, apply, calculate=False, jobs=None, prof=None):
+    """Parse every (zip, spk) in one pool, plan one batched update for all of them and apply it.
+
+    Returns the consolidated per-SPK report rows.
+    """
+    prof = prof or Profiler("bulk_update_heights")
+    with prof.phase("parse"):
+        parsed = parse_archives(sorted({path for path, spk in archives if spk}), jobs)
+    for path, spk in archives:
+        if not spk:
+            print(f"❌ {path}: no SPKNumber")
+        elif isinstance(parsed.get(path), Exception):
+            print(f"❌ {path}: {parsed[path]}")
+    flights = merge_flights(archives, parsed)
+
+    with prof.phase("plan"):
+        journal.start("bulk_update_heights", {
+            "archives": [[path, spk] for path, spk in archives], "calculate": calculate
+        })
+        plan_many(session, token, flights, journal, calculate)
+
+    try:
+        with prof.phase("edit"):
+            run_pending(journal, apply)
+    except Exception as e:
+        # the remaining batches are reported as failed; --resume picks them up
+        print(f"\n❌ Error: {e}")
+    return consolidated_report(archives, parsed, flights, journal)
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Bulk-update Height from KMLs in ZIP for one SPKNumber"
+        description="Bulk-update Height from KMLs in ZIP for one SPKNumber, "
+                    "or from many ZIPs listed in a manifest or dropped in a folder"
     )
-    parser.add_argument("zipfile", help="ZIP containing KML files")
-    parser.add_argument("spk", help="SPKNumber for all these KMLs")
+    parser.add_argument("zipfile", nargs="?",
+                        help="ZIP containing KML files, or a folder of ZIPs (SPK from manifest.json/"
+                             "manifest.csv, SPK-named sub-folders or the file name)")
+    parser.add_argument("spk", nargs="?", help="SPKNumber for all these KMLs")
+    parser.add_argument("--manifest", metavar="PATH",
+                        help="CSV (zipfile,spk columns) or JSON ({\"a.zip\": \"spk\"}) list of ZIPs "
+                             "to process in one run")
+    parser.add_argument("--jobs", type=int,
+                        help="parse processes for multi-archive runs (default: CPU count)")
+    parser.add_argument("--report", metavar="PATH",
+                        help="also write the per-SPK report of a multi-archive run as CSV")
+    parser.add_argument("--calculate", action="store_true",
+                        help="set Height server-side with one calculate call per distinct height "
+                             "(falls back to batched applyEdits if unsupported)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the unfinished batches of the last run from its journal")
+    parser.add_argument("--rollback", action="store_true",
+                        help="restore the Height values overwritten by the last run, from its journal "
+                             "(--calculate runs keep no snapshot and cannot be restored)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    session = requests.Session()
+    archives = None
+    if args.manifest:
+        archives = read_manifest(args.manifest)
+        source = args.manifest
+    elif args.zipfile and os.path.isdir(args.zipfile):
+        archives = find_archives(args.zipfile)
+        if args.spk:
+            archives = [(path, args.spk) for path, _ in archives]
+        source = args.zipfile
+    elif not args.zipfile or not args.spk:
+        parser.error("give a ZIP and its SPKNumber, a folder of ZIPs, or --manifest")
+
+    if archives is not None:
+        key = ("manifest", os.path.basename(os.path.normpath(source)))
+    else:
+        key = (args.spk, os.path.basename(args.zipfile))
+
+    session = InstrumentedSession("bulk_update_heights")
+    journal = Journal(journal_path("bulk_update_heights", *key))
+    prof = Profiler.from_args("bulk_update_heights", args)
+    prof.start()
 
     try:
-        token, cookie = get_final_token(session)
-
-        with tempfile.TemporaryDirectory() as tmp:
-            with zipfile.ZipFile(args.zipfile, "r") as z:
-                z.extractall(tmp)
-
-            for _, _, files in os.walk(tmp):
-                for fn in files:
-                    if not fn.lower().endswith(".kml"):
-                        continue
-                    path = os.path.join(tmp, fn)
-
-                    try:
-                        height = parse_height_only(path)
-                    except ValueError as e:
-                        print(f"– skipping '{fn}': {e}")
-                        continue
-
-                    # Attempt to get FlightID
-                    try:
-                        tree = ET.parse(path)
-                        root = tree.getroot()
-                        ext = next((el for el in root.iter() if el.tag.endswith("ExtendedData")), None)
-                        fid = None
-                        if ext is not None:
-                            for d in ext:
-                                nm = d.attrib.get("name", "").lower()
-                                if "flightid" in nm or "flight_controller_id" in nm:
-                                    val = next((c.text for c in d if c.tag.endswith("value")), None)
-                                    if val:
-                                        fid = val.strip()
-                                        break
-                        if not fid:
-                            raise ValueError
-                    except Exception:
-                        try:
-                            fid = extract_flight_id_from_filename(fn)
-                        except ValueError:
-                            print(f"– skipping '{fn}': cannot determine FlightID")
-                            continue
-
-                    print(f"Parsed '{fn}' → FlightID={fid}, Height={height}")
-
-                    feats = query_null_heights(session, token, args.spk, fid)
-                    if not feats:
-                        print(f" → no null-height features for FlightID={fid}")
-                        continue
-
-                    for feat in feats:
-                        oid = feat["attributes"]["OBJECTID"]
-                        print(f" → updating OBJECTID={oid} to Height={height}")
-                        resp = update_height(session, token, cookie, feat["attributes"], height)
-                        print("    response:", resp)
+        with prof.phase("auth"):
+            token, cookie = get_final_token(session)
+        apply = make_apply(session, token, cookie, args.spk)
+
+        if args.rollback:
+            with prof.phase("edit"):
+                n = rollback(journal, apply)
+            print(f"\n✅ Reverted {n} batches.")
+            return
+
+        if args.resume and journal.exists():
+            print(f"Resuming {len(journal.pending())} of {len(journal.plans)} batches from {journal.path}")
+            with prof.phase("edit"):
+                run_pending(journal, apply)
+            if archives is not None:
+                print_report(consolidated_report([], {}, {}, journal), args.report)
+        elif archives is not None:
+            if not archives:
+                print(f"❌ No ZIP archives in {source}")
+                sys.exit(1)
+            print(f"Processing {len(archives)} archives from {source}")
+            rows = process_many(session, token, archives, journal, apply, calculate=args.calculate,
+                                jobs=args.jobs, prof=prof)
+            with prof.phase("write-output"):
+                print_report(rows, args.report)
+            if any(r["failed"] or r["failed_archives"] for r in rows):
+                sys.exit(1)
+        else:
+            process_archive(session, token, args.zipfile, args.spk, journal, apply,
+                            calculate=args.calculate, prof=prof)
 
     except Exception as e:
         print(f"\n❌ Error: {e}")
         sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,17 +1,33 @@
 import os
+import re
+import sys
+import csv
 import json
+import math
 import time
-import requests
+import argparse
 from collections import defaultdict
 from dotenv import load_dotenv
 
+import pbf
+import fastjson
+from query_planner import fetch_features
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+from journal import Journal, journal_path, chunked, edits_payload, fetch_snapshot, run_pending, rollback
+
 load_dotenv()
 
-BASE_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
-SERVER_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/MapServer"
+BASE_URL = os.getenv('FDM_LAYER_URL', "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0")
+SERVER_URL = re.sub(r'/FeatureServer/\d+$', '/MapServer', BASE_URL)
 TOKEN_URL = "https://maps.sinarmasforestry.com/portal/sharing/rest/generateToken"
 TOKEN_CACHE_FILE = ".token_cache.json"
 
+# --geometry: re-upload detection on footprints
+OVERLAP_THRESHOLD = 0.9
+MAX_ALLOWABLE_OFFSET = 0.00001
+OVERLAP_FILE = 'overlapping_flights.csv'
+
 TOKEN_HEADERS = {
     'Content-Type': 'application/x-www-form-urlencoded',
     'Referer': 'https://maps.sinarmasforestry.com/UploadDroneManagements/',
@@ -96,21 +112,72 @@ def get_final_token(session):
     return token, cookie
 
 
-def fetch_all_features(session, token, user_id):
+def fetch_all_features(session, token, user_id, use_pbf=False):
+    return fetch_features(session, BASE_URL, token, f"UserID='{user_id}'",
+                          'OBJECTID,FlightID,SPKNumber,CRT_Date', use_pbf=use_pbf)
+
+
+def fetch_footprints(session, token, user_id, max_offset, use_pbf=False):
+    """Every feature of user_id with a generalized, low-precision polygon, paged by OBJECTID."""
     params = {
         'f': 'json',
         'where': f"UserID='{user_id}'",
         'outFields': 'OBJECTID,FlightID,SPKNumber,CRT_Date',
-        'returnGeometry': 'false',
+        'returnGeometry': 'true',
+        'maxAllowableOffset': max_offset,
+        'orderByFields': 'OBJECTID',
+        'geometryPrecision': max(0, -math.floor(math.log10(max_offset))),
         'token': token,
-        'resultRecordCount': 10000,
     }
-    resp = session.get(f"{BASE_URL}/query", params=params)
-    resp.raise_for_status()
-    return resp.json().get('features', [])
+    # integer coordinates only where pbf.decode dequantizes them, never on the f=json fallback
+    quantized = {'quantizationParameters': fastjson.dumps(
+        {'mode': 'view', 'originPosition': 'upperLeft', 'tolerance': max_offset})}
+
+    features, offset = [], 0
+    while True:
+        js = pbf.query(session, f"{BASE_URL}/query", {**params, 'resultOffset': offset},
+                       pbf=use_pbf, pbf_params=quantized)
+        if 'error' in js:
+            raise Exception(f"❌ Query failed: {js['error']}")
+        page = js.get('features', [])
+        features.extend(page)
+        if not page or not js.get('exceededTransferLimit'):
+            return features
+        offset += len(page)
+
 
+def find_overlaps(features, threshold):
+    """Same-SPK pairs with different FlightIDs whose footprints overlap by at least threshold, older first."""
+    # only --geometry gets here; footprints pulls in shapely (and numpy) when installed
+    from footprints import make_footprint, overlapping_pairs
+    attrs, fps = {}, []
+    for feat in features:
+        a = feat['attributes']
+        attrs[a['OBJECTID']] = a
+        fp = make_footprint(a['OBJECTID'], a['SPKNumber'], feat.get('geometry'))
+        if fp:
+            fps.append(fp)
+    rows = []
+    for a, b, ratio in overlapping_pairs(fps, threshold):
+        older, newer = sorted((attrs[a.oid], attrs[b.oid]), key=lambda x: (x['CRT_Date'] or 0, x['OBJECTID']))
+        if older['FlightID'] == newer['FlightID']:
+            continue
+        rows.append((older, newer, ratio))
+    rows.sort(key=lambda r: (r[0]['SPKNumber'], r[0]['OBJECTID']))
+    return rows
 
-def delete_objectid(session, token, cookie, oid):
+
+def write_overlaps(rows, path):
+    with open(path, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['SPKNumber', 'older_OBJECTID', 'older_FlightID', 'older_CRT_Date',
+                    'newer_OBJECTID', 'newer_FlightID', 'newer_CRT_Date', 'overlap'])
+        for older, newer, ratio in rows:
+            w.writerow([older['SPKNumber'], older['OBJECTID'], older['FlightID'], older['CRT_Date'],
+                        newer['OBJECTID'], newer['FlightID'], newer['CRT_Date'], f"{ratio:.4f}"])
+
+
+def apply_edits(session, token, cookie, edits):
     headers = {
         **TOKEN_HEADERS,
         'Origin': 'https://maps.sinarmasforestry.com',
@@ -118,56 +185,138 @@ def delete_objectid(session, token, cookie, oid):
     }
     data = {
         'f': 'json',
-        'deletes': str(oid),
         'token': token,
+        **edits_payload(edits),
     }
     r = session.post(f"{BASE_URL}/applyEdits", headers=headers, data=data)
     r.raise_for_status()
     return r.json()
 
 
+def plan_duplicates(session, token, user_id, features, journal):
+    groups = defaultdict(list)
+    for feat in features:
+        attr = feat['attributes']
+        groups[attr['FlightID']].append(attr)
+
+    to_delete = []
+    for fid, attrs in groups.items():
+        if len(attrs) <= 1:
+            continue
+        sorted_by_date = sorted(attrs, key=lambda a: a['CRT_Date'], reverse=True)
+        for d in sorted_by_date[1:]:
+            to_delete.append(d['OBJECTID'])
+
+    if not to_delete:
+        return []
+
+    print(f"Found {len(to_delete)} duplicates to delete:\n{to_delete}\n")
+
+    journal.start('checkduplicate', {'user_id': user_id})
+    for batch in chunked(to_delete):
+        before = fetch_snapshot(session, f"{BASE_URL}/query", token, batch)
+        journal.plan({'deletes': batch}, before)
+    return to_delete
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Delete older duplicate features per FlightID")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the unfinished batches of the last run from its journal")
+    parser.add_argument('--rollback', action='store_true',
+                        help="re-add the features deleted by the last run, from its journal")
+    parser.add_argument('--pbf', action='store_true',
+                        help="pull features as f=pbf (falls back to JSON if the server refuses)")
+    parser.add_argument('--geometry', action='store_true',
+                        help="instead, report same-SPK flights with different FlightIDs whose footprints "
+                             "overlap (re-uploads); nothing is deleted")
+    parser.add_argument('--overlap', type=float, default=OVERLAP_THRESHOLD,
+                        help=f"--geometry: minimum intersection/union ratio (default: {OVERLAP_THRESHOLD})")
+    parser.add_argument('--max-offset', type=float, default=MAX_ALLOWABLE_OFFSET,
+                        help="--geometry: maxAllowableOffset / quantization tolerance in layer units "
+                             f"(default: {MAX_ALLOWABLE_OFFSET})")
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help="instead, list the duplicates in a Parquet snapshot from export_parquet.py; "
+                             "nothing is deleted")
+    parser.add_argument('--output', default=OVERLAP_FILE,
+                        help=f"--geometry: CSV of the overlapping pairs (default: {OVERLAP_FILE})")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
     user_id = os.getenv('GIS_USER_ID')
     if not user_id:
         print("❌ Please set GIS_USER_ID in your .env")
-        return
+        sys.exit(1)
 
-    session = requests.Session()
+    session = InstrumentedSession('checkduplicate')
+    journal = Journal(journal_path('checkduplicate', user_id))
+    prof = Profiler.from_args('checkduplicate', args)
+    prof.start()
 
     try:
-        token, cookie = get_final_token(session)
-        print("Fetching all features…")
-        features = fetch_all_features(session, token, user_id)
-        print(f" → Retrieved {len(features)} records")
-
-        groups = defaultdict(list)
-        for feat in features:
-            attr = feat['attributes']
-            groups[attr['FlightID']].append(attr)
-
-        to_delete = []
-        for fid, attrs in groups.items():
-            if len(attrs) <= 1:
-                continue
-            sorted_by_date = sorted(attrs, key=lambda a: a['CRT_Date'], reverse=True)
-            for d in sorted_by_date[1:]:
-                to_delete.append(d['OBJECTID'])
-
-        if not to_delete:
-            print("✅ No duplicates found.")
+        if args.snapshot:
+            from export_parquet import snapshot_duplicates
+            with prof.phase('plan'):
+                to_delete = snapshot_duplicates(args.snapshot)
+            if not to_delete:
+                print(f"✅ No duplicates in {args.snapshot}.")
+                return
+            print(f"Found {len(to_delete)} duplicates in {args.snapshot} (not deleted):\n{to_delete}")
             return
 
-        print(f"Found {len(to_delete)} duplicates to delete:\n{to_delete}\n")
+        with prof.phase('auth'):
+            token, cookie = get_final_token(session)
+        apply = lambda edits: apply_edits(session, token, cookie, edits)
+
+        if args.geometry:
+            print("Fetching all footprints…")
+            with prof.phase('fetch'):
+                features = fetch_footprints(session, token, user_id, args.max_offset, args.pbf)
+            print(f" → Retrieved {len(features)} records")
+            with prof.phase('plan'):
+                overlaps = find_overlaps(features, args.overlap)
+            if not overlaps:
+                print("✅ No overlapping flights found.")
+                return
+            with prof.phase('write-output'):
+                for older, newer, ratio in overlaps:
+                    print(f"SPK {older['SPKNumber']}: {older['FlightID']} (OBJECTID {older['OBJECTID']}) ≈ "
+                          f"{newer['FlightID']} (OBJECTID {newer['OBJECTID']}), overlap {ratio:.1%}")
+                write_overlaps(overlaps, args.output)
+            print(f"\n⚠️  {len(overlaps)} overlapping pairs written to {args.output}")
+            return
+
+        if args.rollback:
+            with prof.phase('edit'):
+                n = rollback(journal, apply)
+            print(f"\n✅ Reverted {n} batches.")
+            return
+
+        if args.resume and journal.exists():
+            print(f"Resuming {len(journal.pending())} of {len(journal.plans)} batches from {journal.path}")
+        else:
+            print("Fetching all features…")
+            with prof.phase('fetch'):
+                features = fetch_all_features(session, token, user_id, args.pbf)
+            print(f" → Retrieved {len(features)} records")
+
+            with prof.phase('plan'):
+                planned = plan_duplicates(session, token, user_id, features, journal)
+            if not planned:
+                print("✅ No duplicates found.")
+                return
 
-        for oid in to_delete:
-            print(f"> Deleting OBJECTID={oid} …", end=" ")
-            resp = delete_objectid(session, token, cookie, oid)
-            print(resp)
+        with prof.phase('edit'):
+            run_pending(journal, apply)
 
         print("\n✅ Duplicate cleanup complete.")
     except Exception as e:
         print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
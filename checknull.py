@@ -1,14 +1,21 @@
 import os
+import re
+import sys
 import json
 import time
-import requests
+import argparse
 from dotenv import load_dotenv
 
+from http_metrics import InstrumentedSession
+from layers import service_url, query_layers
+from query_planner import fetch_statistics
+from profiler import Profiler, add_profile_arguments
+
 load_dotenv()
 
-BASE_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
+BASE_URL = os.getenv('FDM_LAYER_URL', "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0")
 QUERY_URL = f"{BASE_URL}/query"
-SERVER_URL = BASE_URL.replace('/FeatureServer/0', '/MapServer')
+SERVER_URL = re.sub(r'/FeatureServer/\d+$', '/MapServer', BASE_URL)
 TOKEN_URL = "https://maps.sinarmasforestry.com/portal/sharing/rest/generateToken"
 TOKEN_CACHE_FILE = ".token_cache.json"
 
@@ -94,40 +101,90 @@ def get_final_token(session):
 
 
 def fetch_null_height_spks(session, token, user_id):
-    params = {
-        'f': 'json',
-        'where': f"(UserID='{user_id}') AND Height IS NULL",
-        'resultRecordCount': 10000,
-        'outFields': 'SPKNumber',
-        'returnGeometry': 'false',
-        'token': token
-    }
-    r = session.get(QUERY_URL, params=params)
-    r.raise_for_status()
-    return [feat['attributes']['SPKNumber'] for feat in r.json().get('features', [])]
+    # one row per SPKNumber instead of one per feature
+    rows = fetch_statistics(session, BASE_URL, token, f"(UserID='{user_id}') AND Height IS NULL",
+                            [{'statisticType': 'count', 'onStatisticField': 'OBJECTID',
+                              'outStatisticFieldName': 'nulls'}], ['SPKNumber'])
+    return [row['SPKNumber'] for row in rows]
+
+
+def fetch_null_height_spks_by_layer(session, token, user_id, layer_ids):
+    """{layer id: SPKNumbers with NULL Height} for several layers of the service at once."""
+    where = f"(UserID='{user_id}') AND Height IS NULL"
+    results = query_layers(session, service_url(BASE_URL), token,
+                           {layer_id: where for layer_id in layer_ids}, out_fields='SPKNumber')
+    return {layer_id: [feat['attributes']['SPKNumber'] for feat in res.get('features', [])]
+            for layer_id, res in results.items()}
 
 
 def main():
+    parser = argparse.ArgumentParser(description="List SPKNumbers that still have NULL Height")
+    parser.add_argument('--layers', metavar='IDS',
+                        help="comma-separated layer ids of the FeatureServer to check in one request "
+                             "(default: only the configured layer)")
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help="read a Parquet snapshot from export_parquet.py instead of querying the layer")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
     user_id = os.getenv('GIS_USER_ID')
     if not user_id:
         print("❌ Please set GIS_USER_ID in your .env")
-        return
+        sys.exit(1)
 
-    session = requests.Session()
+    session = InstrumentedSession('checknull')
+    prof = Profiler.from_args('checknull', args)
+    prof.start()
     try:
-        token, _ = get_final_token(session)
-        spks = fetch_null_height_spks(session, token, user_id)
-        unique_spks = sorted(set(spks))
+        if args.snapshot:
+            from export_parquet import snapshot_null_height_spks
+            with prof.phase('parse'):
+                unique_spks = sorted(set(snapshot_null_height_spks(args.snapshot, user_id)))
+            if not unique_spks:
+                print(f"✅ No SPKNumbers with NULL Height in {args.snapshot}.")
+                return
+            with prof.phase('write-output'):
+                print(f"SPKNumbers with NULL Height in {args.snapshot}:")
+                for spk in unique_spks:
+                    print(spk)
+            return
+
+        with prof.phase('auth'):
+            token, _ = get_final_token(session)
+        if args.layers:
+            layer_ids = [int(i) for i in args.layers.split(',') if i.strip()]
+            with prof.phase('fetch'):
+                by_layer = fetch_null_height_spks_by_layer(session, token, user_id, layer_ids)
+            with prof.phase('write-output'):
+                for layer_id in layer_ids:
+                    unique_spks = sorted(set(by_layer[layer_id]))
+                    if not unique_spks:
+                        print(f"✅ Layer {layer_id}: no SPKNumbers with NULL Height found.")
+                        continue
+                    print(f"Layer {layer_id} SPKNumbers with NULL Height:")
+                    for spk in unique_spks:
+                        print(spk)
+            return
+
+        with prof.phase('fetch'):
+            spks = fetch_null_height_spks(session, token, user_id)
+        with prof.phase('plan'):
+            unique_spks = sorted(set(spks))
 
         if not unique_spks:
             print("✅ No SPKNumbers with NULL Height found.")
             return
 
-        print("SPKNumbers with NULL Height:")
-        for spk in unique_spks:
-            print(spk)
+        with prof.phase('write-output'):
+            print("SPKNumbers with NULL Height:")
+            for spk in unique_spks:
+                print(spk)
     except Exception as e:
         print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 
 if __name__ == '__main__':
@@ -1,5 +1,8 @@
-import requests
 import sys
+import argparse
+
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
 
 # --- CONFIG --- 
 USER_ID        = ''
@@ -11,7 +14,7 @@ COOKIE_VALUE   = ''
 
 BASE_URL       = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
 
-def fetch_zero_spk_objectids():
+def fetch_zero_spk_objectids(session):
     """Fetch all OBJECTIDs for SPKNumber starting '0'."""
     params = {
         'f': 'json',
@@ -21,11 +24,11 @@ def fetch_zero_spk_objectids():
         'returnGeometry':   'false',
         'token':            QUERY_TOKEN,
     }
-    r = requests.get(f"{BASE_URL}/query", params=params)
+    r = session.get(f"{BASE_URL}/query", params=params)
     r.raise_for_status()
     return [feat['attributes']['OBJECTID'] for feat in r.json().get('features', [])]
 
-def delete_objectid(objectid):
+def delete_objectid(session, objectid):
     """Delete a single OBJECTID using the EDIT token."""
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
@@ -39,23 +42,36 @@ def delete_objectid(objectid):
         'deletes': str(objectid),
         'token':   DELETE_TOKEN,
     }
-    r = requests.post(f"{BASE_URL}/applyEdits", headers=headers, data=data)
+    r = session.post(f"{BASE_URL}/applyEdits", headers=headers, data=data)
     r.raise_for_status()
     return r.json()
 
 def main():
-    oids = fetch_zero_spk_objectids()
-    if not oids:
-        print("No SPKNumber '0*' features found.")
-        return
-    
-    print(f"Found {len(oids)} OBJECTIDs to delete:\n{oids}\n")
-    for oid in oids:
-        print(f"> Deleting OBJECTID={oid} …", end=" ")
-        resp = delete_objectid(oid)
-        print(resp)
-
-    print("\n✅ All done.")
+    parser = argparse.ArgumentParser(description="Delete features whose SPKNumber is '0'")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    session = InstrumentedSession('delete')
+    prof = Profiler.from_args('delete', args)
+    prof.start()
+    try:
+        with prof.phase('fetch'):
+            oids = fetch_zero_spk_objectids(session)
+        if not oids:
+            print("No SPKNumber '0*' features found.")
+            return
+
+        print(f"Found {len(oids)} OBJECTIDs to delete:\n{oids}\n")
+        with prof.phase('edit'):
+            for oid in oids:
+                print(f"> Deleting OBJECTID={oid} …", end=" ")
+                resp = delete_objectid(session, oid)
+                print(resp)
+
+        print("\n✅ All done.")
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 if __name__ == '__main__':
     main()
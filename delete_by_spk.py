@@ -1,14 +1,20 @@
 import os
+import re
 import sys
 import json
 import time
-import requests
+import argparse
 from dotenv import load_dotenv
 
+from http_metrics import InstrumentedSession
+from query_planner import fetch_ids
+from profiler import Profiler, add_profile_arguments
+from journal import Journal, journal_path, chunked, edits_payload, fetch_snapshot, run_pending, rollback
+
 load_dotenv()
 
-BASE_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
-SERVER_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/MapServer"
+BASE_URL = os.getenv('FDM_LAYER_URL', "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0")
+SERVER_URL = re.sub(r'/FeatureServer/\d+$', '/MapServer', BASE_URL)
 TOKEN_URL = "https://maps.sinarmasforestry.com/portal/sharing/rest/generateToken"
 TOKEN_CACHE_FILE = ".token_cache.json"
 
@@ -95,27 +101,19 @@ def get_final_token(session):
 
 
 def fetch_objectids_for_spk(session, token, spk):
-    params = {
-        'f': 'json',
-        'where': f"SPKNumber='{spk}'",
-        'outFields': 'OBJECTID',
-        'returnGeometry': 'false',
-        'token': token,
-    }
-    r = session.get(f"{BASE_URL}/query", params=params)
-    r.raise_for_status()
-    return [f['attributes']['OBJECTID'] for f in r.json().get('features', [])]
+    # returnIdsOnly is not capped at maxRecordCount, unlike a features query
+    return fetch_ids(session, BASE_URL, token, f"SPKNumber='{spk}'")
 
 
-def delete_objectid(session, token, objectid):
+def apply_edits(session, token, edits):
     headers = {
         **TOKEN_HEADERS,
         'Origin': 'https://maps.sinarmasforestry.com',
     }
     data = {
         'f': 'json',
-        'deletes': str(objectid),
         'token': token,
+        **edits_payload(edits),
     }
     r = session.post(f"{BASE_URL}/applyEdits", headers=headers, data=data)
     r.raise_for_status()
@@ -123,9 +121,14 @@ def delete_objectid(session, token, objectid):
 
 
 def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <SPKNumber>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Delete every feature of one SPKNumber")
+    parser.add_argument('spk', help="SPKNumber to delete")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the unfinished batches of the last run from its journal")
+    parser.add_argument('--rollback', action='store_true',
+                        help="re-add the features deleted by the last run, from its journal")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
 
     # Check required env vars
     for var in ['GIS_AUTH_USERNAME', 'GIS_AUTH_PASSWORD', 'GIS_USERNAME', 'GIS_PASSWORD']:
@@ -133,28 +136,50 @@ def main():
             print(f"❌ Missing environment variable: {var}")
             sys.exit(1)
 
-    session = requests.Session()
+    session = InstrumentedSession('delete_by_spk')
+    spk = args.spk
+    journal = Journal(journal_path('delete_by_spk', spk))
+    prof = Profiler.from_args('delete_by_spk', args)
+    prof.start()
 
     try:
-        token = get_final_token(session)
-        spk = sys.argv[1]
-        oids = fetch_objectids_for_spk(session, token, spk)
-
-        if not oids:
-            print(f"No features found for SPKNumber '{spk}'.")
+        with prof.phase('auth'):
+            token = get_final_token(session)
+        apply = lambda edits: apply_edits(session, token, edits)
+
+        if args.rollback:
+            with prof.phase('edit'):
+                n = rollback(journal, apply)
+            print(f"\n✅ Reverted {n} batches.")
             return
 
-        print(f"Found {len(oids)} features for SPKNumber {spk}: {oids}")
-        for oid in oids:
-            print(f"> Deleting OBJECTID={oid} …", end=" ")
-            resp = delete_objectid(session, token, oid)
-            print(resp)
+        if args.resume and journal.exists():
+            print(f"Resuming {len(journal.pending())} of {len(journal.plans)} batches from {journal.path}")
+        else:
+            with prof.phase('fetch'):
+                oids = fetch_objectids_for_spk(session, token, spk)
+
+            if not oids:
+                print(f"No features found for SPKNumber '{spk}'.")
+                return
+
+            print(f"Found {len(oids)} features for SPKNumber {spk}: {oids}")
+            with prof.phase('plan'):
+                journal.start('delete_by_spk', {'spk': spk})
+                for batch in chunked(oids):
+                    journal.plan({'deletes': batch}, fetch_snapshot(session, f"{BASE_URL}/query", token, batch))
+
+        with prof.phase('edit'):
+            run_pending(journal, apply)
 
         print("\n✅ Done.")
     except Exception as e:
         print(f"\n❌ Error: {e}")
         sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Export the layer to partitioned Parquet files, and add to them incrementally.
+
+  python export_parquet.py snapshot/                       # by SPKNumber prefix
+  python export_parquet.py snapshot/ --partition month     # by CRT_Date month
+  python export_parquet.py snapshot/ --fields FlightID,SPKNumber,Height
+  python export_parquet.py snapshot/ --append              # only features added since
+
+Pages are fetched in OBJECTID order (OBJECTID > last seen, so no page is
+re-read) and streamed into one Parquet writer per partition, in hive
+layout (snapshot/spk_prefix=50000/part-<run>.parquet). Nothing is held in
+memory beyond one row group per partition. snapshot/_snapshot.json records
+the highest OBJECTID exported, so --append writes new part files with only
+the features added since; existing files are never rewritten.
+
+OBJECTID and CRT_Date are always exported. checknull.py and
+checkduplicate.py read a snapshot with --snapshot DIR. Needs pyarrow.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+from datetime import datetime, timezone
+from collections import defaultdict
+from dotenv import load_dotenv
+
+import pbf
+import fastjson
+import bulk_update_heights as bulk
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+
+# pyarrow is optional and slow to import; require_pyarrow() loads it on first use
+pa = pq = ds = pc = None
+
+load_dotenv()
+
+STATE_FILE = "_snapshot.json"
+PAGE_SIZE = 2000
+ROW_GROUP_ROWS = 50_000
+PREFIX_LEN = 5
+ALWAYS_FIELDS = ["OBJECTID", "CRT_Date"]
+
+PARTITION_KEYS = {"spk": "spk_prefix", "month": "crt_month"}
+
+
+def require_pyarrow():
+    global pa, pq, ds, pc
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+        import pyarrow.compute
+    except ImportError:
+        raise Exception("❌ Parquet export needs pyarrow: pip install pyarrow")
+    pa, pq, ds, pc = pyarrow, pyarrow.parquet, pyarrow.dataset, pyarrow.compute
+
+
+def arrow_type(esri_type):
+    return {
+        "esriFieldTypeOID": pa.int64(),
+        "esriFieldTypeInteger": pa.int64(),
+        "esriFieldTypeSmallInteger": pa.int32(),
+        "esriFieldTypeDouble": pa.float64(),
+        "esriFieldTypeSingle": pa.float32(),
+        "esriFieldTypeDate": pa.timestamp("ms", tz="UTC"),
+    }.get(esri_type, pa.string())
+
+
+def layer_fields(session, token):
+    r = session.get(bulk.BASE_URL, params={"f": "json", "token": token})
+    r.raise_for_status()
+    js = r.json()
+    if "error" in js:
+        raise Exception(f"❌ Layer metadata failed: {js['error']}")
+    return {f["name"]: f["type"] for f in js.get("fields", [])}
+
+
+def partition_value(attrs, partition, prefix_len):
+    if partition == "month":
+        crt = attrs.get("CRT_Date")
+        if crt is None:
+            return "unknown"
+        return datetime.fromtimestamp(crt / 1000, tz=timezone.utc).strftime("%Y-%m")
+    spk = attrs.get("SPKNumber") or ""
+    return re.sub(r"[^A-Za-z0-9-]", "_", spk[:prefix_len]) or "unknown"
+
+
+def fetch_pages(session, token, where, fields, since_oid=0, use_pbf=False):
+    """Yield pages of attributes in OBJECTID order, each starting after the last OBJECTID seen."""
+    last = since_oid
+    while True:
+        js = pbf.query(session, bulk.QUERY_URL, {
+            "where": f"({where}) AND OBJECTID > {last}",
+            "outFields": ",".join(fields),
+            "orderByFields": "OBJECTID",
+            "resultRecordCount": PAGE_SIZE,
+            "returnGeometry": "false",
+            "token": token,
+        }, pbf=use_pbf)
+        if "error" in js:
+            raise Exception(f"❌ Query failed: {js['error']}")
+        page = [f["attributes"] for f in js.get("features", [])]
+        if not page:
+            return
+        yield page
+        last = max(a["OBJECTID"] for a in page)
+
+
+class PartitionedWriter:
+    """One ParquetWriter per partition value, fed in row groups of ROW_GROUP_ROWS."""
+
+    def __init__(self, out_dir, schema, key, run):
+        self.out_dir, self.schema, self.key, self.run = out_dir, schema, key, run
+        self.buffers = defaultdict(list)
+        self.writers = {}
+        self.paths = []
+        self.rows = defaultdict(int)
+
+    def add(self, value, attrs):
+        buf = self.buffers[value]
+        buf.append(attrs)
+        if len(buf) >= ROW_GROUP_ROWS:
+            self.flush(value)
+
+    def flush(self, value):
+        rows = self.buffers.pop(value, [])
+        if not rows:
+            return
+        writer = self.writers.get(value)
+        if writer is None:
+            folder = os.path.join(self.out_dir, f"{self.key}={value}")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"part-{self.run}.parquet")
+            writer = pq.ParquetWriter(path, self.schema)
+            self.writers[value] = writer
+            self.paths.append(path)
+        columns = {name: [r.get(name) for r in rows] for name in self.schema.names}
+        writer.write_table(pa.table(columns, schema=self.schema))
+        self.rows[value] += len(rows)
+
+    def close(self):
+        for value in list(self.buffers):
+            self.flush(value)
+        for writer in self.writers.values():
+            writer.close()
+
+    def discard(self):
+        """Close and delete this run's part files, after a failed export."""
+        for writer in self.writers.values():
+            writer.close()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return fastjson.loads(f.read())
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(fastjson.dumpb(state))
+    os.replace(f"{path}.tmp", path)
+
+
+def export(session, token, out_dir, where, fields, field_types, partition, prefix_len,
+           since_oid=0, use_pbf=False):
+    """Stream the features matching where into a new set of part files; returns (rows, max OBJECTID, files, run).
+
+    A failed export deletes the part files it wrote, so a retry does not
+    add its rows twice.
+    """
+    schema = pa.schema([(name, arrow_type(field_types.get(name))) for name in fields])
+    # the starting OBJECTID keeps two runs in the same second apart
+    run = f"{time.strftime('%Y%m%dT%H%M%S')}-{since_oid}"
+    writer = PartitionedWriter(out_dir, schema, PARTITION_KEYS[partition], run)
+    fetch_fields = sorted(set(fields) | {"SPKNumber"}) if partition == "spk" else fields
+    total, last = 0, since_oid
+    try:
+        for page in fetch_pages(session, token, where, fetch_fields, since_oid, use_pbf):
+            for attrs in page:
+                writer.add(partition_value(attrs, partition, prefix_len), attrs)
+            total += len(page)
+            last = max(last, page[-1]["OBJECTID"])
+            print(f"\r> {total} features exported …", end="", flush=True)
+        writer.close()
+    except BaseException:
+        writer.discard()
+        raise
+    if total:
+        print()
+    return total, last, len(writer.writers), run
+
+
+# --- reading a snapshot ---
+
+def read_snapshot(out_dir, columns):
+    """The snapshot's rows as a pyarrow Table with the given columns."""
+    require_pyarrow()
+    state = load_state(out_dir)
+    if state is None:
+        raise Exception(f"❌ No snapshot in {out_dir} (missing {STATE_FILE})")
+    missing = [c for c in columns if c not in state["fields"]]
+    if missing:
+        raise Exception(f"❌ Snapshot {out_dir} was exported without {', '.join(missing)}")
+    # only the part files of runs recorded in the state; a run that died before
+    # saving it (killed mid-export) may have left some behind
+    runs = {r["run"] for r in state["runs"] if "run" in r}
+    if len(runs) == len(state["runs"]):
+        files = [os.path.join(root, fn) for root, _, names in os.walk(out_dir) for fn in sorted(names)
+                 if fn.startswith("part-") and fn[len("part-"):-len(".parquet")] in runs]
+        dataset = ds.dataset(files, format="parquet", partitioning="hive", partition_base_dir=out_dir)
+    else:
+        dataset = ds.dataset(out_dir, format="parquet", partitioning="hive",
+                             exclude_invalid_files=True, ignore_prefixes=["_", "."])
+    return dataset.to_table(columns=columns)
+
+
+def snapshot_null_height_spks(out_dir, user_id=None):
+    """SPKNumbers of the snapshot's NULL Height rows (of user_id, when UserID was exported)."""
+    state = load_state(out_dir) or {"fields": []}
+    columns = ["SPKNumber", "Height"] + (["UserID"] if user_id and "UserID" in state["fields"] else [])
+    table = read_snapshot(out_dir, columns)
+    mask = pc.is_null(table["Height"])
+    if "UserID" in columns:
+        mask = pc.and_(mask, pc.equal(table["UserID"], user_id))
+    return table.filter(mask)["SPKNumber"].to_pylist()
+
+
+def snapshot_duplicates(out_dir):
+    """OBJECTIDs that checkduplicate.py would delete: all but the newest CRT_Date per FlightID."""
+    table = read_snapshot(out_dir, ["OBJECTID", "FlightID", "CRT_Date"])
+    counts = table.group_by("FlightID").aggregate([("OBJECTID", "count")])
+    repeated = counts.filter(pc.greater(counts["OBJECTID_count"], 1))["FlightID"]
+    dups = table.filter(pc.is_in(table["FlightID"], value_set=repeated))
+    dups = dups.sort_by([("FlightID", "ascending"), ("CRT_Date", "descending")])
+    to_delete, prev = [], None
+    for fid, oid in zip(dups["FlightID"].to_pylist(), dups["OBJECTID"].to_pylist()):
+        if fid == prev:
+            to_delete.append(oid)
+        prev = fid
+    return to_delete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the layer to partitioned Parquet files")
+    parser.add_argument("out", help="snapshot folder")
+    parser.add_argument("--partition", choices=sorted(PARTITION_KEYS), default="spk",
+                        help="spk: by SPKNumber prefix; month: by CRT_Date month (default: spk)")
+    parser.add_argument("--prefix-len", type=int, default=PREFIX_LEN,
+                        help=f"SPKNumber characters per partition (default: {PREFIX_LEN})")
+    parser.add_argument("--fields",
+                        help="comma-separated fields to export (default: all); "
+                             + " and ".join(ALWAYS_FIELDS) + " are always included")
+    parser.add_argument("--where", help="filter (default: UserID = GIS_USER_ID)")
+    parser.add_argument("--append", action="store_true",
+                        help="export only the features added since the last snapshot in OUT")
+    parser.add_argument("--pbf", action="store_true", help="fetch pages as f=pbf")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    user_id = os.getenv("GIS_USER_ID")
+    if not args.where and not user_id:
+        print("❌ Please set GIS_USER_ID in your .env, or pass --where")
+        sys.exit(1)
+
+    session = InstrumentedSession("export_parquet")
+    prof = Profiler.from_args("export_parquet", args)
+    prof.start()
+    try:
+        require_pyarrow()
+        state = load_state(args.out)
+        if args.append:
+            if state is None:
+                raise Exception(f"❌ Nothing to append to: no {STATE_FILE} in {args.out}")
+            # the snapshot's own layout wins, so every part file has the same schema
+            where, fields = state["where"], state["fields"]
+            partition, prefix_len = state["partition"], state["prefix_len"]
+            since = state["max_objectid"]
+        else:
+            if state is not None:
+                raise Exception(f"❌ {args.out} already holds a snapshot; use --append or a new folder")
+            where = args.where or f"UserID='{user_id}'"
+            partition, prefix_len, since = args.partition, args.prefix_len, 0
+            fields = None
+
+        with prof.phase("auth"):
+            token, _ = bulk.get_final_token(session)
+        with prof.phase("fetch"):
+            field_types = layer_fields(session, token)
+
+        if fields is None:
+            wanted = [f.strip() for f in args.fields.split(",")] if args.fields else list(field_types)
+            unknown = [f for f in wanted if f not in field_types]
+            if unknown:
+                raise Exception(f"❌ Unknown fields: {', '.join(unknown)}")
+            fields = ALWAYS_FIELDS + [f for f in wanted if f not in ALWAYS_FIELDS]
+
+        os.makedirs(args.out, exist_ok=True)
+        with prof.phase("fetch"):
+            rows, last, files, run = export(session, token, args.out, where, fields, field_types,
+                                            partition, prefix_len, since, args.pbf)
+
+        with prof.phase("write-output"):
+            state = state or {"where": where, "fields": fields, "partition": partition,
+                              "prefix_len": prefix_len, "rows": 0, "runs": []}
+            state["max_objectid"] = last
+            state["rows"] += rows
+            state["runs"].append({"at": int(time.time() * 1000), "run": run, "since_objectid": since,
+                                  "rows": rows})
+            save_state(args.out, state)
+        print(f"✅ {rows} features written to {files} part files in {args.out} "
+              f"({state['rows']} in the snapshot, up to OBJECTID {last})")
+
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
+
+
+if __name__ == "__main__":
+    main()
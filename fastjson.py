@@ -0,0 +1,36 @@
+"""JSON encode/decode through orjson when it is installed, stdlib json otherwise.
+
+Both backends produce compact output (no spaces after separators), so
+applyEdits payloads are byte-for-byte smaller than json.dumps defaults
+either way.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+
+if orjson:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def dumpb(obj):
+        return orjson.dumps(obj)
+else:
+    _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return _encoder.encode(obj)
+
+    def dumpb(obj):
+        return _encoder.encode(obj).encode("utf-8")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""fdm — single entry point for the flight-data-management scripts.
+
+  fdm check-null
+  fdm bulk-heights archive.zip 5000012345 --calculate
+  fdm <command> --help
+
+Only the chosen command's module is imported, and pandas/openpyxl and the
+XML parser are imported inside the code paths that need them, so quick
+cron checks do not pay for heavy imports.
+"""
+import sys
+
+COMMANDS = {
+    "check-spk": ("runner", "report upload status for every SPK in feedback.xlsx"),
+    "spk-service": ("spk_service", "serve check-spk answers over HTTP from a refreshed local index"),
+    "bulk-heights": ("bulk_update_heights", "fill NULL Height from the KMLs in a ZIP for one SPK"),
+    "watch": ("watch_heights", "bulk-heights for every ZIP dropped into a folder, as a daemon"),
+    "dedupe": ("checkduplicate", "delete older duplicate features per FlightID"),
+    "check-null": ("checknull", "list SPKNumbers that still have NULL Height"),
+    "upload": ("upload_kml", "add the flights in KML ZIPs as new features"),
+    "reconcile": ("reconcile_heights", "fill every NULL Height found in the KML archive store"),
+    "export": ("export_parquet", "export the layer to partitioned Parquet files, or append to them"),
+    "delete-spk": ("delete_by_spk", "delete every feature of one SPKNumber"),
+    "swap": ("update_features_swap", "swap SPKNumber/KeyID on 'L…' features and de-duplicate"),
+}
+
+
+def usage():
+    width = max(len(c) for c in COMMANDS)
+    lines = ["usage: fdm <command> [args...]", "", "commands:"]
+    for cmd, (_, help_text) in COMMANDS.items():
+        lines.append(f"  {cmd:<{width}}  {help_text}")
+    lines.append("")
+    lines.append("Run 'fdm <command> --help' for the options of a command.")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0 if argv else 2
+
+    cmd, rest = argv[0], argv[1:]
+    if cmd not in COMMANDS:
+        print(f"fdm: unknown command '{cmd}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    import importlib
+    module = importlib.import_module(COMMANDS[cmd][0])
+    sys.argv = [f"fdm {cmd}", *rest]
+    return module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Find flights of the same SPK whose footprints overlap, without comparing every pair.
+
+Footprints are Esri polygon rings. Candidate pairs come from shapely's
+STRtree when shapely is installed, otherwise from a per-SPK uniform grid
+over the bounding boxes. Pairs whose bounding boxes cannot reach the
+threshold are dropped before any polygon maths. The overlap ratio is
+intersection area over union area.
+
+Without shapely, the intersection is computed by clipping against the
+convex hull of the other footprint. That is exact for the convex
+footprints drones produce, and an overestimate for concave ones.
+"""
+import math
+from collections import defaultdict, namedtuple
+
+try:
+    from shapely.geometry import Polygon, MultiPolygon
+    from shapely.strtree import STRtree
+except ImportError:  # optional; the grid index below needs nothing
+    Polygon = MultiPolygon = STRtree = None
+
+Footprint = namedtuple("Footprint", "oid spk rings bbox area")
+
+
+def ring_signed_area(ring):
+    s = 0.0
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        s += x0 * y1 - x1 * y0
+    return s / 2.0
+
+
+def open_ring(ring):
+    pts = [(p[0], p[1]) for p in ring]
+    if len(pts) > 1 and pts[0] == pts[-1]:
+        pts.pop()
+    return pts
+
+
+def make_footprint(oid, spk, geometry):
+    """Footprint from an f=json polygon geometry, or None when it has no area."""
+    rings = [open_ring(r) for r in (geometry or {}).get("rings", []) if len(r) >= 3]
+    if not rings:
+        return None
+    xs = [x for r in rings for x, _ in r]
+    ys = [y for r in rings for _, y in r]
+    # Esri outer rings are clockwise and holes counter-clockwise, so the sum nets holes out
+    area = abs(sum(ring_signed_area(r) for r in rings))
+    if area <= 0:
+        return None
+    return Footprint(oid, spk, rings, (min(xs), min(ys), max(xs), max(ys)), area)
+
+
+def convex_hull(points):
+    """Counter-clockwise hull (Andrew's monotone chain)."""
+    pts = sorted(set(points))
+    if len(pts) < 3:
+        return pts
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def clip(subject, clipper):
+    """Sutherland–Hodgman: subject polygon clipped by a counter-clockwise convex clipper."""
+    out = subject
+    for (cx0, cy0), (cx1, cy1) in zip(clipper, clipper[1:] + clipper[:1]):
+        if not out:
+            break
+        inp, out = out, []
+
+        def inside(p):
+            return (cx1 - cx0) * (p[1] - cy0) - (cy1 - cy0) * (p[0] - cx0) >= 0
+
+        def cut(p, q):
+            dx, dy = q[0] - p[0], q[1] - p[1]
+            ex, ey = cx1 - cx0, cy1 - cy0
+            denom = dx * ey - dy * ex
+            if denom == 0:
+                return q
+            t = ((cx0 - p[0]) * ey - (cy0 - p[1]) * ex) / denom
+            return (p[0] + t * dx, p[1] + t * dy)
+
+        prev = inp[-1]
+        for cur in inp:
+            if inside(cur):
+                if not inside(prev):
+                    out.append(cut(prev, cur))
+                out.append(cur)
+            elif inside(prev):
+                out.append(cut(prev, cur))
+            prev = cur
+    return out
+
+
+def outer_rings(fp):
+    return [r for r in fp.rings if ring_signed_area(r) <= 0] or fp.rings
+
+
+def to_shape(fp):
+    outers = outer_rings(fp)
+    if len(outers) == 1:
+        return Polygon(outers[0], [r for r in fp.rings if ring_signed_area(r) > 0])
+    return MultiPolygon([Polygon(r) for r in outers])
+
+
+def intersection_area(a, b):
+    hull = convex_hull([p for r in outer_rings(b) for p in r])
+    if len(hull) < 3:
+        return 0.0
+    return sum(abs(ring_signed_area(clip(r, hull))) for r in outer_rings(a) if len(r) >= 3)
+
+
+def bbox_bound(a, b):
+    """Upper bound of the overlap ratio from the bounding boxes alone."""
+    w = min(a.bbox[2], b.bbox[2]) - max(a.bbox[0], b.bbox[0])
+    h = min(a.bbox[3], b.bbox[3]) - max(a.bbox[1], b.bbox[1])
+    if w < 0 or h < 0:
+        return 0.0
+    inter = min(w * h, a.area, b.area)
+    return inter / max(a.area, b.area)
+
+
+def grid_candidates(group):
+    """Index pairs (i, j), i < j, whose bounding boxes share a grid cell."""
+    sizes = sorted(max(fp.bbox[2] - fp.bbox[0], fp.bbox[3] - fp.bbox[1]) for fp in group)
+    cell = sizes[len(sizes) // 2] or 1.0
+    grid = defaultdict(list)
+    for j, fp in enumerate(group):
+        x0, y0, x1, y1 = fp.bbox
+        seen = set()
+        for cx in range(math.floor(x0 / cell), math.floor(x1 / cell) + 1):
+            for cy in range(math.floor(y0 / cell), math.floor(y1 / cell) + 1):
+                bucket = grid[(cx, cy)]
+                for i in bucket:
+                    if i not in seen:
+                        seen.add(i)
+                        yield i, j
+                bucket.append(j)
+
+
+def overlapping_pairs(footprints, threshold=0.9):
+    """[(footprint, footprint, ratio)] for same-SPK pairs whose overlap ratio reaches threshold."""
+    by_spk = defaultdict(list)
+    for fp in footprints:
+        by_spk[fp.spk].append(fp)
+
+    pairs = []
+    for group in by_spk.values():
+        if len(group) < 2:
+            continue
+        if STRtree is not None:
+            shapes = [to_shape(fp) for fp in group]
+            tree = STRtree(shapes)
+            left, right = tree.query(shapes, predicate="intersects")
+            candidates = ((int(i), int(j)) for i, j in zip(left, right) if i < j)
+        else:
+            shapes = None
+            candidates = grid_candidates(group)
+
+        for i, j in candidates:
+            a, b = group[i], group[j]
+            if bbox_bound(a, b) < threshold:
+                continue
+            if shapes is not None:
+                inter = shapes[i].intersection(shapes[j]).area
+            else:
+                inter = intersection_area(a, b)
+            union = a.area + b.area - inter
+            ratio = inter / union if union > 0 else 0.0
+            if ratio >= threshold:
+                pairs.append((a, b, ratio))
+    return pairs
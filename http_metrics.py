@@ -0,0 +1,421 @@
+import os
+import gzip
+import json
+import math
+import time
+import threading
+from collections import defaultdict, OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import fastjson
+
+METRICS_DIR = os.getenv("FDM_METRICS_DIR", ".metrics")
+# node exporter textfile collector directory; one fdm_<job>.prom per job
+PROM_TEXTFILE_DIR = os.getenv("FDM_PROM_TEXTFILE_DIR")
+# set per vendor by tenants.py; becomes a label and part of the file names
+TENANT = os.getenv("FDM_TENANT")
+
+# Prometheus histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ENDPOINTS = ("generateToken", "query", "applyEdits", "calculate", "deleteFeatures")
+
+# gzip POST bodies at least this large (0 disables); servers that reject
+# Content-Encoding: gzip are remembered and sent plain bodies from then on
+GZIP_MIN_BYTES = int(os.getenv("FDM_GZIP_REQUESTS_MIN_BYTES", "0"))
+
+# identical queries within this many seconds share one response (0 disables;
+# in-flight duplicates are always coalesced), and at most this many are kept
+QUERY_CACHE_TTL = float(os.getenv("FDM_QUERY_CACHE_TTL", "10"))
+QUERY_CACHE_SIZE = int(os.getenv("FDM_QUERY_CACHE_SIZE", "256"))
+
+# layer operations that change features
+WRITE_ENDPOINTS = ("applyEdits", "calculate", "deleteFeatures", "addFeatures", "updateFeatures")
+
+
+def form_value(form, key):
+    """Raw value of key in an urlencoded string, without parsing all of it."""
+    needle = key + "="
+    if form.startswith(needle):
+        start = len(needle)
+    else:
+        i = form.find("&" + needle)
+        if i < 0:
+            return None
+        start = i + 1 + len(needle)
+    end = form.find("&", start)
+    return form[start:] if end < 0 else form[start:end]
+
+
+def classify(request):
+    """(endpoint, operation) for a prepared request."""
+    path = urlsplit(request.url).path.rstrip("/")
+    endpoint = path.rsplit("/", 1)[-1]
+    if endpoint not in ENDPOINTS:
+        endpoint = "other"
+
+    form = urlsplit(request.url).query
+    body = request.body
+    if body and isinstance(body, (str, bytes)):
+        if isinstance(body, bytes):
+            body = body.decode("latin-1")
+        form = f"{form}&{body}" if form else body
+
+    def has(key, value=None):
+        v = form_value(form, key)
+        return bool(v) if value is None else v == value
+
+    if endpoint == "generateToken":
+        op = "scope" if has("serverUrl") else "login"
+    elif endpoint == "query":
+        if has("layerDefs"):
+            op = "layers"
+        elif has("returnCountOnly", "true"):
+            op = "count"
+        elif has("returnIdsOnly", "true"):
+            op = "ids"
+        elif has("outStatistics"):
+            op = "statistics"
+        elif has("returnDistinctValues", "true"):
+            op = "distinct"
+        elif has("objectIds"):
+            op = "objectIds"
+        else:
+            op = "features"
+    elif endpoint == "applyEdits":
+        op = "+".join(k for k in ("adds", "updates", "deletes") if has(k)) or "none"
+    else:
+        op = request.method.lower()
+    return endpoint, op
+
+
+def error_body(response):
+    """True for an ArcGIS error answered as HTTP 200: a body starting {"error": …}."""
+    return b'"error"' in (response.content or b"")[:64]
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return None
+    # nearest-rank
+    rank = math.ceil(pct / 100.0 * len(sorted_vals)) - 1
+    return sorted_vals[max(0, min(len(sorted_vals) - 1, rank))]
+
+
+class Metrics:
+    """Per-endpoint latency, size, error and retry counters for one run."""
+
+    def __init__(self, job, tenant=TENANT):
+        self.job = job
+        self.tenant = tenant
+        self.started = time.time()
+        self.latencies = defaultdict(list)
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.operations = defaultdict(lambda: defaultdict(int))
+        self.cache = defaultdict(int)
+        # fetch plans chosen by query_planner, with their estimated and actual cost
+        self.plans = []
+
+    def record(self, request, response, elapsed, tag=None):
+        endpoint, op = tag or classify(request)
+        body = request.body or b""
+        c = self.counters[endpoint]
+        c["requests"] += 1
+        c["bytes_sent"] += len(body.encode("utf-8") if isinstance(body, str) else body) + len(request.url)
+        if response is None:
+            c["errors"] += 1
+        else:
+            c["bytes_received"] += len(response.content or b"")
+            if response.status_code >= 400 or error_body(response):
+                c["errors"] += 1
+            retries = getattr(getattr(response.raw, "retries", None), "history", None)
+            if retries:
+                c["retries"] += len(retries)
+        self.latencies[endpoint].append(elapsed)
+        self.operations[endpoint][op] += 1
+
+    def summary(self):
+        endpoints = {}
+        for endpoint, lat in self.latencies.items():
+            lat = sorted(lat)
+            c = self.counters[endpoint]
+            endpoints[endpoint] = {
+                "requests": c["requests"],
+                "errors": c["errors"],
+                "retries": c["retries"],
+                "bytes_sent": c["bytes_sent"],
+                "bytes_received": c["bytes_received"],
+                "latency_s": {
+                    "p50": percentile(lat, 50),
+                    "p95": percentile(lat, 95),
+                    "p99": percentile(lat, 99),
+                    "max": lat[-1],
+                    "sum": sum(lat),
+                },
+                "operations": dict(self.operations[endpoint]),
+            }
+        total = {k: sum(e[k] for e in endpoints.values())
+                 for k in ("requests", "errors", "retries", "bytes_sent", "bytes_received")}
+        finished = time.time()
+        return {
+            "job": self.job,
+            "tenant": self.tenant,
+            "started": self.started,
+            "finished": finished,
+            "wall_s": finished - self.started,
+            "total": total,
+            "endpoints": endpoints,
+            "query_cache": {k: self.cache[k] for k in ("hits", "coalesced", "invalidations")},
+            "query_plans": self.plans,
+        }
+
+    def prometheus(self, summary=None):
+        summary = summary or self.summary()
+        # not "job": the scrape config owns that label, and a clash becomes exported_job
+        base = f'script="{self.job}"' + (f',tenant="{self.tenant}"' if self.tenant else "")
+        lines = [
+            "# HELP fdm_http_request_duration_seconds GIS request latency by endpoint.",
+            "# TYPE fdm_http_request_duration_seconds histogram",
+        ]
+        for endpoint, lat in sorted(self.latencies.items()):
+            labels = f'{base},endpoint="{endpoint}"'
+            for le in LATENCY_BUCKETS:
+                lines.append(f'fdm_http_request_duration_seconds_bucket{{{labels},le="{le}"}} '
+                             f'{sum(1 for v in lat if v <= le)}')
+            lines.append(f'fdm_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {len(lat)}')
+            lines.append(f"fdm_http_request_duration_seconds_sum{{{labels}}} {sum(lat)}")
+            lines.append(f"fdm_http_request_duration_seconds_count{{{labels}}} {len(lat)}")
+
+        for name, key, help_text in (
+            ("fdm_http_request_errors_total", "errors", "Failed GIS requests."),
+            ("fdm_http_request_retries_total", "retries", "Transport-level retries."),
+            ("fdm_http_sent_bytes_total", "bytes_sent", "Request URL and body bytes."),
+            ("fdm_http_received_bytes_total", "bytes_received", "Response body bytes."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for endpoint, e in sorted(summary["endpoints"].items()):
+                lines.append(f'{name}{{{base},endpoint="{endpoint}"}} {e[key]}')
+
+        lines.append("# HELP fdm_query_cache_total Queries answered without a request, and cache invalidations.")
+        lines.append("# TYPE fdm_query_cache_total counter")
+        for kind, n in sorted(summary["query_cache"].items()):
+            lines.append(f'fdm_query_cache_total{{{base},kind="{kind}"}} {n}')
+
+        lines.append("# HELP fdm_run_last_finished_timestamp_seconds When the job last finished.")
+        lines.append("# TYPE fdm_run_last_finished_timestamp_seconds gauge")
+        lines.append(f'fdm_run_last_finished_timestamp_seconds{{{base}}} {summary["finished"]}')
+        lines.append("# HELP fdm_run_duration_seconds Wall time of the last run.")
+        lines.append("# TYPE fdm_run_duration_seconds gauge")
+        lines.append(f'fdm_run_duration_seconds{{{base}}} {summary["wall_s"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=None, prom_dir=PROM_TEXTFILE_DIR):
+        """Write the JSON summary (and the Prometheus textfile if configured)."""
+        summary = self.summary()
+        name = f"{self.job}_{self.tenant}" if self.tenant else self.job
+        path = path or os.path.join(METRICS_DIR, f"{name}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+        if prom_dir:
+            # node exporter may read at any time: write aside, then rename
+            prom_path = os.path.join(prom_dir, f"fdm_{name}.prom")
+            tmp = f"{prom_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.prometheus(summary))
+            os.replace(tmp, prom_path)
+        return path
+
+
+def query_key(request):
+    """(layer URL, normalized parameters) of a query, without the token."""
+    parts = urlsplit(request.url)
+    body = request.body or ""
+    if isinstance(body, bytes):
+        body = body.decode("latin-1")
+    params = {}
+    for k, v in parse_qsl(parts.query, keep_blank_values=True) + parse_qsl(body, keep_blank_values=True):
+        if k == "token":
+            continue
+        if k == "where":
+            v = " ".join(v.split())
+        elif k == "outFields":
+            v = ",".join(f.strip() for f in v.split(","))
+        params[k] = v
+    layer = f"{parts.scheme}://{parts.netloc}{parts.path.rstrip('/').rsplit('/', 1)[0]}"
+    return layer, tuple(sorted(params.items()))
+
+
+def layer_of(url):
+    """…/FeatureServer/0/applyEdits → …/FeatureServer/0"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path.rstrip('/').rsplit('/', 1)[0]}"
+
+
+class QueryCache:
+    """Singleflight plus a short-TTL LRU of query responses, dropped on writes to the layer.
+
+    Identical queries (same layer and normalized parameters) in flight at
+    the same time share one request. Successful answers are then kept for
+    ttl seconds, at most size of them. A write to a layer drops its cached
+    answers and those of its service-level query, and a query that was
+    already in flight when any write started is not cached, so no answer
+    older than the session's own writes is ever returned.
+    """
+
+    def __init__(self, ttl=QUERY_CACHE_TTL, size=QUERY_CACHE_SIZE):
+        self.ttl, self.size = ttl, size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key → (expires, response)
+        self.flights = {}  # (key, generation) → [event, response, error]
+        self.generation = 0
+
+    def invalidate(self, layer):
+        service = layer.rsplit("/", 1)[0]
+        with self.lock:
+            self.generation += 1
+            stale = [k for k in self.entries if k[0] in (layer, service)]
+            for k in stale:
+                del self.entries[k]
+        return len(stale)
+
+    def fetch(self, key, send, metrics):
+        """Cached response for key, or the one from send() shared with concurrent callers."""
+        with self.lock:
+            hit = self.entries.get(key)
+            if hit and hit[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                metrics.cache["hits"] += 1
+                return hit[1]
+            generation = self.generation
+            flight = self.flights.get((key, generation))
+            leader = flight is None
+            if leader:
+                flight = self.flights[(key, generation)] = [threading.Event(), None, None]
+            else:
+                metrics.cache["coalesced"] += 1
+
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+
+        try:
+            response = send()
+            flight[1] = response
+        except Exception as e:
+            flight[2] = e
+            raise
+        except BaseException:
+            # KeyboardInterrupt and the like stay with the leader; waiters get a plain error
+            flight[2] = Exception("❌ Shared request was interrupted")
+            raise
+        finally:
+            # waiters first, so nothing below can leave them blocked
+            flight[0].set()
+            with self.lock:
+                self.flights.pop((key, generation), None)
+                ok = (flight[1] is not None and flight[2] is None and flight[1].status_code == 200
+                      and not error_body(flight[1]))
+                if self.ttl > 0 and ok and generation == self.generation:
+                    self.entries[key] = (time.monotonic() + self.ttl, flight[1])
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.size:
+                        self.entries.popitem(last=False)
+        return response
+
+
+class JSONResponse(requests.Response):
+    """Response whose json() decodes with fastjson (orjson when available)."""
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super().json(**kwargs)
+        return fastjson.loads(self.content)
+
+
+class InstrumentedSession(requests.Session):
+    """requests.Session that times and tags every request into self.metrics.
+
+    Idempotent requests (GET) are retried on connection errors and 429/5xx
+    gateway responses; those retries are counted per endpoint. Responses
+    decode through fastjson, and POST bodies of at least gzip_min_bytes are
+    sent gzip-compressed to servers that accept it. Queries go through a
+    QueryCache, which edits made through this session keep current.
+    """
+
+    def __init__(self, job, retries=3, gzip_min_bytes=GZIP_MIN_BYTES,
+                 cache_ttl=QUERY_CACHE_TTL, cache_size=QUERY_CACHE_SIZE):
+        super().__init__()
+        self.metrics = Metrics(job)
+        self.gzip_min_bytes = gzip_min_bytes
+        self.gzip_refused = set()
+        self.query_cache = QueryCache(cache_ttl, cache_size)
+        adapter = HTTPAdapter(max_retries=Retry(
+            total=retries, backoff_factor=0.5,
+            status_forcelist=(429, 502, 503, 504), raise_on_status=False,
+        ))
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def _compress(self, request):
+        """gzip the body in place; returns the original body, or None if untouched."""
+        body = request.body
+        if (not self.gzip_min_bytes or request.method != "POST" or not body
+                or "Content-Encoding" in request.headers
+                or urlsplit(request.url).netloc in self.gzip_refused):
+            return None
+        raw = body.encode("utf-8") if isinstance(body, str) else body
+        if not isinstance(raw, bytes) or len(raw) < self.gzip_min_bytes:
+            return None
+        request.body = gzip.compress(raw, compresslevel=5)
+        request.headers["Content-Encoding"] = "gzip"
+        request.headers["Content-Length"] = str(len(request.body))
+        return body
+
+    def _send(self, request, tag, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.metrics.record(request, None, time.perf_counter() - start, tag)
+            raise
+        self.metrics.record(request, response, time.perf_counter() - start, tag)
+        response.__class__ = JSONResponse
+        return response
+
+    def send(self, request, **kwargs):
+        tag = classify(request)
+        if tag[0] == "query" and not kwargs.get("stream"):
+            return self.query_cache.fetch(query_key(request),
+                                          lambda: self._send_plain(request, tag, **kwargs), self.metrics)
+        path = urlsplit(request.url).path.rstrip("/")
+        if path.rsplit("/", 1)[-1] not in WRITE_ENDPOINTS:
+            return self._send_plain(request, tag, **kwargs)
+        layer = layer_of(request.url)
+        self.metrics.cache["invalidations"] += self.query_cache.invalidate(layer)
+        try:
+            return self._send_plain(request, tag, **kwargs)
+        finally:
+            # queries that started while the edit was in flight must not be cached either
+            self.query_cache.invalidate(layer)
+
+    def _send_plain(self, request, tag, **kwargs):
+        original = self._compress(request)
+        response = self._send(request, tag, **kwargs)
+        if original is not None and response.status_code in (400, 411, 413, 415):
+            # server does not take compressed bodies: remember and resend plain
+            self.gzip_refused.add(urlsplit(request.url).netloc)
+            request.body = original
+            del request.headers["Content-Encoding"]
+            request.headers["Content-Length"] = str(len(original.encode("utf-8")
+                                                        if isinstance(original, str) else original))
+            response = self._send(request, tag, **kwargs)
+        return response
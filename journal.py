@@ -0,0 +1,229 @@
+import os
+import re
+import time
+
+import fastjson
+
+JOURNAL_DIR = ".journals"
+
+# Edits per applyEdits call when a job is planned into batches
+BATCH_SIZE = 500
+
+
+def journal_path(job, *key):
+    name = "_".join([job, *(re.sub(r"[^A-Za-z0-9.-]+", "-", str(k)) for k in key)])
+    return os.path.join(JOURNAL_DIR, f"{name}.jsonl")
+
+
+def chunked(items, size=BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def edits_payload(edits):
+    """Turn a journal edits dict into applyEdits form fields."""
+    data = {}
+    for op, value in edits.items():
+        if op == "deletes":
+            data[op] = ",".join(str(oid) for oid in value)
+        else:
+            data[op] = fastjson.dumps(value)
+    return data
+
+
+def fetch_snapshot(session, query_url, token, oids):
+    """Full attributes and geometry of the given OBJECTIDs, for rollback.
+
+    Asks again for whatever a page capped at maxRecordCount left out, and
+    raises unless every OBJECTID came back, so a delete is never planned
+    without the snapshot that would undo it.
+    """
+    features, missing = [], set(oids)
+    while missing:
+        r = session.post(query_url, data={
+            "f": "json",
+            "objectIds": ",".join(str(oid) for oid in sorted(missing)),
+            "outFields": "*",
+            "returnGeometry": "true",
+            "token": token,
+        })
+        r.raise_for_status()
+        js = r.json()
+        if "error" in js:
+            raise Exception(f"❌ Snapshot query failed: {js['error']}")
+        page = [f for f in js.get("features", []) if f["attributes"].get("OBJECTID") in missing]
+        if not page:
+            break
+        features.extend(page)
+        missing -= {f["attributes"]["OBJECTID"] for f in page}
+    if missing:
+        raise Exception(f"❌ No snapshot for {len(missing)} of {len(oids)} OBJECTIDs "
+                        f"(e.g. {min(missing)}); not planning their deletion")
+    return features
+
+
+class Journal:
+    """Append-only JSONL record of a bulk job's planned and committed edits.
+
+    Each line is one of:
+      {"kind": "job", "job": ..., "params": {...}}
+      {"kind": "plan", "batch": n, "edits": {"deletes"|"updates"|...: ...}, "before": [...]}
+      {"kind": "done", "batch": n, "result": {...}}
+      {"kind": "undone", "batch": n, "result": {...}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.params = {}
+        self.plans = {}
+        self.done = {}
+        self.undone = set()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = fastjson.loads(line)
+                except ValueError:
+                    # a torn last line from an interrupted write
+                    continue
+                kind = rec.get("kind")
+                if kind == "job":
+                    self.params = rec.get("params", {})
+                elif kind == "plan":
+                    self.plans[rec["batch"]] = rec
+                elif kind == "done":
+                    self.done[rec["batch"]] = rec.get("result")
+                elif kind == "undone":
+                    self.undone.add(rec["batch"])
+
+    def _append(self, rec):
+        with open(self.path, "a") as f:
+            f.write(fastjson.dumps(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def exists(self):
+        return bool(self.plans)
+
+    def start(self, job, params):
+        """Begin a fresh journal, keeping any previous one alongside it."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, f"{self.path}.{int(time.time())}")
+        self.params = params
+        self.plans, self.done, self.undone = {}, {}, set()
+        self._append({"kind": "job", "job": job, "params": params, "created": int(time.time())})
+
+    def plan(self, edits, before=None):
+        batch = len(self.plans)
+        rec = {"kind": "plan", "batch": batch, "edits": edits, "before": before or []}
+        self.plans[batch] = rec
+        self._append(rec)
+        return batch
+
+    def commit(self, batch, result):
+        self.done[batch] = result
+        self._append({"kind": "done", "batch": batch, "result": result})
+
+    def pending(self):
+        return [self.plans[b] for b in sorted(self.plans) if b not in self.done]
+
+    def mark_undone(self, batch, result):
+        self.undone.add(batch)
+        self._append({"kind": "undone", "batch": batch, "result": result})
+
+    def inverse_batches(self):
+        """(batch, edits) that revert committed batches, newest first.
+
+        Deleted features are re-added from their snapshot (they come back
+        with new OBJECTIDs); updated features get their old attributes back;
+        added features are deleted again by the OBJECTIDs in addResults.
+        Other batches without a "before" snapshot cannot be reverted; they
+        are skipped and listed by irreversible().
+        """
+        out = []
+        for batch in sorted(self.done, reverse=True):
+            if batch in self.undone:
+                continue
+            rec = self.plans.get(batch)
+            if rec and "adds" in rec["edits"]:
+                added = [r["objectId"] for r in (self.done[batch] or {}).get("addResults", [])
+                         if r.get("success")]
+                if added:
+                    out.append((batch, {"deletes": added}))
+                continue
+            if not rec or not rec.get("before"):
+                continue
+            edits = rec["edits"]
+            if "deletes" in edits:
+                adds = []
+                for feat in rec["before"]:
+                    attrs = {k: v for k, v in feat["attributes"].items() if k != "OBJECTID"}
+                    add = {"attributes": attrs}
+                    if feat.get("geometry"):
+                        add["geometry"] = feat["geometry"]
+                    adds.append(add)
+                out.append((batch, {"adds": adds}))
+            elif "updates" in edits:
+                out.append((batch, {"updates": [{"attributes": f["attributes"]} for f in rec["before"]]}))
+        return out
+
+    def irreversible(self):
+        """Committed batches inverse_batches() skips: no snapshot to revert from (e.g. calculate)."""
+        return [b for b in sorted(self.done)
+                if b not in self.undone and b in self.plans
+                and "adds" not in self.plans[b]["edits"] and not self.plans[b].get("before")]
+
+
+def check_result(resp):
+    """Raise when an applyEdits (or calculate) response reports any failure."""
+    if not isinstance(resp, dict):
+        raise Exception(f"❌ Unexpected response: {resp!r}")
+    if "error" in resp:
+        raise Exception(f"❌ Rejected by the server: {resp['error']}")
+    failed = [r for key in ("addResults", "updateResults", "deleteResults")
+              for r in resp.get(key, []) if not r.get("success")]
+    if failed:
+        raise Exception(f"❌ {len(failed)} edit(s) failed, first: {failed[0].get('error', failed[0])}")
+    if resp.get("success") is False:
+        raise Exception(f"❌ Edit failed: {resp}")
+
+
+def run_pending(journal, apply):
+    """Apply every planned-but-uncommitted batch through apply(edits).
+
+    A batch the server rejects, wholly or in part, stays pending and stops
+    the run, so --resume retries it.
+    """
+    pending = journal.pending()
+    total = len(journal.plans)
+    for rec in pending:
+        edits = rec["edits"]
+        size = sum(len(v) if isinstance(v, list) else 1 for v in edits.values())
+        print(f"> Batch {rec['batch'] + 1}/{total} ({size} edits) …", end=" ")
+        resp = apply(edits)
+        check_result(resp)
+        journal.commit(rec["batch"], resp)
+        print(resp)
+    return len(pending)
+
+
+def rollback(journal, apply):
+    """Revert committed batches newest-first through apply(edits)."""
+    inverse = journal.inverse_batches()
+    kept = journal.irreversible()
+    if kept:
+        print(f"⚠️ {len(kept)} committed batch(es) have no before snapshot and cannot be reverted: "
+              + ", ".join(str(b + 1) for b in kept))
+    for batch, edits in inverse:
+        print(f"> Reverting batch {batch + 1} …", end=" ")
+        resp = apply(edits)
+        check_result(resp)
+        journal.mark_undone(batch, resp)
+        print(resp)
+    return len(inverse)
@@ -0,0 +1,131 @@
+"""FlightID → Height index over a store of KML ZIP archives.
+
+The index is a small SQLite file. refresh() only re-parses archives whose
+size or mtime changed since the last run (and drops archives that are gone),
+so after the first build keeping it current costs a stat per archive.
+"""
+import os
+import re
+import sqlite3
+
+from bulk_update_heights import DEFAULT_SPK_PATTERN, load_manifest, infer_spk, parse_archives
+
+INDEX_FILE = ".kml_index.sqlite"
+
+# archives handed to the parse pool (and committed to the index) at a time
+REFRESH_CHUNK = 200
+# SQLite's default limit on bound parameters is 999
+LOOKUP_CHUNK = 500
+
+SPK_DIR = re.compile(r"^\d{6,}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    path TEXT PRIMARY KEY, size INTEGER, mtime REAL, spk TEXT, flights INTEGER, error TEXT
+);
+CREATE TABLE IF NOT EXISTS flights (
+    flight_id TEXT, height REAL, spk TEXT, archive TEXT, kml TEXT
+);
+CREATE INDEX IF NOT EXISTS flights_flight_id ON flights(flight_id);
+CREATE INDEX IF NOT EXISTS flights_archive ON flights(archive);
+"""
+
+
+def walk_archives(store):
+    """{path: (size, mtime)} for every ZIP anywhere under store."""
+    found = {}
+    for root, _, files in os.walk(store):
+        for fn in files:
+            if fn.lower().endswith(".zip"):
+                path = os.path.join(root, fn)
+                st = os.stat(path)
+                found[path] = (st.st_size, st.st_mtime)
+    return found
+
+
+def archive_spk(path, manifests, pattern):
+    """SPK from the folder's manifest or the file name, else an SPK-named parent folder."""
+    folder = os.path.dirname(path)
+    if folder not in manifests:
+        try:
+            manifests[folder] = load_manifest(folder)
+        except (OSError, ValueError, KeyError):
+            manifests[folder] = {}
+    spk = infer_spk(folder, path, manifests[folder], pattern)
+    if spk:
+        return spk
+    parent = os.path.basename(folder)
+    return parent if SPK_DIR.match(parent) else None
+
+
+class KmlIndex:
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def stats(self):
+        archives = self.db.execute("SELECT COUNT(*) FROM archives").fetchone()[0]
+        flights = self.db.execute("SELECT COUNT(DISTINCT flight_id) FROM flights").fetchone()[0]
+        return {"archives": archives, "flights": flights}
+
+    def refresh(self, store, jobs=None, spk_pattern=DEFAULT_SPK_PATTERN):
+        """Bring the index in line with store; returns (parsed, removed, failed) archive counts."""
+        store = os.path.abspath(store)
+        on_disk = walk_archives(store)
+        known = {path: (size, mtime) for path, size, mtime
+                 in self.db.execute("SELECT path, size, mtime FROM archives WHERE path LIKE ?",
+                                    (store.rstrip(os.sep) + os.sep + "%",))}
+
+        removed = [path for path in known if path not in on_disk]
+        for path in removed:
+            self._forget(path)
+        self.db.commit()
+
+        changed = sorted(path for path, stamp in on_disk.items() if known.get(path) != stamp)
+        pattern = re.compile(spk_pattern)
+        manifests = {}
+        failed = 0
+        for i in range(0, len(changed), REFRESH_CHUNK):
+            chunk = changed[i:i + REFRESH_CHUNK]
+            parsed = parse_archives(chunk, jobs)
+            for path in chunk:
+                result = parsed.get(path)
+                spk = archive_spk(path, manifests, pattern)
+                self._forget(path)
+                size, mtime = on_disk[path]
+                if isinstance(result, Exception):
+                    failed += 1
+                    self.db.execute("INSERT INTO archives VALUES (?, ?, ?, ?, 0, ?)",
+                                    (path, size, mtime, spk, str(result)))
+                    continue
+                self.db.executemany("INSERT INTO flights VALUES (?, ?, ?, ?, ?)",
+                                    [(fid, height, spk, path, fn) for fn, fid, height in result])
+                self.db.execute("INSERT INTO archives VALUES (?, ?, ?, ?, ?, NULL)",
+                                (path, size, mtime, spk, len(result)))
+            self.db.commit()
+            print(f"Indexed {min(i + REFRESH_CHUNK, len(changed))}/{len(changed)} changed archives")
+        return len(changed), len(removed), failed
+
+    def _forget(self, path):
+        self.db.execute("DELETE FROM flights WHERE archive = ?", (path,))
+        self.db.execute("DELETE FROM archives WHERE path = ?", (path,))
+
+    def lookup(self, flight_ids):
+        """{FlightID: [(height, spk, archive)]}, oldest archive first."""
+        out = {}
+        flight_ids = list(flight_ids)
+        for i in range(0, len(flight_ids), LOOKUP_CHUNK):
+            chunk = flight_ids[i:i + LOOKUP_CHUNK]
+            rows = self.db.execute(
+                "SELECT f.flight_id, f.height, f.spk, f.archive FROM flights f "
+                "JOIN archives a ON a.path = f.archive "
+                f"WHERE f.flight_id IN ({','.join('?' * len(chunk))}) ORDER BY a.mtime",
+                chunk,
+            )
+            for fid, height, spk, archive in rows:
+                out.setdefault(fid, []).append((height, spk, archive))
+        return out
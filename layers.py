@@ -0,0 +1,111 @@
+"""Query several layers of one FeatureServer in a single request.
+
+The service-level FeatureServer/query takes a layerDefs list of per-layer
+filters and answers with one result per layer. It has no resultOffset, so
+a layer that hits maxRecordCount is re-fetched on its own with paging, and
+servers that do not offer the service-level query at all get one paged
+layer query per layer instead.
+"""
+import re
+
+import fastjson
+
+# service URLs whose root query is not supported; they get per-layer queries from then on
+_SERVICE_REFUSED = set()
+# what a server without the root query answers
+_UNSUPPORTED = re.compile(r"not supported|unsupported|invalid url|not found", re.IGNORECASE)
+
+
+def service_url(layer_url):
+    """…/FeatureServer/0 → …/FeatureServer"""
+    return re.sub(r"/FeatureServer/\d+/?$", "/FeatureServer", layer_url.rstrip("/"))
+
+
+def normalize_defs(defs, out_fields):
+    """{layer id: where or {"where", "outFields"}} → layerDefs list."""
+    out = []
+    for layer_id, d in defs.items():
+        if isinstance(d, str):
+            d = {"where": d}
+        out.append({"layerId": int(layer_id), "where": d.get("where") or "1=1",
+                    "outFields": d.get("outFields") or out_fields})
+    return out
+
+
+def refuses_root_query(r, js):
+    """True when the answer says FeatureServer/query is not offered, not merely that this request failed."""
+    if r.status_code in (404, 405, 501):
+        return True
+    err = js.get("error")
+    if not err:
+        # answered, but not in the service-level shape
+        return "layers" not in js
+    if err.get("code") in (404, 405, 501):
+        return True
+    return err.get("code") == 400 and bool(_UNSUPPORTED.search(str(err.get("message", ""))))
+
+
+def query_layer(session, layer_url, params):
+    """One layer's full result, following exceededTransferLimit with resultOffset."""
+    features, offset = [], 0
+    while True:
+        r = session.post(f"{layer_url}/query", data={**params, "resultOffset": offset} if offset else params)
+        r.raise_for_status()
+        js = r.json()
+        if "error" in js:
+            raise Exception(f"❌ Query failed on {layer_url}: {js['error']}")
+        if "features" not in js:
+            # count / ids answers are never paged
+            return js
+        features.extend(js["features"])
+        if not js["features"] or not js.get("exceededTransferLimit"):
+            js["features"] = features
+            js.pop("exceededTransferLimit", None)
+            return js
+        offset += len(js["features"])
+
+
+def query_layers(session, service, token, defs, out_fields="*", return_geometry=False,
+                 count_only=False, ids_only=False):
+    """{layer id: layer-shaped result} for every layer in defs, in as few requests as possible.
+
+    defs maps layer id to a WHERE clause or to {"where": ..., "outFields": ...}.
+    Results look like the layer-level query's: "features", "count" or
+    "objectIds", never truncated.
+    """
+    layer_defs = normalize_defs(defs, out_fields)
+    common = {
+        "f": "json",
+        "returnGeometry": "true" if return_geometry else "false",
+        "token": token,
+    }
+    if count_only:
+        common["returnCountOnly"] = "true"
+    elif ids_only:
+        common["returnIdsOnly"] = "true"
+
+    results = {}
+    if service not in _SERVICE_REFUSED:
+        r = session.post(f"{service}/query", data={**common, "layerDefs": fastjson.dumps(layer_defs)})
+        try:
+            js = r.json()
+        except ValueError:
+            js = {"error": {"code": r.status_code}}
+        if r.status_code != 200 and "error" not in js:
+            js = {"error": {"code": r.status_code}}
+        if refuses_root_query(r, js):
+            _SERVICE_REFUSED.add(service)
+        elif "error" not in js:
+            for layer in js["layers"]:
+                if not layer.get("exceededTransferLimit"):
+                    results[int(layer.pop("id"))] = layer
+
+    for d in layer_defs:
+        if d["layerId"] in results:
+            continue
+        params = {**common, "where": d["where"], "outFields": d["outFields"]}
+        if not (count_only or ids_only):
+            # resultOffset pages are only consistent over a fixed order
+            params["orderByFields"] = "OBJECTID"
+        results[d["layerId"]] = query_layer(session, f"{service}/{d['layerId']}", params)
+    return results
@@ -0,0 +1,732 @@
+#!/usr/bin/env python3
+"""Local stand-in for the portal token endpoint and the DroneSprayingVendor
+FeatureServer, serving an in-memory synthetic dataset.
+
+Paths mirror production, so pointing a script at http://HOST:PORT instead of
+https://maps.sinarmasforestry.com is enough:
+
+  /portal/sharing/rest/generateToken
+  /arcgis/rest/services/<folder>/<service>/FeatureServer[/query]
+  /arcgis/rest/services/<folder>/<service>/FeatureServer/<layer>[/query|/applyEdits|/deleteFeatures|/calculate]
+
+Extra endpoints for harnesses: GET /__stats, POST /__reset.
+"""
+import re
+import gzip
+import time
+import random
+import secrets
+import calendar
+import argparse
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pbf
+import fastjson
+import synthetic
+
+TOKEN_TTL_MS = 60 * 60 * 1000
+
+
+# --- WHERE clause evaluation ---
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<str>'(?:[^']|'')*')
+    | (?P<num>-?\d+(?:\.\d+)?)
+    | (?P<op><>|!=|<=|>=|=|<|>)
+    | (?P<punct>[(),])
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_.]*)
+    )""", re.VERBOSE)
+
+
+class WhereError(ValueError):
+    pass
+
+
+def tokenize(where):
+    pos, out = 0, []
+    where = where.strip()
+    while pos < len(where):
+        m = TOKEN_RE.match(where, pos)
+        if not m or m.end() == pos:
+            raise WhereError(f"cannot parse WHERE near: {where[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        val = m.group(kind)
+        if kind == "str":
+            val = val[1:-1].replace("''", "'")
+        elif kind == "num":
+            val = float(val) if "." in val else int(val)
+        elif kind == "ident":
+            val = val.upper() if val.upper() in KEYWORDS else val
+        out.append((kind, val))
+    return out
+
+
+KEYWORDS = {"AND", "OR", "NOT", "IS", "NULL", "LIKE", "IN", "LOWER", "UPPER", "DATE", "TIMESTAMP", "BETWEEN"}
+
+
+def like_regex(pattern):
+    out = []
+    for ch in pattern:
+        if ch == "%":
+            out.append(".*")
+        elif ch == "_":
+            out.append(".")
+        else:
+            out.append(re.escape(ch))
+    return re.compile("".join(out) + r"\Z", re.DOTALL)
+
+
+def to_epoch_ms(text):
+    t = time.strptime(text[:19], "%Y-%m-%d %H:%M:%S" if len(text) > 10 else "%Y-%m-%d")
+    return calendar.timegm(t) * 1000
+
+
+class WhereParser:
+    """Recursive-descent compiler from an ArcGIS SQL-92 subset to a predicate."""
+
+    def __init__(self, where, index):
+        self.toks = tokenize(where)
+        self.pos = 0
+        self.index = index
+
+    def peek(self, kind=None, val=None):
+        if self.pos >= len(self.toks):
+            return False
+        k, v = self.toks[self.pos]
+        return (kind is None or k == kind) and (val is None or v == val)
+
+    def take(self, kind=None, val=None):
+        if not self.peek(kind, val):
+            got = self.toks[self.pos] if self.pos < len(self.toks) else "end of clause"
+            raise WhereError(f"expected {val or kind}, got {got}")
+        tok = self.toks[self.pos]
+        self.pos += 1
+        return tok[1]
+
+    def compile(self):
+        if not self.toks:
+            return lambda row: True
+        pred = self.or_()
+        if self.pos != len(self.toks):
+            raise WhereError(f"unexpected {self.toks[self.pos][1]!r}")
+        return pred
+
+    def or_(self):
+        parts = [self.and_()]
+        while self.peek("ident", "OR"):
+            self.take()
+            parts.append(self.and_())
+        return parts[0] if len(parts) == 1 else (lambda row: any(p(row) for p in parts))
+
+    def and_(self):
+        parts = [self.not_()]
+        while self.peek("ident", "AND"):
+            self.take()
+            parts.append(self.not_())
+        return parts[0] if len(parts) == 1 else (lambda row: all(p(row) for p in parts))
+
+    def not_(self):
+        if self.peek("ident", "NOT"):
+            self.take()
+            inner = self.not_()
+            return lambda row: not inner(row)
+        if self.peek("punct", "("):
+            # a parenthesised sub-expression, unless it is an operand like (1)
+            save = self.pos
+            self.take()
+            try:
+                inner = self.or_()
+                self.take("punct", ")")
+                return inner
+            except WhereError:
+                self.pos = save
+        return self.comparison()
+
+    def operand(self):
+        if self.peek("str") or self.peek("num"):
+            v = self.take()
+            return lambda row: v
+        if self.peek("ident", "NULL"):
+            self.take()
+            return lambda row: None
+        if self.peek("ident", "DATE") or self.peek("ident", "TIMESTAMP"):
+            self.take()
+            v = to_epoch_ms(self.take("str"))
+            return lambda row: v
+        if self.peek("ident", "LOWER") or self.peek("ident", "UPPER"):
+            fn = str.lower if self.take() == "LOWER" else str.upper
+            self.take("punct", "(")
+            inner = self.operand()
+            self.take("punct", ")")
+            return lambda row: None if inner(row) is None else fn(str(inner(row)))
+        if self.peek("punct", "("):
+            self.take()
+            inner = self.operand()
+            self.take("punct", ")")
+            return inner
+        name = self.take("ident")
+        idx = self.index.get(name.lower())
+        if idx is None:
+            raise WhereError(f"unknown field {name!r}")
+        return lambda row: row[idx]
+
+    def comparison(self):
+        left = self.operand()
+        negate = False
+        if self.peek("ident", "IS"):
+            self.take()
+            if self.peek("ident", "NOT"):
+                self.take()
+                negate = True
+            self.take("ident", "NULL")
+            return (lambda row: left(row) is not None) if negate else (lambda row: left(row) is None)
+        if self.peek("ident", "NOT"):
+            self.take()
+            negate = True
+        if self.peek("ident", "LIKE"):
+            self.take()
+            rx = like_regex(str(self.take("str")))
+
+            def like(row):
+                v = left(row)
+                return v is not None and (rx.match(str(v)) is not None) != negate
+            return like
+        if self.peek("ident", "IN"):
+            self.take()
+            self.take("punct", "(")
+            values = [self.operand()(None)]
+            while self.peek("punct", ","):
+                self.take()
+                values.append(self.operand()(None))
+            self.take("punct", ")")
+            values = set(values)
+
+            def in_(row):
+                v = left(row)
+                return v is not None and (v in values) != negate
+            return in_
+        if self.peek("ident", "BETWEEN"):
+            self.take()
+            lo = self.operand()
+            self.take("ident", "AND")
+            hi = self.operand()
+
+            def between(row):
+                v = left(row)
+                return v is not None and (lo(row) <= v <= hi(row)) != negate
+            return between
+        op = self.take("op")
+        right = self.operand()
+        cmp = {
+            "=": lambda a, b: a == b, "<>": lambda a, b: a != b, "!=": lambda a, b: a != b,
+            "<": lambda a, b: a < b, ">": lambda a, b: a > b,
+            "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b,
+        }[op]
+
+        def compare(row):
+            a, b = left(row), right(row)
+            if a is None or b is None:
+                return False
+            try:
+                return cmp(a, b)
+            except TypeError:
+                return cmp(str(a), str(b))
+        return compare
+
+
+# --- dataset ---
+
+class FeatureStore:
+    """In-memory layer: rows are lists in FIELDS order, keyed by OBJECTID."""
+
+    def __init__(self, count, seed=0, users=(synthetic.DEFAULT_USER,), max_record_count=2000, reupload_rate=0.0):
+        self.count, self.seed, self.users = count, seed, users
+        self.reupload_rate = reupload_rate
+        self.max_record_count = max_record_count
+        self.fields = list(synthetic.FIELDS)
+        self.index = {f.lower(): i for i, f in enumerate(self.fields)}
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        rows, shapes = synthetic.generate_rows(self.count, self.seed, self.users,
+                                               reupload_rate=self.reupload_rate)
+        with self.lock:
+            self.rows = {r[0]: r for r in rows}
+            self.shapes = {r[0]: s for r, s in zip(rows, shapes)}
+            self.next_oid = self.count + 1
+
+    def metadata(self, layer_id):
+        return {
+            "id": layer_id,
+            "name": "DroneSprayingVendor",
+            "type": "Feature Layer",
+            "geometryType": "esriGeometryPolygon",
+            "objectIdField": "OBJECTID",
+            "maxRecordCount": self.max_record_count,
+            "supportsCalculate": True,
+            "advancedQueryCapabilities": {
+                "supportsPagination": True,
+                "supportsStatistics": True,
+                "supportsDistinct": True,
+                "supportsOrderBy": True,
+            },
+            "fields": [{"name": f, "type": synthetic.FIELD_TYPES[f]} for f in self.fields],
+        }
+
+    def resolve_fields(self, out_fields):
+        if not out_fields or out_fields.strip() == "*":
+            return list(self.fields)
+        out = []
+        for name in out_fields.split(","):
+            name = name.strip()
+            if name.lower() not in self.index:
+                raise WhereError(f"unknown field {name!r}")
+            out.append(self.fields[self.index[name.lower()]])
+        return out
+
+    def select(self, params):
+        pred = WhereParser(params.get("where") or "1=1", self.index).compile()
+        oids = params.get("objectIds")
+        with self.lock:
+            if oids:
+                wanted = [int(o) for o in str(oids).split(",") if o.strip()]
+                rows = [self.rows[o] for o in wanted if o in self.rows]
+            else:
+                rows = list(self.rows.values())
+        return [r for r in rows if pred(r)]
+
+    def order(self, rows, order_by):
+        if not order_by:
+            return rows
+        for part in reversed([p.strip() for p in order_by.split(",") if p.strip()]):
+            bits = part.split()
+            idx = self.index[bits[0].lower()]
+            desc = len(bits) > 1 and bits[1].upper() == "DESC"
+            rows = sorted(rows, key=lambda r: (r[idx] is None, r[idx]), reverse=desc)
+        return rows
+
+    def feature(self, row, fields, with_geometry):
+        feat = {"attributes": {f: row[self.index[f.lower()]] for f in fields}}
+        if with_geometry:
+            feat["geometry"] = {"rings": [synthetic.ring(self.shapes[row[0]])]}
+        return feat
+
+    def query(self, params):
+        rows = self.select(params)
+        truthy = lambda k: str(params.get(k, "")).lower() == "true"
+
+        if truthy("returnCountOnly"):
+            return {"count": len(rows)}
+        if truthy("returnIdsOnly"):
+            return {"objectIdFieldName": "OBJECTID", "objectIds": [r[0] for r in rows]}
+        if params.get("outStatistics"):
+            return self.statistics(rows, params)
+
+        fields = self.resolve_fields(params.get("outFields"))
+        if truthy("returnDistinctValues"):
+            seen, distinct = set(), []
+            for r in rows:
+                key = tuple(r[self.index[f.lower()]] for f in fields)
+                if key not in seen:
+                    seen.add(key)
+                    distinct.append(r)
+            rows = distinct
+
+        rows = self.order(rows, params.get("orderByFields"))
+        offset = int(params.get("resultOffset") or 0)
+        limit = min(int(params.get("resultRecordCount") or self.max_record_count), self.max_record_count)
+        page = rows[offset:offset + limit]
+        with_geometry = str(params.get("returnGeometry", "true")).lower() != "false"
+        out = {
+            "objectIdFieldName": "OBJECTID",
+            "geometryType": "esriGeometryPolygon",
+            "fields": [{"name": f, "type": synthetic.FIELD_TYPES[f]} for f in fields],
+            "features": [self.feature(r, fields, with_geometry) for r in page],
+        }
+        if offset + limit < len(rows):
+            out["exceededTransferLimit"] = True
+        return out
+
+    def statistics(self, rows, params):
+        stats = fastjson.loads(params["outStatistics"])
+        group_by = [g.strip() for g in (params.get("groupByFieldsForStatistics") or "").split(",") if g.strip()]
+        gidx = [self.index[g.lower()] for g in group_by]
+        groups = defaultdict(list)
+        for r in rows:
+            groups[tuple(r[i] for i in gidx)].append(r)
+        if not group_by and not groups:
+            groups[()] = []
+
+        features = []
+        for key, members in groups.items():
+            attrs = dict(zip(group_by, key))
+            for st in stats:
+                idx = self.index[st["onStatisticField"].lower()]
+                vals = [r[idx] for r in members if r[idx] is not None]
+                kind = st["statisticType"].lower()
+                name = st.get("outStatisticFieldName") or f"{kind}_{st['onStatisticField']}"
+                if kind == "count":
+                    attrs[name] = len(vals)
+                elif kind == "sum":
+                    attrs[name] = sum(vals) if vals else None
+                elif kind == "min":
+                    attrs[name] = min(vals) if vals else None
+                elif kind == "max":
+                    attrs[name] = max(vals) if vals else None
+                elif kind == "avg":
+                    attrs[name] = sum(vals) / len(vals) if vals else None
+                else:
+                    raise WhereError(f"unsupported statisticType {kind!r}")
+            features.append({"attributes": attrs})
+        return {"features": features}
+
+    def apply_edits(self, params):
+        out = {"addResults": [], "updateResults": [], "deleteResults": []}
+        with self.lock:
+            for feat in fastjson.loads(params.get("adds") or "[]"):
+                oid = self.next_oid
+                self.next_oid += 1
+                attrs = {k.lower(): v for k, v in feat.get("attributes", {}).items()}
+                row = [attrs.get(f.lower()) for f in self.fields]
+                row[0] = oid
+                self.rows[oid] = row
+                self.shapes[oid] = shape_from_geometry(feat.get("geometry"))
+                out["addResults"].append({"objectId": oid, "success": True})
+
+            for feat in fastjson.loads(params.get("updates") or "[]"):
+                attrs = feat.get("attributes", {})
+                oid = attrs.get("OBJECTID")
+                row = self.rows.get(oid)
+                if row is None:
+                    out["updateResults"].append({"objectId": oid, "success": False,
+                                                 "error": {"code": 1019, "description": "Object is missing."}})
+                    continue
+                for k, v in attrs.items():
+                    idx = self.index.get(k.lower())
+                    if idx:  # never rewrite OBJECTID (index 0)
+                        row[idx] = v
+                if feat.get("geometry"):
+                    self.shapes[oid] = shape_from_geometry(feat["geometry"])
+                out["updateResults"].append({"objectId": oid, "success": True})
+
+            deletes = params.get("deletes") or ""
+            if deletes.startswith("["):
+                deletes = ",".join(str(d) for d in fastjson.loads(deletes))
+            for oid in (int(d) for d in deletes.split(",") if d.strip()):
+                ok = self.rows.pop(oid, None) is not None
+                self.shapes.pop(oid, None)
+                res = {"objectId": oid, "success": ok}
+                if not ok:
+                    res["error"] = {"code": 1019, "description": "Object is missing."}
+                out["deleteResults"].append(res)
+        return out
+
+    def delete_features(self, params):
+        with self.lock:
+            oids = [r[0] for r in self.select(params)]
+            for oid in oids:
+                self.rows.pop(oid, None)
+                self.shapes.pop(oid, None)
+        return {"deleteResults": [{"objectId": oid, "success": True} for oid in oids]}
+
+    def calculate(self, params):
+        exprs = fastjson.loads(params.get("calcExpression") or "[]")
+        with self.lock:
+            rows = self.select(params)
+            for r in rows:
+                for ex in exprs:
+                    r[self.index[ex["field"].lower()]] = ex.get("value")
+        return {"success": True, "updatedFeatureCount": len(rows)}
+
+
+def shape_from_geometry(geom):
+    if not geom or not geom.get("rings"):
+        return (0.0, 0.0, 0.0, 0.0)
+    pts = [p for ring in geom["rings"] for p in ring]
+    xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+    return (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+
+def query_pbf(result):
+    """Encode a query() result dict as a FeatureCollection protocol buffer."""
+    if "count" in result:
+        return pbf.encode_count(result["count"])
+    if "objectIds" in result:
+        return pbf.encode_object_ids(result["objectIds"])
+    features = result.get("features", [])
+    fields = result.get("fields")
+    if fields is None:
+        # statistics results carry no field list
+        sample = features[0]["attributes"] if features else {}
+        fields = [{"name": k, "type": "esriFieldTypeDouble" if isinstance(v, float) else
+                   "esriFieldTypeInteger" if isinstance(v, int) else "esriFieldTypeString"}
+                  for k, v in sample.items()]
+    geometry_type = result.get("geometryType") if any("geometry" in f for f in features) else None
+    return pbf.encode_feature_result(fields, features, exceeded=result.get("exceededTransferLimit", False),
+                                     geometry_type=geometry_type)
+
+
+# --- HTTP ---
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.by_endpoint = defaultdict(lambda: {"requests": 0, "bytes_in": 0, "bytes_out": 0, "errors": 0})
+
+    def record(self, endpoint, bytes_in, bytes_out, error):
+        with self.lock:
+            s = self.by_endpoint[endpoint]
+            s["requests"] += 1
+            s["bytes_in"] += bytes_in
+            s["bytes_out"] += bytes_out
+            s["errors"] += int(error)
+
+    def snapshot(self):
+        with self.lock:
+            per = {k: dict(v) for k, v in self.by_endpoint.items()}
+        total = {k: sum(v[k] for v in per.values()) for k in ("requests", "bytes_in", "bytes_out", "errors")}
+        return {"total": total, "endpoints": per}
+
+
+def service_query(layers, params):
+    """Service-level FeatureServer/query: one layer query per layerDefs entry.
+
+    Like the real endpoint it has no resultOffset, so a layer with more
+    matches than maxRecordCount comes back with exceededTransferLimit.
+    """
+    defs = fastjson.loads(params.get("layerDefs") or "{}")
+    if isinstance(defs, dict):
+        defs = [{"layerId": k, "where": v} for k, v in defs.items()]
+    out = []
+    for d in defs:
+        layer_id = int(d["layerId"])
+        if layer_id not in layers:
+            raise KeyError(f"layer {layer_id} does not exist")
+        sub = {k: params[k] for k in ("returnGeometry", "returnCountOnly", "returnIdsOnly") if k in params}
+        sub["where"] = d.get("where") or "1=1"
+        sub["outFields"] = d.get("outFields") or params.get("outFields") or "*"
+        out.append({"id": layer_id, **layers[layer_id].query(sub)})
+    return {"layers": out}
+
+
+def service_metadata(layers):
+    return {"layers": [{"id": i, "name": f"DroneSprayingVendor_{i}"} for i in sorted(layers)],
+            "supportsQueryDataElements": False}
+
+
+FS_PATH_RE = re.compile(r"/FeatureServer/(?P<layer>\d+)(?:/(?P<op>\w+))?/?$")
+FS_ROOT_RE = re.compile(r"/FeatureServer(?:/(?P<op>query))?/?$")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "MockFeatureServer/1.0"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def do_GET(self):
+        self.dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            if not self.server.gzip_requests:
+                return self.reply({"error": {"code": 415, "message": "Unsupported Content-Encoding"}},
+                                  status=415, endpoint="other", bytes_in=len(self.requestline) + length)
+            body = gzip.decompress(body)
+        self.dispatch(parse_qs(body.decode("utf-8"), keep_blank_values=True), length)
+
+    def dispatch(self, form, body_len=0):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        params.update({k: v[-1] for k, v in form.items()})
+        bytes_in = len(self.requestline) + body_len
+
+        if url.path == "/__stats":
+            return self.reply(self.server.stats.snapshot(), record=False)
+        if url.path == "/__reset":
+            if params.get("data", "true") != "false":
+                for store in self.server.layers.values():
+                    store.reset()
+            self.server.stats.reset()
+            return self.reply({"success": True}, record=False)
+
+        srv = self.server
+        if srv.latency_ms or srv.jitter_ms:
+            time.sleep((srv.latency_ms + random.uniform(0, srv.jitter_ms)) / 1000.0)
+
+        if url.path.endswith("/generateToken"):
+            endpoint, handler = "generateToken", self.generate_token
+        else:
+            m = FS_PATH_RE.search(url.path)
+            root = None if m else FS_ROOT_RE.search(url.path)
+            if not m and not root:
+                return self.reply({"error": {"code": 404, "message": "Not found"}}, status=404,
+                                  endpoint="other", bytes_in=bytes_in)
+            if root:
+                op = root.group("op") or "layer"
+                endpoint = op
+                handler = {
+                    "layer": lambda p: service_metadata(srv.layers),
+                    "query": (lambda p: service_query(srv.layers, p)) if srv.service_query else None,
+                }.get(op)
+            else:
+                op = m.group("op") or "layer"
+                endpoint = op
+                store = srv.layers.get(int(m.group("layer")))
+                if store is None:
+                    return self.reply({"error": {"code": 400, "message": "Invalid or missing input parameters.",
+                                                 "details": [f"layer {m.group('layer')} does not exist"]}},
+                                      status=400, endpoint=endpoint, bytes_in=bytes_in)
+                handler = {
+                    "layer": lambda p: store.metadata(int(m.group("layer"))),
+                    "query": store.query,
+                    "applyEdits": store.apply_edits,
+                    "deleteFeatures": store.delete_features,
+                    "calculate": store.calculate if srv.calculate else None,
+                }.get(op)
+            if handler is None:
+                return self.reply({"error": {"code": 400, "message": f"Operation '{op}' not supported"}},
+                                  status=400, endpoint=endpoint, bytes_in=bytes_in)
+            if op != "layer" and srv.require_token and params.get("token") not in srv.tokens:
+                return self.reply({"error": {"code": 498, "message": "Invalid token."}},
+                                  endpoint=endpoint, bytes_in=bytes_in, error=True)
+
+        if srv.error_rate and random.random() < srv.error_rate and endpoint in srv.error_endpoints:
+            if random.random() < 0.5:
+                return self.reply({"error": {"code": 500, "message": "Injected failure"}}, status=500,
+                                  endpoint=endpoint, bytes_in=bytes_in, error=True)
+            return self.reply({"error": {"code": 500, "message": "Injected failure"}},
+                              endpoint=endpoint, bytes_in=bytes_in, error=True)
+
+        want_pbf = params.get("f") == "pbf"
+        if want_pbf and (endpoint != "query" or not srv.pbf or root):
+            return self.reply({"error": {"code": 400, "message": "Invalid or missing input parameters.",
+                                         "details": ["'f' parameter is invalid"]}},
+                              status=400, endpoint=endpoint, bytes_in=bytes_in)
+
+        try:
+            result = handler(params)
+        except (WhereError, KeyError, ValueError) as e:
+            return self.reply({"error": {"code": 400, "message": "Unable to complete operation.",
+                                         "details": [str(e)]}},
+                              endpoint=endpoint, bytes_in=bytes_in, error=True)
+        if want_pbf:
+            return self.reply_bytes(query_pbf(result), "application/x-protobuf",
+                                    endpoint=endpoint, bytes_in=bytes_in)
+        self.reply(result, endpoint=endpoint, bytes_in=bytes_in)
+
+    def generate_token(self, params):
+        if not (params.get("username") or params.get("token")):
+            return {"error": {"code": 400, "message": "Unable to generate token."}}
+        token = secrets.token_urlsafe(24)
+        self.server.tokens.add(token)
+        self.set_cookie = f"AGS_ROLES={secrets.token_hex(16)}; Path=/"
+        return {"token": token, "expires": int(time.time() * 1000) + TOKEN_TTL_MS, "ssl": False}
+
+    def reply(self, obj, status=200, endpoint=None, bytes_in=0, error=False, record=True):
+        body = fastjson.dumpb(obj)
+        self.reply_bytes(body, "application/json; charset=utf-8", status, endpoint, bytes_in, error, record)
+
+    def reply_bytes(self, body, content_type, status=200, endpoint=None, bytes_in=0, error=False, record=True):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        cookie = getattr(self, "set_cookie", None)
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+            self.set_cookie = None
+        self.end_headers()
+        # counted before the client can see the answer, so a /__stats right after it includes it
+        if record:
+            self.server.stats.record(endpoint, bytes_in, len(body), error or status >= 400)
+        self.wfile.write(body)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, store, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 error_endpoints=("query", "applyEdits", "deleteFeatures", "calculate"),
+                 calculate=True, pbf=True, gzip_requests=True, require_token=True, verbose=False,
+                 service_query=True):
+        super().__init__(addr, Handler)
+        # one FeatureStore, or {layer id: FeatureStore} for a multi-layer service
+        self.layers = store if isinstance(store, dict) else {0: store}
+        self.store = self.layers[min(self.layers)]
+        self.service_query = service_query
+        self.stats = Stats()
+        self.tokens = set()
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.error_rate, self.error_endpoints = error_rate, set(error_endpoints)
+        self.calculate = calculate
+        self.pbf = pbf
+        self.gzip_requests = gzip_requests
+        self.require_token = require_token
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline mock of the token endpoint and FeatureServer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--features", type=int, default=1000, help="synthetic dataset size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--user", action="append", default=[], help="UserID(s) to spread features over")
+    parser.add_argument("--max-record-count", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fixed delay per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform random delay per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-endpoint", action="append", default=[],
+                        help="limit injected failures to these endpoints (query, applyEdits, …)")
+    parser.add_argument("--no-calculate", action="store_true", help="reject the calculate operation")
+    parser.add_argument("--no-pbf", action="store_true", help="reject f=pbf queries")
+    parser.add_argument("--no-gzip-requests", action="store_true", help="reject gzip-encoded request bodies")
+    parser.add_argument("--reupload-rate", type=float, default=0.0,
+                        help="fraction of flights re-uploaded under a new FlightID")
+    parser.add_argument("--layers", type=int, default=1,
+                        help="layers in the service; layer N is generated with seed + N")
+    parser.add_argument("--no-service-query", action="store_true",
+                        help="reject the service-level FeatureServer/query")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    print(f"Generating {args.features} features …")
+    users = tuple(args.user) or (synthetic.DEFAULT_USER,)
+    store = {n: FeatureStore(args.features, args.seed + n, users, args.max_record_count, args.reupload_rate)
+             for n in range(max(1, args.layers))}
+    kwargs = {}
+    if args.error_endpoint:
+        kwargs["error_endpoints"] = args.error_endpoint
+    server = MockServer((args.host, args.port), store, args.latency_ms, args.jitter_ms, args.error_rate,
+                        calculate=not args.no_calculate, pbf=not args.no_pbf,
+                        gzip_requests=not args.no_gzip_requests, verbose=args.verbose,
+                        service_query=not args.no_service_query, **kwargs)
+    print(f"Serving on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
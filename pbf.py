@@ -0,0 +1,460 @@
+"""Esri FeatureCollection protocol buffer (f=pbf) support.
+
+A small wire-format codec for the parts of FeatureCollection.proto that
+FeatureServer query returns: feature results (fields, attributes,
+quantized geometry), counts and objectId lists. No protobuf runtime is
+needed.
+
+query() asks for f=pbf and falls back to f=json when the server refuses,
+always returning the same dict shape as the JSON response.
+"""
+import re
+import struct
+
+DOUBLE = struct.Struct("<d")
+
+# FeatureCollection.proto FieldType enum
+FIELD_TYPES = [
+    "esriFieldTypeSmallInteger", "esriFieldTypeInteger", "esriFieldTypeSingle",
+    "esriFieldTypeDouble", "esriFieldTypeString", "esriFieldTypeDate",
+    "esriFieldTypeOID", "esriFieldTypeGeometry", "esriFieldTypeBlob",
+    "esriFieldTypeRaster", "esriFieldTypeGUID", "esriFieldTypeGlobalID",
+    "esriFieldTypeXML",
+]
+GEOMETRY_TYPES = {
+    0: "esriGeometryPoint", 1: "esriGeometryMultipoint", 2: "esriGeometryPolyline",
+    3: "esriGeometryPolygon", 4: "esriGeometryMultipatch", 127: None,
+}
+
+# URLs whose server refused f=pbf; later queries go straight to JSON
+_PBF_REFUSED = set()
+# what an unsupported-format answer says ("'f' parameter is invalid", "Invalid format", …)
+_REFUSAL = re.compile(r"'f' parameter|\bformat\b|\bpbf\b", re.IGNORECASE)
+
+
+class PbfError(ValueError):
+    pass
+
+
+# --- wire format ---
+
+def read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise PbfError("varint too long")
+
+
+def zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def iter_fields(buf, start=0, end=None):
+    """Yield (field_number, wire_type, value) for one message.
+
+    Length-delimited values are returned as (start, end) offsets into buf
+    so nested messages are decoded without copying.
+    """
+    pos = start
+    end = len(buf) if end is None else end
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            val, pos = read_varint(buf, pos)
+        elif wire == 2:
+            size, pos = read_varint(buf, pos)
+            val = (pos, pos + size)
+            pos += size
+        elif wire == 1:
+            val = buf[pos:pos + 8]
+            pos += 8
+        elif wire == 5:
+            val = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise PbfError(f"unsupported wire type {wire}")
+        yield field, wire, val
+
+
+def packed_varints(buf, wire, val):
+    if wire == 0:
+        return [val]
+    out = []
+    pos, end = val
+    while pos < end:
+        v, pos = read_varint(buf, pos)
+        out.append(v)
+    return out
+
+
+def text(buf, span):
+    return bytes(buf[span[0]:span[1]]).decode("utf-8")
+
+
+# --- decoding ---
+
+def decode_value(buf, start, end):
+    for field, wire, val in iter_fields(buf, start, end):
+        if field == 1:
+            return text(buf, val)
+        if field == 2:
+            return struct.unpack("<f", val)[0]
+        if field == 3:
+            return struct.unpack("<d", val)[0]
+        if field == 4 or field == 8:
+            return zigzag(val)
+        if field in (5, 7):
+            return val
+        if field == 6:
+            return val - (1 << 64) if val >= 1 << 63 else val
+        if field == 9:
+            return bool(val)
+    return None  # an empty Value is a NULL attribute
+
+
+def decode_doubles(buf, span):
+    out = {}
+    for field, wire, val in iter_fields(buf, *span):
+        if wire == 1:
+            out[field] = struct.unpack("<d", val)[0]
+    return out
+
+
+def decode_transform(buf, span):
+    t = {"upper_left": False, "scale": (1.0, 1.0), "translate": (0.0, 0.0)}
+    for field, wire, val in iter_fields(buf, *span):
+        if field == 1:
+            t["upper_left"] = val == 0  # esriQuantizeOriginPostionUpperLeft
+        elif field == 2:
+            d = decode_doubles(buf, val)
+            t["scale"] = (d.get(1, 1.0), d.get(2, 1.0))
+        elif field == 3:
+            d = decode_doubles(buf, val)
+            t["translate"] = (d.get(1, 0.0), d.get(2, 0.0))
+    return t
+
+
+def decode_geometry(buf, span, geometry_type, transform):
+    lengths, coords = [], []
+    for field, wire, val in iter_fields(buf, *span):
+        if field == 2:
+            lengths.extend(packed_varints(buf, wire, val))
+        elif field == 3:
+            coords.extend(zigzag(v) for v in packed_varints(buf, wire, val))
+
+    sx, sy = transform["scale"] if transform else (1.0, 1.0)
+    tx, ty = transform["translate"] if transform else (0.0, 0.0)
+    flip = transform["upper_left"] if transform else False
+    points, x, y = [], 0, 0
+    for i in range(0, len(coords) - 1, 2):
+        x += coords[i]
+        y += coords[i + 1]
+        points.append([x * sx + tx, ty - y * sy if flip else y * sy + ty])
+
+    if geometry_type == "esriGeometryPoint":
+        return {"x": points[0][0], "y": points[0][1]} if points else None
+    if geometry_type == "esriGeometryMultipoint":
+        return {"points": points}
+    parts, pos = [], 0
+    for n in lengths or [len(points)]:
+        parts.append(points[pos:pos + n])
+        pos += n
+    key = "rings" if geometry_type == "esriGeometryPolygon" else "paths"
+    return {key: parts}
+
+
+def decode_feature_result(buf, start, end):
+    out = {"fields": [], "features": []}
+    raw_features = []
+    geometry_type, transform = None, None
+    for field, wire, val in iter_fields(buf, start, end):
+        if field == 1:
+            out["objectIdFieldName"] = text(buf, val)
+        elif field == 7:
+            geometry_type = GEOMETRY_TYPES.get(val)
+        elif field == 9:
+            if val:
+                out["exceededTransferLimit"] = True
+        elif field == 12:
+            transform = decode_transform(buf, val)
+        elif field == 13:
+            f = {}
+            for ff, _, fv in iter_fields(buf, *val):
+                if ff == 1:
+                    f["name"] = text(buf, fv)
+                elif ff == 2:
+                    f["type"] = FIELD_TYPES[fv] if fv < len(FIELD_TYPES) else fv
+                elif ff == 3:
+                    f["alias"] = text(buf, fv)
+            out["fields"].append(f)
+        elif field == 15:
+            raw_features.append(val)
+
+    if geometry_type:
+        out["geometryType"] = geometry_type
+    names = [f["name"] for f in out["fields"]]
+    for fs, fe in raw_features:
+        values, geometry = decode_feature(buf, fs, fe, geometry_type, transform)
+        feat = {"attributes": dict(zip(names, values))}
+        if geometry is not None:
+            feat["geometry"] = geometry
+        out["features"].append(feat)
+    return out
+
+
+def decode_feature(buf, pos, end, geometry_type, transform):
+    """(attribute values, geometry) of one Feature message.
+
+    This is the hot loop of a large pull, so the common single-byte keys and
+    lengths and the string/sint64/double Values are decoded inline; anything
+    else goes through the generic path.
+    """
+    values, geometry = [], None
+    unpack_double = DOUBLE.unpack_from
+    while pos < end:
+        key = buf[pos]
+        size = buf[pos + 1]
+        pos += 2
+        if size & 0x80:
+            size, pos = read_varint(buf, pos - 1)
+        vend = pos + size
+        if key == 0x0A:  # attributes: Value
+            if size == 0:
+                values.append(None)
+            else:
+                vk = buf[pos]
+                if vk == 0x0A:  # string_value
+                    n = buf[pos + 1]
+                    p = pos + 2
+                    if n & 0x80:
+                        n, p = read_varint(buf, pos + 1)
+                    values.append(str(buf[p:p + n], "utf-8"))
+                elif vk == 0x40 or vk == 0x20:  # sint64_value / sint_value
+                    n, _ = read_varint(buf, pos + 1)
+                    values.append((n >> 1) ^ -(n & 1))
+                elif vk == 0x19:  # double_value
+                    values.append(unpack_double(buf, pos + 1)[0])
+                else:
+                    values.append(decode_value(buf, pos, vend))
+        elif key == 0x12:  # geometry
+            geometry = decode_geometry(buf, (pos, vend), geometry_type, transform)
+        pos = vend
+    return values, geometry
+
+
+def decode(data):
+    """Decode a FeatureCollectionPBuffer into the f=json response shape."""
+    buf = bytes(data)
+    for field, wire, val in iter_fields(buf):
+        if field != 2:
+            continue
+        for qf, qw, qv in iter_fields(buf, *val):
+            if qf == 1:
+                return decode_feature_result(buf, *qv)
+            if qf == 2:
+                count = 0
+                for cf, _, cv in iter_fields(buf, *qv):
+                    if cf == 1:
+                        count = cv
+                return {"count": count}
+            if qf == 3:
+                out = {"objectIds": []}
+                for of, ow, ov in iter_fields(buf, *qv):
+                    if of == 1:
+                        out["objectIdFieldName"] = text(buf, ov)
+                    elif of == 3:
+                        out["objectIds"].extend(packed_varints(buf, ow, ov))
+                return out
+    raise PbfError("no queryResult in FeatureCollection")
+
+
+# --- encoding (used by mock_featureserver.py) ---
+
+def write_varint(out, n):
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return
+
+
+def write_key(out, field, wire):
+    write_varint(out, (field << 3) | wire)
+
+
+def write_bytes(out, field, payload):
+    write_key(out, field, 2)
+    write_varint(out, len(payload))
+    out += payload
+
+
+def write_string(out, field, s):
+    write_bytes(out, field, s.encode("utf-8"))
+
+
+def write_uint(out, field, n):
+    write_key(out, field, 0)
+    write_varint(out, n)
+
+
+def encode_value(v):
+    out = bytearray()
+    if v is None:
+        return out
+    if isinstance(v, bool):
+        write_uint(out, 9, int(v))
+    elif isinstance(v, int):
+        write_uint(out, 8, (v << 1) ^ (v >> 63))
+    elif isinstance(v, float):
+        write_key(out, 3, 1)
+        out += struct.pack("<d", v)
+    else:
+        write_string(out, 1, str(v))
+    return out
+
+
+def encode_packed(values):
+    out = bytearray()
+    for v in values:
+        write_varint(out, v)
+    return out
+
+
+def encode_geometry(parts, scale, translate):
+    """Quantize parts (lists of [x, y]) with upper-left origin delta encoding."""
+    lengths, coords = [], []
+    px = py = 0
+    for part in parts:
+        lengths.append(len(part))
+        for x, y in part:
+            qx = int(round((x - translate[0]) / scale[0]))
+            qy = int(round((translate[1] - y) / scale[1]))
+            for d in (qx - px, qy - py):
+                coords.append((d << 1) ^ (d >> 63))
+            px, py = qx, qy
+    out = bytearray()
+    write_bytes(out, 2, encode_packed(lengths))
+    write_bytes(out, 3, encode_packed(coords))
+    return out
+
+
+def encode_feature_result(fields, features, object_id_field="OBJECTID", exceeded=False,
+                          geometry_type=None, scale=(1e-8, 1e-8), translate=(-400.0, 400.0)):
+    """FeatureCollectionPBuffer bytes for a feature query result.
+
+    features are f=json style dicts; polygon/polyline geometry is quantized
+    with the given scale/translate (the defaults keep 1e-8 degree precision).
+    """
+    fr = bytearray()
+    write_string(fr, 1, object_id_field)
+    gt = {v: k for k, v in GEOMETRY_TYPES.items()}.get(geometry_type, 127)
+    write_uint(fr, 7, gt)
+    if exceeded:
+        write_uint(fr, 9, 1)
+    if geometry_type:
+        tr = bytearray()
+        write_uint(tr, 1, 0)
+        sc = bytearray()
+        for i, v in enumerate(scale, start=1):
+            write_key(sc, i, 1)
+            sc += struct.pack("<d", v)
+        write_bytes(tr, 2, sc)
+        tl = bytearray()
+        for i, v in enumerate(translate, start=1):
+            write_key(tl, i, 1)
+            tl += struct.pack("<d", v)
+        write_bytes(tr, 3, tl)
+        write_bytes(fr, 12, tr)
+    for f in fields:
+        fb = bytearray()
+        write_string(fb, 1, f["name"])
+        write_uint(fb, 2, FIELD_TYPES.index(f["type"]))
+        write_bytes(fr, 13, fb)
+    names = [f["name"] for f in fields]
+    for feat in features:
+        fb = bytearray()
+        attrs = feat["attributes"]
+        for n in names:
+            write_bytes(fb, 1, encode_value(attrs.get(n)))
+        geom = feat.get("geometry")
+        if geom:
+            parts = geom.get("rings") or geom.get("paths") or []
+            write_bytes(fb, 2, encode_geometry(parts, scale, translate))
+        write_bytes(fr, 15, fb)
+    return wrap_query_result(1, fr)
+
+
+def encode_count(count):
+    body = bytearray()
+    write_uint(body, 1, count)
+    return wrap_query_result(2, body)
+
+
+def encode_object_ids(oids, object_id_field="OBJECTID"):
+    body = bytearray()
+    write_string(body, 1, object_id_field)
+    write_bytes(body, 3, encode_packed(oids))
+    return wrap_query_result(3, body)
+
+
+def wrap_query_result(kind, body):
+    qr = bytearray()
+    write_bytes(qr, kind, body)
+    out = bytearray()
+    write_string(out, 1, "1.0")
+    write_bytes(out, 2, qr)
+    return bytes(out)
+
+
+# --- client ---
+
+def refuses_pbf(r, ctype):
+    """True when the response says f=pbf is not supported, not merely that this request failed."""
+    if r.status_code >= 500 or r.status_code in (401, 403):
+        return False
+    if "json" in ctype:
+        try:
+            err = r.json().get("error") or {}
+        except (ValueError, AttributeError):
+            return False
+        if err.get("code") in (401, 403, 498, 499) or (err.get("code") or 0) >= 500:
+            return False
+        text = " ".join([str(err.get("message", ""))] + [str(d) for d in err.get("details") or []])
+    elif "html" in ctype:
+        text = r.text
+    else:
+        return False
+    return bool(_REFUSAL.search(text))
+
+
+def query(session, url, params, pbf=True, pbf_params=None):
+    """GET url with f=pbf, falling back to f=json if the server refuses.
+
+    pbf_params (e.g. quantizationParameters) go on the f=pbf request only,
+    since decode() undoes them and an f=json answer would not. Returns the
+    f=json shaped dict either way.
+    """
+    if pbf and url not in _PBF_REFUSED:
+        r = session.get(url, params={**params, **(pbf_params or {}), "f": "pbf"})
+        ctype = r.headers.get("Content-Type", "")
+        if r.status_code == 200 and "json" not in ctype and "html" not in ctype:
+            try:
+                return decode(r.content)
+            except (PbfError, IndexError, struct.error, UnicodeDecodeError):
+                pass
+        elif refuses_pbf(r, ctype):
+            _PBF_REFUSED.add(url)
+        # anything else (5xx, an expired token, a garbled body) falls back for this query only
+    r = session.get(url, params={**params, "f": "json"})
+    r.raise_for_status()
+    return r.json()
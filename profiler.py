@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import cProfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+PHASES = ("auth", "fetch", "parse", "plan", "edit", "write-output")
+
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help="time the auth/fetch/parse/plan/edit/write-output phases and print a summary")
+    parser.add_argument("--profile-out", metavar="PATH",
+                        help="also dump a profile to PATH (implies --profile)")
+    parser.add_argument("--profile-mode", choices=("cprofile", "sample"), default="cprofile",
+                        help="cprofile: pstats dump; sample: collapsed stacks for flame graphs")
+
+
+class Sampler(threading.Thread):
+    """Wall-clock sampling profiler for one thread, using sys._current_frames.
+
+    Counts are kept per collapsed stack ("outer;inner;leaf"), the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.halt = threading.Event()
+
+    def run(self):
+        while not self.halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.halt.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """Named phase timers plus an optional cProfile/sampling dump.
+
+    When disabled, phase() is a plain pass-through, so scripts can keep the
+    phase markers in place unconditionally.
+    """
+
+    def __init__(self, job, enabled=False, out=None, mode="cprofile"):
+        self.job = job
+        self.enabled = enabled or bool(out)
+        self.out = out
+        self.mode = mode
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.started = None
+        self.profile = None
+        self.sampler = None
+
+    @classmethod
+    def from_args(cls, job, args):
+        return cls(job, args.profile, args.profile_out, args.profile_mode)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += time.perf_counter() - start
+            self.counts[name] += 1
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.started = time.perf_counter()
+        if self.out and self.mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.out:
+            self.sampler = Sampler(threading.get_ident())
+            self.sampler.start()
+
+    def stop(self):
+        if not self.enabled or self.started is None:
+            return
+        wall = time.perf_counter() - self.started
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(self.out)
+        if self.sampler:
+            self.sampler.stop()
+            self.sampler.dump(self.out)
+        self.report(wall)
+        self.started = None
+
+    def summary(self, wall):
+        phases = {name: {"seconds": self.totals[name], "calls": self.counts[name]}
+                  for name in sorted(self.totals, key=self.totals.get, reverse=True)}
+        return {"job": self.job, "wall_s": wall,
+                "unaccounted_s": max(0.0, wall - sum(self.totals.values())), "phases": phases}
+
+    def report(self, wall):
+        s = self.summary(wall)
+        print(f"\n⏱  Profile for {self.job}: {wall:.3f}s wall", file=sys.stderr)
+        for name, p in s["phases"].items():
+            share = 100.0 * p["seconds"] / wall if wall else 0.0
+            print(f"   {name:<13} {p['seconds']:>9.3f}s {share:>5.1f}%  ({p['calls']}×)", file=sys.stderr)
+        print(f"   {'(other)':<13} {s['unaccounted_s']:>9.3f}s", file=sys.stderr)
+        if self.out:
+            print(f"   {self.mode} dump written to {self.out}", file=sys.stderr)
@@ -0,0 +1,180 @@
+"""Pick how to fetch a query's features from cheap probes, instead of one fixed shape.
+
+The first page is asked for directly, so a small check stays one request.
+Only when it comes back truncated is the rest planned. The probes are the
+layer's maxRecordCount and supportsPagination (metadata, once per layer)
+and a returnCountOnly query. The plans:
+
+  single      everything fit in the first page
+  paged       a few more pages, fetched one after another with resultOffset
+  parallel    many pages: returnIdsOnly, then objectIds chunks on a thread pool
+  ids         OBJECTIDs only, one returnIdsOnly request (never truncated)
+  statistics  grouped outStatistics only, no features
+
+Each plan's estimated cost in requests and round trips is printed and kept
+in session.metrics.plans for tuning.
+"""
+import os
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pbf
+import fastjson
+
+# pages worth sending in parallel rather than in sequence; below this the
+# returnIdsOnly round trip and objectIds filtering cost more than they save
+PARALLEL_MIN_PAGES = int(os.getenv("FDM_PARALLEL_MIN_PAGES", "4"))
+WORKERS = int(os.getenv("FDM_QUERY_WORKERS", "8"))
+# objectIds per GET when f=pbf (the ids go in the URL)
+PBF_IDS_PER_REQUEST = 500
+
+# layer URL → (maxRecordCount, supportsPagination)
+_LAYER_INFO = {}
+
+
+def layer_info(session, layer_url, token):
+    """(maxRecordCount, supportsPagination), from the layer metadata on first use."""
+    if layer_url not in _LAYER_INFO:
+        r = session.get(layer_url, params={"f": "json", "token": token})
+        r.raise_for_status()
+        js = r.json()
+        if "error" in js:
+            raise Exception(f"❌ Layer metadata failed: {js['error']}")
+        adv = js.get("advancedQueryCapabilities", {})
+        _LAYER_INFO[layer_url] = (js.get("maxRecordCount") or 1000, adv.get("supportsPagination", True))
+    return _LAYER_INFO[layer_url]
+
+
+def run_query(session, layer_url, params, use_pbf=False):
+    url = f"{layer_url}/query"
+    if use_pbf:
+        js = pbf.query(session, url, params)
+    else:
+        r = session.post(url, data={"f": "json", **params})
+        r.raise_for_status()
+        js = r.json()
+    if "error" in js:
+        raise Exception(f"❌ Query failed: {js['error']}")
+    return js
+
+
+def log_plan(session, plan):
+    session.metrics.plans.append(plan)
+    extra = "".join(f", {k}={plan[k]}" for k in ("count", "max_records", "workers") if k in plan)
+    est = f" (estimated {plan['estimated_round_trips']})" if "estimated_round_trips" in plan else ""
+    print(f"🧭 {plan['plan']}: {plan['requests']} requests in {plan['round_trips']} round trips{est}"
+          f"{extra}, {plan['wall_s']:.2f}s")
+
+
+def fetch_ids(session, layer_url, token, where):
+    """OBJECTIDs matching where, in one returnIdsOnly request."""
+    start = time.perf_counter()
+    js = run_query(session, layer_url, {"where": where, "returnIdsOnly": "true", "token": token})
+    ids = js.get("objectIds") or []
+    log_plan(session, {"plan": "ids", "where": where, "count": len(ids), "requests": 1,
+                       "round_trips": 1, "wall_s": time.perf_counter() - start})
+    return ids
+
+
+def fetch_statistics(session, layer_url, token, where, statistics, group_by):
+    """Grouped outStatistics rows (attributes dicts), following exceededTransferLimit."""
+    start = time.perf_counter()
+    params = {
+        "where": where,
+        "outStatistics": fastjson.dumps(statistics),
+        "groupByFieldsForStatistics": ",".join(group_by),
+        # resultOffset pages of groups are only consistent over a fixed order
+        "orderByFields": ",".join(group_by),
+        "token": token,
+    }
+    rows, requests = [], 0
+    while True:
+        js = run_query(session, layer_url, {**params, "resultOffset": len(rows)} if rows else params)
+        requests += 1
+        page = [f["attributes"] for f in js.get("features", [])]
+        rows.extend(page)
+        if not page or not js.get("exceededTransferLimit"):
+            break
+    log_plan(session, {"plan": "statistics", "where": where, "count": len(rows), "requests": requests,
+                       "round_trips": requests, "wall_s": time.perf_counter() - start})
+    return rows
+
+
+def choose(pages, chunks, paginates, ordered, workers):
+    """(plan, round trips) for the rest: pages of resultOffset, or chunks of objectIds."""
+    paged = pages
+    parallel = 1 + math.ceil(chunks / workers)
+    if not paginates:
+        return "parallel", parallel
+    if ordered or pages + 1 < PARALLEL_MIN_PAGES or parallel >= paged:
+        return "paged", paged
+    return "parallel", parallel
+
+
+def fetch_features(session, layer_url, token, where, out_fields="*", order_by=None,
+                   return_geometry=False, use_pbf=False, workers=WORKERS, extra=None):
+    """Every feature matching where, by whichever plan the probes make cheapest."""
+    start = time.perf_counter()
+    fields = out_fields if out_fields == "*" or "OBJECTID" in out_fields.split(",") \
+        else f"OBJECTID,{out_fields}"
+    params = {
+        "where": where,
+        "outFields": fields,
+        "returnGeometry": "true" if return_geometry else "false",
+        "token": token,
+        **(extra or {}),
+    }
+    # resultOffset pages are only consistent over a fixed order, first page included
+    params["orderByFields"] = order_by or "OBJECTID"
+
+    first = run_query(session, layer_url, params, use_pbf)
+    features = first.get("features", [])
+    if not first.get("exceededTransferLimit"):
+        log_plan(session, {"plan": "single", "where": where, "count": len(features), "requests": 1,
+                           "round_trips": 1, "wall_s": time.perf_counter() - start})
+        return features
+
+    requests = 2 if layer_url in _LAYER_INFO else 3
+    max_records, paginates = layer_info(session, layer_url, token)
+    page_size = min(max_records, len(features)) or max_records
+    count = run_query(session, layer_url, {"where": where, "returnCountOnly": "true",
+                                           "token": token}).get("count", 0)
+    remaining = max(0, count - len(features))
+    pages = math.ceil(remaining / page_size)
+    chunk = min(page_size, PBF_IDS_PER_REQUEST) if use_pbf else page_size
+    plan, estimate = choose(pages, math.ceil(remaining / chunk), paginates, bool(order_by), workers)
+    probes = requests
+
+    if plan == "paged":
+        while True:
+            js = run_query(session, layer_url, {**params, "resultOffset": len(features)}, use_pbf)
+            requests += 1
+            page = js.get("features", [])
+            features.extend(page)
+            if not page or not js.get("exceededTransferLimit"):
+                break
+    else:
+        have = {f["attributes"]["OBJECTID"] for f in features}
+        ids = run_query(session, layer_url, {"where": where, "returnIdsOnly": "true",
+                                             "token": token}).get("objectIds") or []
+        todo = sorted(oid for oid in ids if oid not in have)
+        chunks = [todo[i:i + chunk] for i in range(0, len(todo), chunk)]
+
+        def fetch_chunk(oids):
+            chunk_params = {k: v for k, v in params.items() if k not in ("where", "orderByFields")}
+            js = run_query(session, layer_url,
+                           {**chunk_params, "objectIds": ",".join(map(str, oids))}, use_pbf)
+            return js.get("features", [])
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for page in pool.map(fetch_chunk, chunks):
+                features.extend(page)
+        requests += 1 + len(chunks)
+
+    rounds = requests - probes if plan == "paged" else 1 + math.ceil(len(chunks) / max(1, workers))
+    log_plan(session, {"plan": plan, "where": where, "count": count, "max_records": page_size,
+                       "workers": workers if plan == "parallel" else 1, "requests": requests,
+                       "estimated_round_trips": probes + estimate, "round_trips": probes + rounds,
+                       "wall_s": time.perf_counter() - start})
+    return features
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Fill every NULL Height of GIS_USER_ID that the KML archive store can answer.
+
+  python reconcile_heights.py /srv/kml-archive
+  python reconcile_heights.py /srv/kml-archive --no-refresh
+
+The store is indexed FlightID → Height in .kml_index.sqlite (only new or
+changed archives are parsed on each run), the null-height features are
+fetched in one paged query, and the heights found are written back in
+journaled applyEdits batches. The SPK of an index entry comes from the
+archive's folder manifest, its file name or an SPK-named parent folder;
+an entry for another SPK is never used.
+"""
+import os
+import sys
+import argparse
+from collections import defaultdict
+from dotenv import load_dotenv
+
+import bulk_update_heights as bulk
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+from journal import Journal, journal_path, chunked, run_pending, rollback
+from kml_index import KmlIndex, INDEX_FILE
+
+load_dotenv()
+
+
+def fetch_null_heights(session, token, user_id):
+    """Every null-height feature of user_id, following exceededTransferLimit."""
+    feats, offset = [], 0
+    while True:
+        r = session.post(bulk.QUERY_URL, data={
+            "f": "json",
+            "where": f"UserID='{user_id}' AND Height IS NULL",
+            "outFields": "OBJECTID,FlightID,SPKNumber,KeyID,CRT_Date,Height",
+            "returnGeometry": "false",
+            "orderByFields": "OBJECTID",
+            "resultOffset": offset,
+            "token": token
+        })
+        r.raise_for_status()
+        js = r.json()
+        if "error" in js:
+            raise Exception(f"❌ Query failed: {js['error']}")
+        page = js.get("features", [])
+        feats.extend(page)
+        if not page or not js.get("exceededTransferLimit"):
+            return feats
+        offset += len(page)
+
+
+def resolve(attrs, candidates):
+    """Height for one feature: newest entry of its own SPK, else of an archive with unknown SPK."""
+    own = [c for c in candidates if c[1] == attrs["SPKNumber"]]
+    unknown = [c for c in candidates if c[1] is None]
+    chosen = own or unknown
+    return chosen[-1][0] if chosen else None
+
+
+def plan_reconcile(index, features, journal):
+    """Journal the updates; returns {spk: {"nulls", "resolved", "unresolved", "other_spk"}}."""
+    found = index.lookup({f["attributes"]["FlightID"] for f in features if f["attributes"].get("FlightID")})
+    summary = defaultdict(lambda: {"nulls": 0, "resolved": 0, "unresolved": 0, "other_spk": 0})
+    updates, before = [], []
+    for feat in features:
+        attrs = feat["attributes"]
+        s = summary[attrs["SPKNumber"]]
+        s["nulls"] += 1
+        candidates = found.get(attrs.get("FlightID"), [])
+        height = resolve(attrs, candidates)
+        if height is None:
+            s["other_spk" if candidates else "unresolved"] += 1
+            continue
+        s["resolved"] += 1
+        updates.append(bulk.height_update(attrs, height))
+        before.append({"attributes": attrs})
+
+    for batch in chunked(list(zip(updates, before))):
+        journal.plan({"updates": [u for u, _ in batch]}, [b for _, b in batch])
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{'SPKNumber':<14}{'nulls':>8}{'resolved':>10}{'no KML':>8}{'other SPK':>11}")
+    for spk in sorted(summary, key=str):
+        s = summary[spk]
+        print(f"{str(spk):<14}{s['nulls']:>8}{s['resolved']:>10}{s['unresolved']:>8}{s['other_spk']:>11}")
+    total = sum(s["resolved"] for s in summary.values())
+    print(f"\n✅ {total} of {sum(s['nulls'] for s in summary.values())} NULL Height features resolved.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fill NULL Height for every FlightID found in a KML archive store"
+    )
+    parser.add_argument("store", nargs="?", default=os.getenv("FDM_KML_STORE"),
+                        help="folder of KML ZIPs, searched recursively (default: $FDM_KML_STORE)")
+    parser.add_argument("--index", default=INDEX_FILE,
+                        help=f"FlightID → Height index file (default: {INDEX_FILE})")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="use the index as is, without checking the store for new archives")
+    parser.add_argument("--jobs", type=int,
+                        help="parse processes for new archives (default: CPU count)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the unfinished batches of the last run from its journal")
+    parser.add_argument("--rollback", action="store_true",
+                        help="put back the NULL Heights filled by the last run, from its journal")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    user_id = os.getenv("GIS_USER_ID")
+    if not user_id:
+        print("❌ Please set GIS_USER_ID in your .env")
+        sys.exit(1)
+    if not args.store and not (args.no_refresh or args.resume or args.rollback):
+        parser.error("give the KML archive folder, set FDM_KML_STORE, or pass --no-refresh")
+
+    session = InstrumentedSession("reconcile_heights")
+    journal = Journal(journal_path("reconcile_heights", user_id))
+    prof = Profiler.from_args("reconcile_heights", args)
+    prof.start()
+    index = None
+
+    try:
+        with prof.phase("auth"):
+            token, cookie = bulk.get_final_token(session)
+        apply = bulk.make_apply(session, token, cookie, None)
+
+        if args.rollback:
+            with prof.phase("edit"):
+                n = rollback(journal, apply)
+            print(f"\n✅ Reverted {n} batches.")
+            return
+
+        if args.resume and journal.exists():
+            print(f"Resuming {len(journal.pending())} of {len(journal.plans)} batches from {journal.path}")
+            with prof.phase("edit"):
+                run_pending(journal, apply)
+            return
+
+        index = KmlIndex(args.index)
+        if not args.no_refresh:
+            with prof.phase("parse"):
+                parsed, removed, failed = index.refresh(args.store, args.jobs)
+            print(f"Index: {parsed} archives (re)parsed, {removed} removed, {failed} unreadable")
+        stats = index.stats()
+        print(f"Index holds {stats['flights']} FlightIDs from {stats['archives']} archives")
+
+        with prof.phase("fetch"):
+            features = fetch_null_heights(session, token, user_id)
+        if not features:
+            print("✅ No NULL Height features found.")
+            return
+
+        with prof.phase("plan"):
+            journal.start("reconcile_heights", {"user_id": user_id, "index": args.index})
+            summary = plan_reconcile(index, features, journal)
+
+        with prof.phase("edit"):
+            run_pending(journal, apply)
+
+        with prof.phase("write-output"):
+            print_summary(summary)
+
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        if index:
+            index.close()
+        session.metrics.write()
+        prof.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,32 @@
 import os
+import re
 import sys
 import json
 import time
-import pandas as pd
-import requests
+import bisect
+import argparse
 from dotenv import load_dotenv
 
+import fastjson
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+
 load_dotenv()
 
 INPUT_FILE = 'feedback.xlsx'
 OUTPUT_FILE = 'feedback_checked.xlsx'
 
-BASE_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
-SERVER_URL = BASE_URL.replace('/FeatureServer/0', '/MapServer')
+BASE_URL = os.getenv('FDM_LAYER_URL', "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0")
+SERVER_URL = re.sub(r'/FeatureServer/\d+$', '/MapServer', BASE_URL)
 QUERY_URL = f"{BASE_URL}/query"
 TOKEN_URL = "https://maps.sinarmasforestry.com/portal/sharing/rest/generateToken"
 TOKEN_CACHE_FILE = ".token_cache.json"
 
+# the per-SPK server query asks for at most this many features
+SPK_RECORD_COUNT = 1000
+# a --mirror older than this is rebuilt from the server
+MIRROR_MAX_AGE_S = 24 * 3600
+
 TOKEN_HEADERS = {
     'Content-Type': 'application/x-www-form-urlencoded',
     'Referer': 'https://maps.sinarmasforestry.com/UploadDroneManagements/',
@@ -98,7 +108,7 @@ def get_final_token(session):
     return token, cookie
 
 
-def find_spk_col(df: pd.DataFrame) -> str:
+def find_spk_col(df) -> str:
     for col in df.columns:
         if col.strip().lower() == 'spknumber':
             return col
@@ -109,7 +119,7 @@ def fetch_spk_info(session, token, user_id, spk: str):
     params = {
         'f': 'json',
         'where': f"(UserID='{user_id}') AND (LOWER(SPKNumber) LIKE '{spk.lower()}%')",
-        'resultRecordCount': 1000,
+        'resultRecordCount': SPK_RECORD_COUNT,
         'outFields': 'FlightID,SPKNumber,KeyID,Height,OBJECTID',
         'returnGeometry': 'false',
         'token': token
@@ -126,16 +136,118 @@ def fetch_spk_info(session, token, user_id, spk: str):
     return 'uploaded', flight_ids
 
 
+def fetch_user_features(session, token, user_id):
+    """(OBJECTID, SPKNumber, FlightID) of every feature of user_id, following exceededTransferLimit."""
+    rows, offset = [], 0
+    while True:
+        r = session.get(QUERY_URL, params={
+            'f': 'json',
+            'where': f"UserID='{user_id}'",
+            'outFields': 'OBJECTID,SPKNumber,FlightID',
+            'returnGeometry': 'false',
+            'orderByFields': 'OBJECTID',
+            'resultOffset': offset,
+            'token': token
+        })
+        r.raise_for_status()
+        js = r.json()
+        if 'error' in js:
+            raise Exception(f"❌ Query failed: {js['error']}")
+        page = js.get('features', [])
+        rows.extend((f['attributes']['OBJECTID'], f['attributes']['SPKNumber'], f['attributes']['FlightID'])
+                    for f in page)
+        if not page or not js.get('exceededTransferLimit'):
+            return rows
+        offset += len(page)
+
+
+class SpkPrefixIndex:
+    """Sorted (lowercased SPKNumber, OBJECTID) index answering fetch_spk_info locally.
+
+    A prefix maps to the contiguous run of keys between bisect_left(prefix)
+    and bisect_left(next prefix), so each lookup is two binary searches.
+    Matches come back in OBJECTID order and capped at SPK_RECORD_COUNT, as
+    the server query returns them.
+    """
+
+    def __init__(self, rows, user_id=None, built=None):
+        entries = sorted(((spk or '').lower(), oid, fid) for oid, spk, fid in rows)
+        self.keys = [e[0] for e in entries]
+        self.entries = entries
+        self.user_id = user_id
+        self.built = time.time() if built is None else built
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = fastjson.loads(f.read())
+        if isinstance(data, list):
+            # older mirrors are a bare row list: owner and age unknown, so always stale
+            return cls(data, built=0)
+        return cls(data['rows'], data.get('user_id'), data.get('built', 0))
+
+    def save(self, path):
+        data = {'user_id': self.user_id, 'built': self.built,
+                'rows': [[oid, spk, fid] for spk, oid, fid in self.entries]}
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(fastjson.dumpb(data))
+        os.replace(f"{path}.tmp", path)
+
+    def age(self):
+        return time.time() - self.built
+
+    def stale(self, user_id, max_age):
+        """Why this index should be rebuilt for user_id, or None if it can be used."""
+        if self.user_id != user_id:
+            return f"built for {self.user_id or 'an unknown user'}, not {user_id}"
+        if self.age() > max_age:
+            return f"{self.age():.0f}s old, over {max_age:g}s"
+        return None
+
+    def lookup(self, spk):
+        prefix = spk.lower()
+        if '%' in prefix or '_' in prefix:
+            # LIKE wildcards; let the server interpret them
+            return None
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+        matches = sorted(self.entries[lo:hi], key=lambda e: e[1])[:SPK_RECORD_COUNT]
+        if not matches:
+            return 'not_uploaded', []
+        return 'uploaded', [fid for _, _, fid in matches]
+
+
 def main():
-    user_id = os.getenv('GIS_AUTH_USERNAME')  # originally agasha123
+    parser = argparse.ArgumentParser(description=f"Check upload status of every SPK in {INPUT_FILE}")
+    parser.add_argument('--local', action='store_true',
+                        help="fetch the user's features once and match SPK prefixes locally "
+                             "instead of one LIKE query per SPK")
+    parser.add_argument('--mirror', metavar='PATH',
+                        help='with --local: read the index from PATH if it exists, is for '
+                             'this user and is fresh enough, otherwise fetch it and save it there')
+    parser.add_argument('--mirror-max-age', type=float, default=MIRROR_MAX_AGE_S,
+                        help=f'seconds after which --mirror is rebuilt (default: {MIRROR_MAX_AGE_S})')
+    parser.add_argument('--refresh-mirror', action='store_true',
+                        help='rebuild --mirror from the server even if it is fresh')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    # GIS_USER_ID like the other scripts; older .env files only have the login name
+    user_id = os.getenv('GIS_USER_ID') or os.getenv('GIS_AUTH_USERNAME')
     if not user_id:
-        print("❌ Please set GIS_AUTH_USERNAME in your .env")
-        return
+        print("❌ Please set GIS_USER_ID (or GIS_AUTH_USERNAME) in your .env")
+        sys.exit(1)
 
-    session = requests.Session()
+    session = InstrumentedSession('runner')
+    prof = Profiler.from_args('runner', args)
+    prof.start()
     try:
-        token, _ = get_final_token(session)
-        df = pd.read_excel(INPUT_FILE, dtype=str)
+        with prof.phase('auth'):
+            token, _ = get_final_token(session)
+        with prof.phase('parse'):
+            # imported here so env/auth failures don't pay for pandas
+            import pandas as pd
+            df = pd.read_excel(INPUT_FILE, dtype=str)
 
         try:
             spk_col = find_spk_col(df)
@@ -143,6 +255,25 @@ def main():
             print(f"ERROR: {e}", file=sys.stderr)
             sys.exit(1)
 
+        index = None
+        if args.local or args.mirror:
+            if args.mirror and os.path.exists(args.mirror) and not args.refresh_mirror:
+                with prof.phase('parse'):
+                    index = SpkPrefixIndex.load(args.mirror)
+                reason = index.stale(user_id, args.mirror_max_age)
+                if reason:
+                    print(f"⚠️ Rebuilding {args.mirror}: {reason}")
+                    index = None
+                else:
+                    print(f"Loaded {len(index.keys)} features from {args.mirror} ({index.age():.0f}s old)")
+            if index is None:
+                with prof.phase('fetch'):
+                    index = SpkPrefixIndex(fetch_user_features(session, token, user_id), user_id)
+                print(f"Indexed {len(index.keys)} features of {user_id}")
+                if args.mirror:
+                    with prof.phase('write-output'):
+                        index.save(args.mirror)
+
         cache = {}
         statuses = []
         flights = []
@@ -154,23 +285,33 @@ def main():
             elif spk in cache:
                 status, fids = cache[spk]
             else:
-                try:
-                    status, fids = fetch_spk_info(session, token, user_id, spk)
-                except Exception as err:
-                    status, fids = f'error: {err}', []
+                found = index.lookup(spk) if index else None
+                if found:
+                    status, fids = found
+                else:
+                    try:
+                        with prof.phase('fetch'):
+                            status, fids = fetch_spk_info(session, token, user_id, spk)
+                    except Exception as err:
+                        status, fids = f'error: {err}', []
                 cache[spk] = (status, fids)
 
             statuses.append(status)
             flights.append(",".join(fids))
             print(f"Row {idx}: SPK={spk or '0'} → {status} ({len(fids)} flights)")
 
-        df['Status'] = statuses
-        df['FlightIDs'] = flights
-        df.to_excel(OUTPUT_FILE, index=False)
+        with prof.phase('write-output'):
+            df['Status'] = statuses
+            df['FlightIDs'] = flights
+            df.to_excel(OUTPUT_FILE, index=False)
         print(f"\n✅ Done — results in {OUTPUT_FILE}")
 
     except Exception as e:
         print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""Answer "has this SPK been uploaded?" over HTTP, from a warm in-memory index.
+
+  python spk_service.py --port 8766 --refresh 300
+
+  GET  /spk/5000012345               → {"spk", "status", "flight_ids"}
+  POST /spk  ["5000012345", …]       → {"results": [{"spk", "status", "flight_ids"}, …]}
+           (or {"spks": [...]})
+  GET  /health                       → index size and age, refresh and lookup counts
+
+Answers are the same as runner.py's fetch_spk_info: prefix match on
+SPKNumber, FlightIDs in OBJECTID order, at most SPK_RECORD_COUNT of them.
+They come from a SpkPrefixIndex of all GIS_USER_ID features, rebuilt every
+--refresh seconds in the background, so the GIS server sees one paged scan
+per refresh however many lookups arrive. An index older than --ttl (every
+refresh since has failed) is dropped and lookups answer 503 rather than
+stale data. SPKs with LIKE wildcards are still asked of the server.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from urllib.parse import urlsplit, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+import fastjson
+import runner
+from http_metrics import InstrumentedSession
+from watch_heights import TokenKeeper
+
+load_dotenv()
+
+REFRESH_S = 300
+TTL_S = 1800
+
+
+class StaleIndex(Exception):
+    pass
+
+
+class SpkService:
+    """The current SpkPrefixIndex of user_id, swapped whole on every refresh."""
+
+    def __init__(self, session, user_id, refresh=REFRESH_S, ttl=TTL_S, mirror=None, refresh_session=None):
+        self.session = session
+        # the paged scan gets its own session, so wildcard lookups never wait out a refresh
+        self.refresh_session = refresh_session or InstrumentedSession("spk_service_refresh")
+        self.user_id = user_id
+        self.refresh_s, self.ttl = refresh, ttl
+        self.mirror = mirror
+        self.tokens = TokenKeeper(session)
+        self.lock = threading.Lock()
+        # self.session (and the token renewal on it) is shared by the handler threads
+        self.http_lock = threading.Lock()
+        self.index, self.built = None, 0.0
+        self.stats = {"refreshes": 0, "refresh_errors": 0, "lookups": 0, "server_lookups": 0}
+        self.last_error = None
+
+    def load_mirror(self):
+        """Start from the saved index, unless it is another user's or older than --ttl."""
+        if not (self.mirror and os.path.exists(self.mirror)):
+            return False
+        index = runner.SpkPrefixIndex.load(self.mirror)
+        reason = index.stale(self.user_id, self.ttl)
+        if reason:
+            print(f"⚠️ Ignoring {self.mirror}: {reason}")
+            return False
+        with self.lock:
+            self.index, self.built = index, index.built
+        return True
+
+    def refresh(self):
+        start = time.perf_counter()
+        with self.http_lock:
+            token, _ = self.tokens.get()
+        rows = runner.fetch_user_features(self.refresh_session, token, self.user_id)
+        index = runner.SpkPrefixIndex(rows, self.user_id)
+        with self.lock:
+            self.index, self.built = index, index.built
+            self.stats["refreshes"] += 1
+            self.last_error = None
+        if self.mirror:
+            index.save(self.mirror)
+        self.refresh_session.metrics.write()
+        print(f"✅ Indexed {len(index.keys)} features of {self.user_id} "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    def refresh_loop(self, stop):
+        while not stop.wait(self.refresh_s):
+            try:
+                self.refresh()
+            except Exception as e:
+                with self.lock:
+                    self.stats["refresh_errors"] += 1
+                    self.last_error = str(e)
+                age = self.age()
+                kept = f"keeping the index from {age:.0f}s ago" if age is not None else "no index to serve"
+                try:
+                    print(f"⚠️ Refresh failed, {kept}: {e}")
+                except Exception:
+                    # the refresher must outlive anything, even a broken stdout
+                    pass
+
+    def age(self):
+        return time.time() - self.built if self.index else None
+
+    def current(self):
+        with self.lock:
+            if self.index and time.time() - self.built > self.ttl:
+                print(f"⚠️ Index older than {self.ttl}s, dropped until the next refresh succeeds")
+                self.index = None
+            return self.index
+
+    def lookup(self, spk):
+        spk = (spk or "").strip()
+        with self.lock:
+            self.stats["lookups"] += 1
+        if spk in ("", "0"):
+            return "not_uploaded", []
+        index = self.current()
+        if index is None:
+            raise StaleIndex(self.last_error or "index not built yet")
+        found = index.lookup(spk)
+        if found:
+            return found
+        with self.http_lock:
+            self.stats["server_lookups"] += 1
+            token, _ = self.tokens.get()
+            return runner.fetch_spk_info(self.session, token, self.user_id, spk)
+
+    def health(self):
+        with self.lock:
+            return {
+                "user_id": self.user_id,
+                "features": len(self.index.keys) if self.index else 0,
+                "age_s": round(self.age(), 1) if self.index else None,
+                "ttl_s": self.ttl,
+                "refresh_s": self.refresh_s,
+                "last_error": self.last_error,
+                **self.stats,
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SpkService/1.0"
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            return self.reply(self.server.service.health())
+        if path.startswith("/spk/"):
+            return self.answer([unquote(path[len("/spk/"):])], single=True)
+        self.reply({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if urlsplit(self.path).path.rstrip("/") != "/spk":
+            return self.reply({"error": "not found"}, 404)
+        try:
+            data = fastjson.loads(body or b"[]")
+        except ValueError:
+            return self.reply({"error": "body must be JSON"}, 400)
+        spks = data.get("spks") if isinstance(data, dict) else data
+        if not isinstance(spks, list) or not all(isinstance(s, str) for s in spks):
+            return self.reply({"error": "expected a JSON list of SPKNumber strings"}, 400)
+        self.answer(spks)
+
+    def answer(self, spks, single=False):
+        service = self.server.service
+        results = []
+        try:
+            for spk in spks:
+                status, fids = service.lookup(spk)
+                results.append({"spk": spk, "status": status, "flight_ids": fids})
+        except StaleIndex as e:
+            return self.reply({"error": f"index unavailable: {e}"}, 503)
+        except Exception as e:
+            return self.reply({"error": str(e)}, 502)
+        self.reply(results[0] if single else {"results": results})
+
+    def reply(self, obj, status=200):
+        body = fastjson.dumpb(obj)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        age = self.server.service.age()
+        if age is not None:
+            self.send_header("X-Index-Age", f"{age:.0f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SpkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, service, verbose=False):
+        super().__init__(addr, Handler)
+        self.service = service
+        self.verbose = verbose
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve SPK upload status from a refreshed local index")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--refresh", type=float, default=REFRESH_S,
+                        help=f"seconds between index rebuilds (default: {REFRESH_S})")
+    parser.add_argument("--ttl", type=float, default=TTL_S,
+                        help=f"seconds an index is served without a successful refresh (default: {TTL_S})")
+    parser.add_argument("--mirror", metavar="PATH",
+                        help="start from the index saved in PATH (if it is this user's and younger "
+                             "than --ttl), and save each refresh there")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    user_id = os.getenv("GIS_USER_ID") or os.getenv("GIS_AUTH_USERNAME")
+    if not user_id:
+        print("❌ Please set GIS_USER_ID (or GIS_AUTH_USERNAME) in your .env")
+        sys.exit(1)
+
+    session = InstrumentedSession("spk_service")
+    service = SpkService(session, user_id, refresh=args.refresh, ttl=args.ttl, mirror=args.mirror)
+    stop = threading.Event()
+    try:
+        if service.load_mirror():
+            print(f"Loaded {len(service.index.keys)} features from {args.mirror} "
+                  f"({service.age():.0f}s old)")
+        if not service.index or service.age() > min(args.refresh, args.ttl):
+            try:
+                service.refresh()
+            except Exception as e:
+                if not service.index:
+                    raise
+                print(f"⚠️ Refresh failed, serving the mirror until the next one: {e}")
+        threading.Thread(target=service.refresh_loop, args=(stop,), daemon=True).start()
+
+        server = SpkServer((args.host, args.port), service, verbose=args.verbose)
+        print(f"🛰️ Serving SPK status on http://{args.host}:{args.port}/spk/<spk>, "
+              f"refreshing every {args.refresh:g}s")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping …")
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        stop.set()
+        session.metrics.write()
+        service.refresh_session.metrics.write()
+
+
+if __name__ == "__main__":
+    main()
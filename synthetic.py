@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic DroneSprayingVendor data for offline runs.
+
+The same (count, seed) always yields the same rows, so the mock server and
+the KML/Excel generators agree on FlightIDs and SPKNumbers without sharing
+files.
+"""
+import os
+import random
+import zipfile
+import argparse
+
+FIELDS = ["OBJECTID", "FlightID", "SPKNumber", "KeyID", "CRT_Date", "Height", "UserID"]
+FIELD_TYPES = {
+    "OBJECTID": "esriFieldTypeOID",
+    "FlightID": "esriFieldTypeString",
+    "SPKNumber": "esriFieldTypeString",
+    "KeyID": "esriFieldTypeString",
+    "CRT_Date": "esriFieldTypeDate",
+    "Height": "esriFieldTypeDouble",
+    "UserID": "esriFieldTypeString",
+}
+
+DEFAULT_USER = "bench"
+FLIGHTS_PER_SPK = 20
+BASE_DATE = 1704067200000  # 2024-01-01 UTC, in ms
+DAY_MS = 86400000
+
+
+def generate_rows(count, seed=0, users=(DEFAULT_USER,), duplicate_rate=0.05,
+                  null_height_rate=0.1, swapped_rate=0.05, reupload_rate=0.0):
+    """Rows as lists in FIELDS order, plus a compact (x, y, w, h) footprint.
+
+    duplicate_rate of rows re-use an earlier FlightID (older CRT_Date),
+    null_height_rate have Height NULL, swapped_rate carry an 'L…' SPKNumber
+    with the real '5…' number in KeyID, as update_features_swap.py expects.
+    reupload_rate of rows copy an earlier flight of the same SPK, footprint
+    nudged slightly, under a new FlightID.
+    """
+    rnd = random.Random(seed)
+    rows, shapes = [], []
+    for i in range(count):
+        oid = i + 1
+        spk_no = i // FLIGHTS_PER_SPK
+        if rows and rnd.random() < duplicate_rate:
+            src = rows[rnd.randrange(len(rows))]
+            flight_id, spk, key_id = src[1], src[2], src[3]
+            crt = src[4] - rnd.randrange(1, 30) * DAY_MS
+            shape = shapes[src[0] - 1]
+        elif reupload_rate and rnd.random() < reupload_rate and i % FLIGHTS_PER_SPK:
+            src = rows[i - 1 - rnd.randrange(i % FLIGHTS_PER_SPK)]
+            flight_id, spk, key_id = f"FL{oid:08d}", src[2], src[3]
+            crt = src[4] + rnd.randrange(1, 30) * DAY_MS
+            x, y, w, h = shapes[src[0] - 1]
+            shape = (round(x + w * rnd.uniform(-0.02, 0.02), 6), round(y + h * rnd.uniform(-0.02, 0.02), 6), w, h)
+        else:
+            flight_id = f"FL{oid:08d}"
+            spk = f"5{spk_no:09d}"
+            key_id = f"K{spk_no:09d}"
+            if rnd.random() < swapped_rate:
+                spk, key_id = f"L{spk_no:09d}", spk
+            crt = BASE_DATE + rnd.randrange(0, 365) * DAY_MS + rnd.randrange(DAY_MS)
+            x = 101.0 + (spk_no % 500) * 0.01 + rnd.random() * 0.005
+            y = -1.0 + (spk_no // 500 % 500) * 0.01 + rnd.random() * 0.005
+            shape = (round(x, 6), round(y, 6), 0.002, 0.001)
+        height = None if rnd.random() < null_height_rate else float(rnd.randrange(2, 6))
+        rows.append([oid, flight_id, spk, key_id, crt, height, users[spk_no % len(users)]])
+        shapes.append(shape)
+    return rows, shapes
+
+
+def ring(shape):
+    x, y, w, h = shape
+    return [[x, y], [x, y + h], [x + w, y + h], [x + w, y], [x, y]]
+
+
+def kml_document(flight_id, height, shape):
+    coords = " ".join(f"{px},{py},0" for px, py in ring(shape))
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <Placemark>
+      <name>{flight_id}</name>
+      <ExtendedData>
+        <Data name="FlightID"><value>{flight_id}</value></Data>
+        <Data name="Height"><value>{height}</value></Data>
+      </ExtendedData>
+      <Polygon><outerBoundaryIs><LinearRing><coordinates>{coords}</coordinates></LinearRing></outerBoundaryIs></Polygon>
+    </Placemark>
+  </Document>
+</kml>
+"""
+
+
+def write_kml_zip(path, rows, shapes, spk, seed=0):
+    """ZIP with one KML per flight of spk; returns the number of KMLs."""
+    rnd = random.Random(seed)
+    seen = set()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for row, shape in zip(rows, shapes):
+            if row[2] != spk or row[1] in seen:
+                continue
+            seen.add(row[1])
+            height = float(rnd.randrange(2, 6))
+            z.writestr(f"flight_{row[1]}.kml", kml_document(row[1], height, shape))
+    return len(seen)
+
+
+def pick_spks(rows, count, seed=0, missing_rate=0.2):
+    """Sample SPKNumbers for a feedback sheet, some of which do not exist."""
+    rnd = random.Random(seed)
+    spks = sorted({r[2] for r in rows})
+    out = []
+    for _ in range(count):
+        if rnd.random() < missing_rate:
+            out.append(f"9{rnd.randrange(10 ** 9):09d}")
+        else:
+            out.append(rnd.choice(spks))
+    return out
+
+
+def write_feedback_xlsx(path, spks):
+    import pandas as pd
+    pd.DataFrame({"No": range(1, len(spks) + 1), "SPKNumber": spks}).to_excel(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic KML ZIPs and feedback sheets")
+    parser.add_argument("--features", type=int, default=1000, help="dataset size (must match the mock server)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic", help="output directory")
+    parser.add_argument("--spk", action="append", default=[], help="SPKNumber to build a KML ZIP for (repeatable)")
+    parser.add_argument("--feedback", type=int, default=0, help="rows of feedback.xlsx to write")
+    args = parser.parse_args()
+
+    rows, shapes = generate_rows(args.features, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+
+    for spk in args.spk or [rows[0][2]]:
+        path = os.path.join(args.out, f"{spk}.zip")
+        n = write_kml_zip(path, rows, shapes, spk, args.seed)
+        print(f"{path}: {n} KMLs")
+
+    if args.feedback:
+        path = os.path.join(args.out, "feedback.xlsx")
+        write_feedback_xlsx(path, pick_spks(rows, args.feedback, args.seed))
+        print(f"{path}: {args.feedback} rows")
+
+
+if __name__ == "__main__":
+    main()
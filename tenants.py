@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Run one fdm command for many vendors at once.
+
+  python tenants.py tenants.json check-null
+  python tenants.py --max-parallel 8 --only vendor-a,vendor-b tenants.json dedupe --resume
+
+tenants.json:
+
+  {
+    "defaults": {"auth_username": "agasha123", "auth_password": "$GIS_AUTH_PASSWORD"},
+    "tenants": [
+      {"name": "vendor-a", "user_id": "vendor_a", "username": "vendor_a_editor",
+       "password": "$VENDOR_A_PASSWORD",
+       "layer_url": "https://…/DroneSprayingVendor/FeatureServer/0"},
+      …
+    ]
+  }
+
+Values may reference environment variables ($NAME), so the file itself
+need not hold secrets. Each tenant runs as its own process in its own
+working directory (tenants/<name>/ unless "workdir" is given), so it has
+its own token cache, connection pool, journals and .metrics. Credentials
+a tenant does not set are blanked rather than taken from .env, so one
+vendor never runs with another's login.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from fdm import COMMANDS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TENANTS_DIR = "tenants"
+
+# tenant key → environment variable read by the scripts
+ENV_KEYS = {
+    "user_id": "GIS_USER_ID",
+    "auth_username": "GIS_AUTH_USERNAME",
+    "auth_password": "GIS_AUTH_PASSWORD",
+    "username": "GIS_USERNAME",
+    "password": "GIS_PASSWORD",
+    "layer_url": "FDM_LAYER_URL",
+}
+
+
+def load_tenants(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"tenants": data}
+    defaults = data.get("defaults", {})
+    tenants = []
+    for t in data.get("tenants", []):
+        t = {**defaults, **t}
+        if not t.get("name"):
+            raise ValueError(f"tenant without a name in {path}")
+        tenants.append(t)
+    names = [t["name"] for t in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate tenant names in {path}")
+    return tenants
+
+
+def tenant_env(tenant):
+    env = dict(os.environ)
+    for key, var in ENV_KEYS.items():
+        env[var] = os.path.expandvars(str(tenant.get(key) or ""))
+    if not env["FDM_LAYER_URL"]:
+        # no layer given: the scripts' default layer
+        del env["FDM_LAYER_URL"]
+    for var, value in tenant.get("env", {}).items():
+        env[var] = os.path.expandvars(str(value))
+    env["FDM_TENANT"] = tenant["name"]
+    env["PYTHONUNBUFFERED"] = "1"
+    return env
+
+
+def absolute_args(args):
+    """Paths that exist here still have to resolve inside the tenant's working directory."""
+    return [os.path.abspath(a) if not a.startswith("-") and os.path.exists(a) else a for a in args]
+
+
+def run_tenant(tenant, command, args, timeout=None):
+    workdir = tenant.get("workdir") or os.path.join(TENANTS_DIR, tenant["name"])
+    os.makedirs(workdir, exist_ok=True)
+    log_path = os.path.join(workdir, f"{command}.log")
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        try:
+            proc = subprocess.run(
+                [sys.executable, os.path.join(HERE, "fdm.py"), command, *args],
+                cwd=workdir, env=tenant_env(tenant), stdout=log, stderr=subprocess.STDOUT,
+                timeout=timeout,
+            )
+            status = "ok" if proc.returncode == 0 else f"exit {proc.returncode}"
+        except subprocess.TimeoutExpired:
+            status = "timeout"
+    return {"tenant": tenant["name"], "status": status, "wall_s": time.perf_counter() - start,
+            "log": log_path}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an fdm command for every tenant in parallel")
+    parser.add_argument("tenants", help="JSON list of tenants (see tenants.py)")
+    parser.add_argument("command", choices=sorted(COMMANDS), help="fdm command to run per tenant")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments passed to the command")
+    parser.add_argument("--max-parallel", type=int, default=4,
+                        help="tenants running at the same time (default: 4)")
+    parser.add_argument("--only", help="comma-separated tenant names to run")
+    parser.add_argument("--timeout", type=float, help="seconds before a tenant's run is killed")
+    args = parser.parse_args()
+
+    try:
+        tenants = load_tenants(args.tenants)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if args.only:
+        wanted = set(args.only.split(","))
+        tenants = [t for t in tenants if t["name"] in wanted]
+    if not tenants:
+        print("❌ No tenants to run")
+        sys.exit(1)
+
+    cmd_args = absolute_args(args.args)
+    print(f"Running '{args.command}' for {len(tenants)} tenants, {args.max_parallel} at a time")
+    start = time.perf_counter()
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, args.max_parallel)) as pool:
+        futures = [pool.submit(run_tenant, t, args.command, cmd_args, args.timeout) for t in tenants]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            mark = "✅" if res["status"] == "ok" else "❌"
+            print(f"{mark} {res['tenant']:<24} {res['status']:<10} {res['wall_s']:>8.1f}s  {res['log']}")
+
+    failed = [r for r in results if r["status"] != "ok"]
+    slowest = max(r["wall_s"] for r in results)
+    print(f"\n{len(results) - len(failed)} ok, {len(failed)} failed in "
+          f"{time.perf_counter() - start:.1f}s (slowest tenant {slowest:.1f}s)")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
 import os
+import re
 import sys
 import json
 import time
-import requests
+import argparse
 from collections import defaultdict
 from dotenv import load_dotenv
 
+import fastjson
+import query_planner
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+
 load_dotenv()
 
-BASE_URL = "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0"
-SERVER_URL = BASE_URL.replace('/FeatureServer/0', '/MapServer')
+BASE_URL = os.getenv('FDM_LAYER_URL', "https://maps.sinarmasforestry.com/arcgis/rest/services/PreFo/DroneSprayingVendor/FeatureServer/0")
+SERVER_URL = re.sub(r'/FeatureServer/\d+$', '/MapServer', BASE_URL)
 QUERY_URL = f"{BASE_URL}/query"
 APPLY_EDITS_URL = f"{BASE_URL}/applyEdits"
 TOKEN_URL = "https://maps.sinarmasforestry.com/portal/sharing/rest/generateToken"
@@ -96,18 +102,9 @@ def get_final_token(session):
     return token, cookie
 
 
-def fetch_features(session, token, user_id, where_clause):
-    params = {
-        'f': 'json',
-        'where': f"(UserID='{user_id}') AND {where_clause}",
-        'outFields': 'OBJECTID,SPKNumber,KeyID,FlightID,CRT_Date',
-        'returnGeometry': 'false',
-        'token': token,
-        'resultRecordCount': 10000
-    }
-    r = session.get(QUERY_URL, params=params)
-    r.raise_for_status()
-    return r.json().get('features', [])
+def fetch_features(session, token, user_id, where_clause, use_pbf=False):
+    return query_planner.fetch_features(session, BASE_URL, token, f"(UserID='{user_id}') AND {where_clause}",
+                                        'OBJECTID,SPKNumber,KeyID,FlightID,CRT_Date', use_pbf=use_pbf)
 
 
 def delete_objectid(session, token, cookie, oid):
@@ -135,7 +132,7 @@ def batch_update(session, token, cookie, updates):
     payload = {
         'f': 'json',
         'token': token,
-        'updates': json.dumps(updates)
+        'updates': fastjson.dumps(updates)
     }
     r = session.post(APPLY_EDITS_URL, headers=headers, data=payload)
     r.raise_for_status()
@@ -159,51 +156,71 @@ def dedupe_and_split(features):
 
 
 def main():
-    user_id = os.getenv('GIS_AUTH_USERNAME')
+    parser = argparse.ArgumentParser(description="Swap SPKNumber/KeyID on 'L…' features and de-duplicate")
+    parser.add_argument('--pbf', action='store_true',
+                        help="pull features as f=pbf (falls back to JSON if the server refuses)")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    user_id = os.getenv('GIS_USER_ID') or os.getenv('GIS_AUTH_USERNAME')
     if not user_id:
-        print("❌ Please set GIS_AUTH_USERNAME in your .env")
-        return
+        print("❌ Please set GIS_USER_ID (or GIS_AUTH_USERNAME) in your .env")
+        sys.exit(1)
 
-    session = requests.Session()
+    session = InstrumentedSession('update_features_swap')
+    prof = Profiler.from_args('update_features_swap', args)
+    prof.start()
 
     try:
-        token, cookie = get_final_token(session)
+        with prof.phase('auth'):
+            token, cookie = get_final_token(session)
 
         print("Fetching features where SPKNumber LIKE 'L%' …")
-        feats = fetch_features(session, token, user_id, "(SPKNumber LIKE 'L%')")
+        with prof.phase('fetch'):
+            feats = fetch_features(session, token, user_id, "(SPKNumber LIKE 'L%')", args.pbf)
         print(f" → {len(feats)} records found")
 
-        keep_initial, del_initial = dedupe_and_split(feats)
+        with prof.phase('plan'):
+            keep_initial, del_initial = dedupe_and_split(feats)
         print(f"Deleting {len(del_initial)} initial duplicates …")
-        for oid in del_initial:
-            print(" >", delete_objectid(session, token, cookie, oid))
-
-        updates = []
-        for attr in keep_initial:
-            updates.append({
-                'attributes': {
-                    'OBJECTID': attr['OBJECTID'],
-                    'SPKNumber': attr['KeyID'],
-                    'KeyID': attr['SPKNumber'],
-                    'CRT_Date': attr['CRT_Date'],
-                }
-            })
+        with prof.phase('edit'):
+            for oid in del_initial:
+                print(" >", delete_objectid(session, token, cookie, oid))
+
+        with prof.phase('plan'):
+            updates = []
+            for attr in keep_initial:
+                updates.append({
+                    'attributes': {
+                        'OBJECTID': attr['OBJECTID'],
+                        'SPKNumber': attr['KeyID'],
+                        'KeyID': attr['SPKNumber'],
+                        'CRT_Date': attr['CRT_Date'],
+                    }
+                })
 
         print(f"Applying {len(updates)} updates (swap SPK⇄Key) …")
-        print(batch_update(session, token, cookie, updates))
+        with prof.phase('edit'):
+            print(batch_update(session, token, cookie, updates))
 
         print("Re-fetching features where SPKNumber LIKE '5%' for final de-duplication …")
-        feats2 = fetch_features(session, token, user_id, "(SPKNumber LIKE '5%')")
-        keep_final, del_final = dedupe_and_split(feats2)
+        with prof.phase('fetch'):
+            feats2 = fetch_features(session, token, user_id, "(SPKNumber LIKE '5%')", args.pbf)
+        with prof.phase('plan'):
+            keep_final, del_final = dedupe_and_split(feats2)
         print(f"Deleting {len(del_final)} post-update duplicates …")
-        for oid in del_final:
-            print(" >", delete_objectid(session, token, cookie, oid))
+        with prof.phase('edit'):
+            for oid in del_final:
+                print(" >", delete_objectid(session, token, cookie, oid))
 
         print("✅ update_features_swap.py complete.")
 
     except Exception as e:
         print(f"\n❌ Error: {e}")
-
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
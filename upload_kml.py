@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""Add the flights in KML ZIPs to the layer as new features, in bulk.
+
+  python upload_kml.py archive.zip 5000012345
+  python upload_kml.py /srv/drop --simplify 0.5
+  python upload_kml.py --manifest march.csv --max-batch-bytes 500000
+
+Archives are picked the same way as bulk_update_heights.py (ZIP + SPK,
+folder, or manifest). Each KML placemark polygon becomes one Esri JSON
+feature: coordinates are parsed a whole <coordinates> string at a time,
+optionally thinned with Douglas-Peucker, rounded to --precision decimals
+and posted as journaled applyEdits adds, capped by feature count and by
+payload bytes. FlightIDs that already exist for the SPK are skipped, so
+re-running on the same archives adds nothing twice; --rollback deletes
+what the last run added.
+"""
+import os
+import re
+import sys
+import math
+import time
+import zipfile
+import argparse
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+import fastjson
+import bulk_update_heights as bulk
+from http_metrics import InstrumentedSession
+from profiler import Profiler, add_profile_arguments
+from journal import Journal, journal_path, chunked, run_pending, rollback
+
+load_dotenv()
+
+# applyEdits limits: features per call, and serialized adds per call
+BATCH_SIZE = 250
+MAX_BATCH_BYTES = 1_000_000
+
+WEB_MERCATOR = (102100, 3857, 900913)
+METERS_PER_DEGREE = 111_320.0
+
+_COMMA_SPACE = re.compile(r"\s*,\s*")
+
+
+# --- KML → Esri JSON geometry ---
+
+def parse_coordinates(text):
+    """'x,y[,z] x,y[,z] …' → [(x, y)] in one split/float pass over the whole string.
+
+    Raises ValueError when the tuples are not all 2D or all 3D.
+    """
+    # "x, y, z" (spaces after the commas) is common in hand-edited KML
+    tuples = _COMMA_SPACE.sub(",", text).split()
+    if not tuples:
+        return []
+    dims = tuples[0].count(",") + 1
+    vals = list(map(float, text.replace(",", " ").split()))
+    if dims not in (2, 3) or len(vals) != dims * len(tuples):
+        raise ValueError(f"coordinates mix 2D and 3D tuples, or are not x,y[,z]: {text.strip()[:60]!r}")
+    return list(zip(vals[0::dims], vals[1::dims]))
+
+
+def to_web_mercator(points):
+    r = 6378137.0
+    out = []
+    for lon, lat in points:
+        lat = max(-85.05112878, min(85.05112878, lat))
+        out.append((math.radians(lon) * r, math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * r))
+    return out
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker on an open polyline, iterative; endpoints are always kept."""
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tol2 = tolerance * tolerance
+    while stack:
+        first, last = stack.pop()
+        (x0, y0), (x1, y1) = points[first], points[last]
+        dx, dy = x1 - x0, y1 - y0
+        seg2 = dx * dx + dy * dy
+        best, best_d = None, tol2
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if seg2 == 0:
+                d = (px - x0) ** 2 + (py - y0) ** 2
+            else:
+                cross = dx * (py - y0) - dy * (px - x0)
+                d = cross * cross / seg2
+            if d > best_d:
+                best, best_d = i, d
+        if best is not None:
+            keep[best] = True
+            stack.append((first, best))
+            stack.append((best, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def simplify_ring(ring, tolerance):
+    """Simplify a closed ring, split at its farthest point so both halves keep their shape."""
+    if tolerance <= 0 or len(ring) < 5:
+        return ring
+    pts = ring[:-1] if ring[0] == ring[-1] else ring
+    x0, y0 = pts[0]
+    far = max(range(len(pts)), key=lambda i: (pts[i][0] - x0) ** 2 + (pts[i][1] - y0) ** 2)
+    half1 = simplify(pts[:far + 1], tolerance)
+    half2 = simplify(pts[far:] + [pts[0]], tolerance)
+    out = half1[:-1] + half2
+    return out if len(out) >= 4 else ring
+
+
+def quantize_ring(ring, precision):
+    out = []
+    for x, y in ring:
+        p = [round(x, precision), round(y, precision)]
+        if not out or out[-1] != p:
+            out.append(p)
+    if out and out[0] != out[-1]:
+        out.append(out[0])
+    return out
+
+
+def signed_area(ring):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:])) / 2.0
+
+
+def esri_rings(outer, inner, tolerance, precision, mercator):
+    """Esri rings: outer clockwise, holes counter-clockwise, closed, simplified, rounded."""
+    rings = []
+    for ring, is_hole in [(r, False) for r in outer] + [(r, True) for r in inner]:
+        if mercator:
+            ring = to_web_mercator(ring)
+        if ring and ring[0] != ring[-1]:
+            ring = ring + [ring[0]]
+        ring = quantize_ring(simplify_ring(ring, tolerance), precision)
+        if len(ring) < 4:
+            continue
+        clockwise = signed_area(ring) < 0
+        if clockwise == is_hole:
+            ring.reverse()
+        rings.append(ring)
+    return rings
+
+
+def kml_value(ext, name):
+    if ext is None:
+        return None
+    for d in ext:
+        if d.tag.endswith("Data") and d.attrib.get("name", "").lower() == name.lower():
+            val = next((c.text for c in d if c.tag.endswith("value")), None)
+            return val.strip() if val else None
+    return None
+
+
+def parse_kml(path, fn, tolerance, precision, mercator):
+    """[(FlightID, Height, KeyID, rings, vertices before, vertices after)] for each polygon placemark."""
+    import xml.etree.ElementTree as ET
+    root = ET.parse(path).getroot()
+    out = []
+    for pm in (el for el in root.iter() if el.tag.endswith("Placemark")):
+        ext = next((el for el in pm.iter() if el.tag.endswith("ExtendedData")), None)
+        outer, inner = [], []
+        for poly in (el for el in pm.iter() if el.tag.endswith("Polygon")):
+            for boundary in poly:
+                target = inner if boundary.tag.endswith("innerBoundaryIs") else outer
+                for coords in (el for el in boundary.iter() if el.tag.endswith("coordinates")):
+                    target.append(parse_coordinates(coords.text or ""))
+        if not outer:
+            continue
+        rings = esri_rings(outer, inner, tolerance, precision, mercator)
+        if not rings:
+            continue
+        fid = (kml_value(ext, "FlightID") or kml_value(ext, "flight_controller_id")
+               or bulk.extract_flight_id_from_filename(fn))
+        height = kml_value(ext, "Height")
+        out.append((fid, float(height) if height else None, kml_value(ext, "KeyID"), rings,
+                    sum(len(r) for r in outer + inner), sum(len(r) for r in rings)))
+    return out
+
+
+def parse_upload_archive(zip_path, tolerance, precision, mercator):
+    """Every polygon placemark of every KML in a ZIP; runs in the parse pool."""
+    placemarks = []
+    with tempfile.TemporaryDirectory() as tmp:
+        with zipfile.ZipFile(zip_path, "r") as z:
+            z.extractall(tmp)
+        for root, _, files in os.walk(tmp):
+            for fn in sorted(files):
+                if fn.lower().endswith(".kml"):
+                    try:
+                        placemarks.extend(parse_kml(os.path.join(root, fn), fn, tolerance, precision, mercator))
+                    except Exception as e:
+                        print(f"– skipping '{fn}': {e}")
+    return placemarks
+
+
+# --- layer ---
+
+def layer_wkid(session, token):
+    """The layer's wkid (4326 when it states none); raises for one the KML coordinates can't be put in."""
+    r = session.get(bulk.BASE_URL, params={"f": "json", "token": token})
+    r.raise_for_status()
+    js = r.json()
+    if "error" in js:
+        raise Exception(f"❌ Layer metadata failed: {js['error']}")
+    sr = js.get("extent", {}).get("spatialReference", {})
+    wkid = sr.get("latestWkid") or sr.get("wkid") or (None if sr else 4326)
+    if wkid != 4326 and wkid not in WEB_MERCATOR:
+        raise Exception(f"❌ Layer spatial reference {wkid or sr} is not supported: "
+                        f"KML lon/lat can only be uploaded to WGS84 (4326) or Web Mercator layers")
+    return wkid
+
+
+def existing_flight_ids(session, token, spk, flight_ids):
+    """The FlightIDs among flight_ids that the SPK already has in the layer."""
+    found = set()
+    for chunk in chunked(sorted(flight_ids), bulk.CALC_BATCH_SIZE):
+        offset = 0
+        while True:
+            r = session.post(bulk.QUERY_URL, data={
+                "f": "json",
+                "where": f"SPKNumber='{spk}' AND FlightID IN ({bulk.sql_in(chunk)})",
+                "outFields": "FlightID",
+                "returnGeometry": "false",
+                "orderByFields": "OBJECTID",
+                "resultOffset": offset,
+                "token": token
+            })
+            r.raise_for_status()
+            js = r.json()
+            if "error" in js:
+                raise Exception(f"❌ Query failed: {js['error']}")
+            page = js.get("features", [])
+            found.update(f["attributes"]["FlightID"] for f in page)
+            if not page or not js.get("exceededTransferLimit"):
+                break
+            offset += len(page)
+    return found
+
+
+def size_capped_batches(features, max_count, max_bytes):
+    """Consecutive groups of features under both the count and the serialized size cap."""
+    batch, size = [], 2
+    for feat in features:
+        n = len(fastjson.dumpb(feat)) + 1
+        if batch and (len(batch) >= max_count or size + n > max_bytes):
+            yield batch
+            batch, size = [], 2
+        batch.append(feat)
+        size += n
+    if batch:
+        yield batch
+
+
+def build_adds(session, token, user_id, archives, parsed):
+    """New features for the FlightIDs not yet in the layer, and {spk: {"placemarks", "duplicates", "existing", "planned"}}.
+
+    The layer holds one feature per FlightID and SPK, so of several placemarks
+    with the same FlightID only the last is kept; the rest are counted as duplicates.
+    """
+    now = int(time.time() * 1000)
+    summary = defaultdict(lambda: {"placemarks": 0, "duplicates": 0, "existing": 0, "planned": 0})
+    by_spk = defaultdict(dict)
+    for path, spk in archives:
+        if spk and isinstance(parsed.get(path), list):
+            for pm in parsed[path]:
+                if pm[0] in by_spk[spk]:
+                    summary[spk]["duplicates"] += 1
+                    if summary[spk]["duplicates"] == 1:
+                        print(f"⚠️ SPK {spk}: more than one placemark with FlightID {pm[0]} "
+                              f"(e.g. in {os.path.basename(path)}); only the last one is uploaded")
+                by_spk[spk][pm[0]] = pm  # later placemarks and archives win
+
+    adds = []
+    for spk, placemarks in by_spk.items():
+        s = summary[spk]
+        s["placemarks"] = len(placemarks)
+        existing = existing_flight_ids(session, token, spk, placemarks)
+        s["existing"] = len(existing)
+        for fid, (_, height, key_id, rings, _, _) in placemarks.items():
+            if fid in existing:
+                continue
+            attrs = {"FlightID": fid, "SPKNumber": spk, "CRT_Date": now, "Height": height, "UserID": user_id}
+            if key_id:
+                attrs["KeyID"] = key_id
+            adds.append({"attributes": attrs, "geometry": {"rings": rings}})
+            s["planned"] += 1
+    return adds, summary
+
+
+def parse_all(archives, tolerance, precision, mercator, jobs=None):
+    results = {}
+    paths = sorted({path for path, spk in archives if spk})
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(parse_upload_archive, path, tolerance, precision, mercator): path
+                   for path in paths}
+        for fut in as_completed(futures):
+            path = futures[fut]
+            try:
+                results[path] = fut.result()
+            except Exception as e:
+                results[path] = e
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the flights in KML ZIPs as new features")
+    parser.add_argument("zipfile", nargs="?", help="ZIP of KML files, or a folder of ZIPs")
+    parser.add_argument("spk", nargs="?", help="SPKNumber for all these KMLs")
+    parser.add_argument("--manifest", metavar="PATH",
+                        help="CSV (zipfile,spk) or JSON ({zip: spk}) list of ZIPs to upload")
+    parser.add_argument("--simplify", type=float, default=0.0, metavar="METERS",
+                        help="Douglas-Peucker tolerance in meters (default: 0, off)")
+    parser.add_argument("--precision", type=int,
+                        help="decimals kept per coordinate (default: 7 for degrees, 2 for meters)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"max features per applyEdits (default: {BATCH_SIZE})")
+    parser.add_argument("--max-batch-bytes", type=int, default=MAX_BATCH_BYTES,
+                        help=f"max serialized adds per applyEdits (default: {MAX_BATCH_BYTES})")
+    parser.add_argument("--jobs", type=int, help="parse processes (default: CPU count)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the unfinished batches of the last run from its journal")
+    parser.add_argument("--rollback", action="store_true",
+                        help="delete the features added by the last run, from its journal")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    user_id = os.getenv("GIS_USER_ID")
+    if not user_id:
+        print("❌ Please set GIS_USER_ID in your .env")
+        sys.exit(1)
+
+    if args.manifest:
+        archives, source = bulk.read_manifest(args.manifest), args.manifest
+    elif args.zipfile and os.path.isdir(args.zipfile):
+        archives, source = bulk.find_archives(args.zipfile), args.zipfile
+        if args.spk:
+            archives = [(path, args.spk) for path, _ in archives]
+    elif args.zipfile and args.spk:
+        archives, source = [(args.zipfile, args.spk)], args.zipfile
+    else:
+        parser.error("give a ZIP and its SPKNumber, a folder of ZIPs, or --manifest")
+
+    session = InstrumentedSession("upload_kml")
+    journal = Journal(journal_path("upload_kml", user_id, os.path.basename(os.path.normpath(source))))
+    prof = Profiler.from_args("upload_kml", args)
+    prof.start()
+
+    try:
+        with prof.phase("auth"):
+            token, cookie = bulk.get_final_token(session)
+        apply = lambda edits: bulk.apply_edits(session, token, cookie, edits)
+
+        if args.rollback:
+            with prof.phase("edit"):
+                n = rollback(journal, apply)
+            print(f"\n✅ Reverted {n} batches.")
+            return
+
+        if args.resume and journal.exists():
+            print(f"Resuming {len(journal.pending())} of {len(journal.plans)} batches from {journal.path}")
+        else:
+            with prof.phase("fetch"):
+                mercator = layer_wkid(session, token) in WEB_MERCATOR
+            precision = args.precision if args.precision is not None else (2 if mercator else 7)
+            tolerance = args.simplify if mercator else args.simplify / METERS_PER_DEGREE
+
+            with prof.phase("parse"):
+                parsed = parse_all(archives, tolerance, precision, mercator, args.jobs)
+            for path, spk in archives:
+                if not spk:
+                    print(f"❌ {path}: no SPKNumber")
+                elif isinstance(parsed.get(path), Exception):
+                    print(f"❌ {path}: {parsed[path]}")
+            before = sum(pm[4] for res in parsed.values() if isinstance(res, list) for pm in res)
+            after = sum(pm[5] for res in parsed.values() if isinstance(res, list) for pm in res)
+            print(f"Parsed {len(archives)} archives: {before} vertices → {after} after simplify/quantize")
+
+            with prof.phase("plan"):
+                adds, summary = build_adds(session, token, user_id, archives, parsed)
+            for spk in sorted(summary):
+                s = summary[spk]
+                dups = f" ({s['duplicates']} duplicate placemarks dropped)" if s["duplicates"] else ""
+                print(f"SPK {spk}: {s['placemarks']} flights{dups}, {s['existing']} already uploaded, "
+                      f"{s['planned']} to add")
+            if not adds:
+                print("✅ Nothing new to upload.")
+                return
+
+            journal.start("upload_kml", {"source": source, "simplify": args.simplify,
+                                         "precision": precision})
+            for batch in size_capped_batches(adds, args.batch_size, args.max_batch_bytes):
+                journal.plan({"adds": batch})
+            print(f"Planned {len(adds)} features in {len(journal.plans)} applyEdits batches")
+
+        with prof.phase("edit"):
+            run_pending(journal, apply)
+
+        # run_pending stops at the first batch with a rejected add, so every committed add succeeded
+        added = sum(len((res or {}).get("addResults", [])) for res in journal.done.values())
+        print(f"\n✅ {added} features added.")
+
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        prof.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Watch a drop folder and fill NULL Height from every KML ZIP that lands in it.
+
+  python watch_heights.py /srv/drop
+  python watch_heights.py /srv/drop --calculate --workers 2
+
+The SPKNumber of an archive comes from, in order:
+  1. manifest.json ({"archive.zip": "5000012345"}) or manifest.csv
+     (columns zipfile,spk) in the drop folder,
+  2. the sub-folder it was dropped in (drop/5000012345/archive.zip),
+  3. --spk-pattern matched against the file name.
+
+Processed archives move to done/, failures to failed/ next to a
+<name>.error.txt. One session (and its connection pool) and one token are
+kept for the life of the daemon; the token is renewed shortly before it
+expires. Journals are the same as bulk_update_heights.py, so
+`bulk_update_heights.py <zip> <spk> --rollback` works on watched archives too.
+"""
+import os
+import re
+import sys
+import time
+import queue
+import shutil
+import zipfile
+import argparse
+import threading
+import traceback
+
+import bulk_update_heights as bulk
+from bulk_update_heights import DEFAULT_SPK_PATTERN, DONE_DIR, FAILED_DIR, load_manifest, infer_spk
+from http_metrics import InstrumentedSession
+from journal import Journal, journal_path, run_pending
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # optional: wake up on file events instead of waiting out the poll interval
+    INotify = None
+
+# renew the token this long before the server says it expires
+TOKEN_MARGIN_S = 300
+
+
+class TokenKeeper:
+    """The current token/cookie, renewed through get_final_token when close to expiry."""
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.token = self.cookie = None
+        self.expires = 0
+
+    def get(self):
+        with self.lock:
+            if self.token and time.time() < self.expires - TOKEN_MARGIN_S:
+                return self.token, self.cookie
+            if self.token:
+                # force a fresh login rather than reusing the nearly-expired cache entry
+                try:
+                    os.remove(bulk.TOKEN_CACHE_FILE)
+                except FileNotFoundError:
+                    pass
+            self.token, self.cookie = bulk.get_final_token(self.session)
+            cached = bulk.load_token_from_cache() or {}
+            # without a cache entry, assume the 60 minute expiration we ask for
+            self.expires = cached.get("expires", (time.time() + 3600) * 1000) / 1000
+            return self.token, self.cookie
+
+
+def scan(root):
+    """(path, size, mtime) of every ZIP in root and its direct sub-folders."""
+    found = []
+    for entry in os.scandir(root):
+        if entry.is_dir() and entry.name not in (DONE_DIR, FAILED_DIR):
+            found.extend(_zips(entry.path))
+    found.extend(_zips(root))
+    return found
+
+
+def _zips(folder):
+    out = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.lower().endswith(".zip"):
+            st = entry.stat()
+            out.append((entry.path, st.st_size, st.st_mtime))
+    return out
+
+
+def move_to(root, path, sub, note=None):
+    """Move path under root/sub, keeping its SPK sub-folder; returns the new path."""
+    rel = os.path.relpath(path, root)
+    dest = os.path.join(root, sub, rel)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.exists(dest):
+        stem, ext = os.path.splitext(dest)
+        dest = f"{stem}.{int(time.time())}{ext}"
+    shutil.move(path, dest)
+    if note:
+        with open(os.path.splitext(dest)[0] + ".error.txt", "w") as f:
+            f.write(note)
+    return dest
+
+
+class Watcher:
+    def __init__(self, root, session, calculate=False, spk_pattern=DEFAULT_SPK_PATTERN,
+                 settle=5.0, workers=1):
+        self.root = root
+        self.session = session
+        self.tokens = TokenKeeper(session)
+        self.calculate = calculate
+        self.pattern = re.compile(spk_pattern)
+        self.settle = settle
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.seen = {}        # path → (size, mtime) at the previous scan
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.stats = {"done": 0, "failed": 0}
+
+    def poll(self):
+        """Queue every ZIP whose size and mtime held still for a full scan and settle period."""
+        try:
+            manifest = load_manifest(self.root)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  Ignoring unreadable manifest: {e}")
+            manifest = {}
+        now = time.time()
+        current = {}
+        for path, size, mtime in scan(self.root):
+            current[path] = (size, mtime)
+            with self.lock:
+                if path in self.queued:
+                    continue
+            if self.seen.get(path) != (size, mtime) or now - mtime < self.settle:
+                continue
+            spk = infer_spk(self.root, path, manifest, self.pattern)
+            with self.lock:
+                self.queued.add(path)
+            self.queue.put((path, spk))
+            print(f"📥 Queued {os.path.relpath(path, self.root)} (SPK {spk or '?'})")
+        self.seen = current
+
+    def process(self, path, spk):
+        name = os.path.relpath(path, self.root)
+        if not spk:
+            raise ValueError("cannot infer SPKNumber from manifest, folder or file name")
+        if not zipfile.is_zipfile(path):
+            raise ValueError("not a ZIP archive")
+
+        token, cookie = self.tokens.get()
+        journal = Journal(journal_path("bulk_update_heights", spk, os.path.basename(path)))
+        apply = bulk.make_apply(self.session, token, cookie, spk)
+        if journal.pending() and journal.params.get("zipfile") == path:
+            # interrupted mid-archive by a restart
+            print(f"Resuming {len(journal.pending())} of {len(journal.plans)} batches of {name}")
+            run_pending(journal, apply)
+        else:
+            bulk.process_archive(self.session, token, path, spk, journal, apply,
+                                 calculate=self.calculate)
+
+    def file_away(self, path, sub, note=None):
+        """move_to, logging a failed move instead of taking the worker thread down with it."""
+        try:
+            move_to(self.root, path, sub, note)
+        except Exception as e:
+            # left in place, it is queued again on a later scan
+            print(f"⚠️  Could not move {os.path.relpath(path, self.root)} to {sub}/: {e}")
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, spk = item
+            name = os.path.relpath(path, self.root)
+            start = time.perf_counter()
+            try:
+                self.process(path, spk)
+            except Exception as e:
+                print(f"❌ {name}: {e}")
+                self.file_away(path, FAILED_DIR, f"SPK: {spk}\n\n{traceback.format_exc()}")
+                with self.lock:
+                    self.stats["failed"] += 1
+            else:
+                self.file_away(path, DONE_DIR)
+                with self.lock:
+                    self.stats["done"] += 1
+                print(f"✅ {name} done in {time.perf_counter() - start:.1f}s")
+            finally:
+                with self.lock:
+                    self.queued.discard(path)
+                self.session.metrics.write()
+
+    def run(self, interval=2.0, once=False):
+        threads = [threading.Thread(target=self.work, daemon=True) for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        notifier = None
+        if INotify and not once:
+            notifier = INotify()
+            mask = inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+            notifier.add_watch(self.root, mask)
+            for entry in os.scandir(self.root):
+                if entry.is_dir() and entry.name not in (DONE_DIR, FAILED_DIR):
+                    notifier.add_watch(entry.path, mask)
+
+        try:
+            self.poll()
+            while True:
+                if notifier:
+                    # events only shorten the wait; scan() still decides what is ready
+                    notifier.read(timeout=int(interval * 1000))
+                else:
+                    time.sleep(interval)
+                self.poll()
+                if once and not self.seen:
+                    # every archive has been moved to done/ or failed/
+                    break
+        finally:
+            for _ in threads:
+                self.queue.put(None)
+            for t in threads:
+                t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Watch a folder and bulk-update Height from every KML ZIP dropped into it"
+    )
+    parser.add_argument("folder", help="drop folder to watch")
+    parser.add_argument("--calculate", action="store_true",
+                        help="set Height server-side with calculate (see bulk_update_heights.py)")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="seconds between folder scans (default: 2)")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="seconds a ZIP must stay unchanged before it is picked up (default: 5)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="archives processed in parallel (default: 1)")
+    parser.add_argument("--spk-pattern", default=DEFAULT_SPK_PATTERN,
+                        help="regex with an 'spk' group matched against file names "
+                             "when neither manifest nor sub-folder names the SPK")
+    parser.add_argument("--once", action="store_true",
+                        help="process what is in the folder now, then exit")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"❌ Not a folder: {args.folder}")
+        sys.exit(1)
+
+    session = InstrumentedSession("watch_heights")
+    watcher = Watcher(args.folder, session, calculate=args.calculate, spk_pattern=args.spk_pattern,
+                      settle=args.settle, workers=max(1, args.workers))
+    mode = "inotify" if INotify and not args.once else f"polling every {args.interval:g}s"
+    print(f"👀 Watching {args.folder} ({mode}); done/ and failed/ hold processed archives")
+
+    try:
+        watcher.tokens.get()
+        watcher.run(interval=args.interval, once=args.once)
+    except KeyboardInterrupt:
+        print("\nStopping …")
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        session.metrics.write()
+        print(f"✅ {watcher.stats['done']} archive(s) done, {watcher.stats['failed']} failed.")
+
+
+if __name__ == "__main__":
+    main()